@@ -0,0 +1,164 @@
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+# Grayscale thumbnail and color grid sizes (width, height) of the frame descriptor.
+THUMBNAIL_SIZE = (32, 18)
+COLOR_GRID_SIZE = (8, 6)
+DESCRIPTOR_SIZE = THUMBNAIL_SIZE[0] * THUMBNAIL_SIZE[1] + COLOR_GRID_SIZE[0] * COLOR_GRID_SIZE[1] * 3
+
+
+class ActionMemory:
+    """
+    Remembers which action the VLM chose for a frame and replays it when a
+    near-identical frame comes back under the same instruction, skipping the
+    round trip to the server.
+
+    Frames are reduced to a cheap descriptor (a grayscale thumbnail plus a
+    coarse color grid, normalized so the dot product is cosine similarity).
+    Lookups go through random-hyperplane LSH tables, then the candidates are
+    compared exactly. Actions later marked unsuccessful are never replayed.
+    The least recently used entries are evicted past `max_entries`, and the
+    memory can be saved to and loaded from an .npz file.
+    """
+
+    def __init__(self, path=None, threshold=0.97, max_entries=5000, num_tables=8, num_bits=12, seed=0):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries = {}  # id -> dict(vector, action, instruction, success, hits, last_used)
+        self.next_id = 0
+        self.lookups = 0
+        self.hits = 0
+        self.seconds_saved = 0.0
+        # Running average of a real inference, credited for every hit.
+        self.inference_seconds = None
+
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((num_tables, num_bits, DESCRIPTOR_SIZE)).astype(np.float32)
+        self.bit_weights = 1 << np.arange(num_bits, dtype=np.int64)
+        self.tables = [{} for _ in range(num_tables)]
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    @staticmethod
+    def describe(frame: np.ndarray) -> np.ndarray:
+        """Compact, normalized descriptor of a BGR frame."""
+        gray = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        color = cv2.resize(frame, COLOR_GRID_SIZE, interpolation=cv2.INTER_AREA)
+        parts = []
+        for part in (gray.astype(np.float32).ravel(), color.astype(np.float32).ravel()):
+            part = part - part.mean()
+            norm = np.linalg.norm(part)
+            parts.append(part / norm if norm > 0 else part)
+        vector = np.concatenate(parts)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _bucket_keys(self, vector: np.ndarray) -> list:
+        """One bucket per table: the signs of the vector's projections on that table's hyperplanes."""
+        bits = (self.planes @ vector) > 0  # (tables, bits)
+        return (bits.astype(np.int64) @ self.bit_weights).tolist()
+
+    def lookup(self, vector: np.ndarray, instruction: str):
+        """Returns (entry_id, action) for the most similar remembered frame above the threshold, or None."""
+        self.lookups += 1
+        start = time.perf_counter()
+        candidates = set()
+        for table, key in zip(self.tables, self._bucket_keys(vector)):
+            candidates.update(table.get(key, ()))
+
+        best_id, best_similarity = None, self.threshold
+        for entry_id in candidates:
+            entry = self.entries[entry_id]
+            if entry["instruction"] != instruction or entry["success"] is False:
+                continue
+            similarity = float(entry["vector"] @ vector)
+            if similarity >= best_similarity:
+                best_id, best_similarity = entry_id, similarity
+
+        if best_id is None:
+            return None
+        entry = self.entries[best_id]
+        entry["hits"] += 1
+        entry["last_used"] = time.time()
+        self.hits += 1
+        if self.inference_seconds is not None:
+            self.seconds_saved += max(self.inference_seconds - (time.perf_counter() - start), 0.0)
+        return best_id, dict(entry["action"])
+
+    def observe_inference(self, seconds: float):
+        """Records how long a real VLM call took, to estimate what hits save."""
+        if self.inference_seconds is None:
+            self.inference_seconds = seconds
+        else:
+            self.inference_seconds = 0.9 * self.inference_seconds + 0.1 * seconds
+
+    def add(self, vector: np.ndarray, instruction: str, action: dict, success=None) -> int:
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = {
+            "vector": vector.astype(np.float32),
+            "action": action,
+            "instruction": instruction,
+            "success": success,
+            "hits": 0,
+            "last_used": time.time(),
+        }
+        for table, key in zip(self.tables, self._bucket_keys(vector)):
+            table.setdefault(key, set()).add(entry_id)
+
+        while len(self.entries) > self.max_entries:
+            self._remove(min(self.entries, key=lambda i: self.entries[i]["last_used"]))
+        return entry_id
+
+    def mark(self, entry_id: int, success: bool):
+        """Records whether the action stored (or replayed) as `entry_id` worked."""
+        entry = self.entries.get(entry_id)
+        if entry is not None:
+            entry["success"] = success
+
+    def _remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        for table, key in zip(self.tables, self._bucket_keys(entry["vector"])):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[key]
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        ids = list(self.entries)
+        vectors = np.stack([self.entries[i]["vector"] for i in ids]) if ids else np.zeros((0, DESCRIPTOR_SIZE), np.float32)
+        meta = [{k: v for k, v in self.entries[i].items() if k != "vector"} for i in ids]
+        # Write then rename, so a crash mid-save keeps the previous file.
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, vectors=vectors, meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        data = np.load(path)
+        meta = json.loads(str(data["meta"]))
+        if data["vectors"].shape[1:] != (DESCRIPTOR_SIZE,):
+            print(f"Ignoring action memory {path}: descriptor size changed")
+            return
+        for vector, entry in zip(data["vectors"], meta):
+            entry_id = self.add(vector, entry["instruction"], entry["action"], entry["success"])
+            self.entries[entry_id].update(hits=entry["hits"], last_used=entry["last_used"])
+        print(f"Loaded {len(self.entries)} remembered actions from {path}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "seconds_saved": round(self.seconds_saved, 2),
+        }
@@ -2,10 +2,19 @@ import time
 import traceback
 import json
 import re
+from contextlib import contextmanager
 from perception import ScreenCapture
 from controller import Controller
 from model import VLM, RemoteVLM
+from action_memory import ActionMemory
+from plans import ActionPlan
+from local_policy import ApproachPolicy, TargetTracker
+from profiling import StageClock, run_profile
+from tracing import StepTrace, TraceWriter
+from speech import Speaker
 import os
+import queue
+import threading
 
 PERSONAS = {
     "1": {
@@ -14,6 +23,8 @@ PERSONAS = {
     },
     "2": {
         "name": "Banana Finder",
+        # Spotting one object doesn't need the 7B model.
+        "model": "qwen2-vl-2b",
         "instruction": "Scan the screen for bananas. If you see a banana, use the 'say' action with the exact message: 'BANANA FOUND, DAN LOOK THERE IS A BANNA HERE LOOK DAN LOOK BANANA!'. If you don't see one, use 'move_mouse' to look around or 'wait'."
     },
     "3": {
@@ -26,22 +37,103 @@ PERSONAS = {
     }
 }
 
+# Actions expected to change the next frame; if it stays the same, the
+# remembered action is marked as failed and not replayed again.
+SCENE_CHANGING_ACTIONS = {"press_key", "move_mouse", "click", "plan"}
+UNCHANGED_SIMILARITY = 0.995
+
+# Pipelined mode (AGENT_PIPELINE=1): whether a newer decision cuts the running
+# action (a key hold or a wait) short. "changed" lets a decision that repeats
+# the running action (same type, key and button) wait for it to finish.
+def _action_kind(action_data: dict) -> tuple:
+    if action_data.get("type") == "plan":
+        action_data = action_data["steps"][0]
+    return action_data.get("type"), action_data.get("key"), action_data.get("button")
+
+PREEMPT_POLICIES = {
+    "never": lambda running, newer: False,
+    "always": lambda running, newer: True,
+    "changed": lambda running, newer: _action_kind(newer) != _action_kind(running),
+}
+PIPELINE_CAPTURE_FPS = float(os.environ.get("PIPELINE_CAPTURE_FPS", 10))
+PIPELINE_REPORT_SECONDS = float(os.environ.get("PIPELINE_REPORT_SECONDS", 10))
+
+def put_latest(q: queue.Queue, item):
+    """Puts into a one-slot queue, replacing what the consumer has not taken yet."""
+    try:
+        q.get_nowait()
+    except queue.Empty:
+        pass
+    q.put_nowait(item)
+
+ACTIONS_HELP = (
+    "Available actions:\n"
+    "- {\"type\": \"press_key\", \"key\": \"<key>\", \"duration\": <float>} (keys: w, a, s, d, space, f, etc.)\n"
+    "- {\"type\": \"move_mouse\", \"x\": <int>, \"y\": <int>} (x, y are relative offsets in pixels. Positive x is right, negative is left.)\n"
+    "- {\"type\": \"click\", \"button\": \"left\"| \"right\"}\n"
+    "- {\"type\": \"wait\", \"duration\": <float>}\n"
+    "- {\"type\": \"say\", \"message\": \"<text>\"} (Use this to speak to the user, e.g., to report findings or offer help. "
+    "Add \"urgent\": true only for a warning that must cut off whatever is being said.)\n\n"
+)
+
+# Hierarchical mode (AGENT_HIERARCHY=1): the VLM picks sub-goals as fast as it
+# can (at most every HIERARCHY_PLANNER_INTERVAL seconds) and the local policy
+# steers toward the sub-goal's target LOCAL_POLICY_HZ times per second.
+HIERARCHY_PLANNER_INTERVAL = float(os.environ.get("HIERARCHY_PLANNER_INTERVAL", 0))
+LOCAL_POLICY_HZ = float(os.environ.get("LOCAL_POLICY_HZ", 20))
+FORWARD_KEY = os.environ.get("FORWARD_KEY", "w")
+
 class Agent:
-    def __init__(self, dummy_model=False, remote_url=None):
-        self.perception = ScreenCapture()
-        self.controller = Controller()
+    def __init__(self, dummy_model=False, remote_url=None, perception=None, controller=None, vlm=None, speech=None,
+                 memory_path=None, trace_path=None):
+        # The capture, input, model and speech parts can be passed in (the
+        # orchestrator does, to run several agents in one process).
+        self.perception = perception or ScreenCapture()
+        # INPUT_EXECUTOR=1 runs key holds, mouse moves and clicks on a background
+        # schedule: they return at once and overlap (hold w while turning).
+        self.controller = controller or Controller(concurrent=os.environ.get("INPUT_EXECUTOR") == "1")
+        # Speech runs in the background; SPEECH_BACKEND picks the TTS command.
+        self.speech = speech or Speaker()
         
-        if remote_url:
-            self.vlm = RemoteVLM(server_url=remote_url)
+        if vlm is not None:
+            self.vlm = vlm
+        elif remote_url:
+            # VLM_SESSION=1 keeps the conversation on the server between steps.
+            self.vlm = RemoteVLM(server_url=remote_url, session=os.environ.get("VLM_SESSION") == "1")
         else:
             self.vlm = VLM(dummy=dummy_model)
+
+        # ACTION_MEMORY=<file.npz> (or `memory_path`) replays remembered actions for
+        # near-identical frames instead of asking the VLM again; the memory persists there.
+        memory_path = memory_path or os.environ.get("ACTION_MEMORY")
+        self.memory = ActionMemory(
+            path=memory_path,
+            threshold=float(os.environ.get("ACTION_MEMORY_THRESHOLD", 0.97)),
+        ) if memory_path else None
+        self.last_parse_ok = True
+        # Whether the last parse needed the regex fallback, and where the last
+        # action came from ("vlm" or "memory").
+        self.last_parse_fallback = False
+        self.last_source = None
+
+        # Wall-clock time per loop stage (capture, reason, act); read by profiles.
+        self.clock = StageClock()
+        # AGENT_TRACE=<file.jsonl> (or `trace_path`) writes a structured record per step (see tracing.py).
+        trace_path = trace_path or os.environ.get("AGENT_TRACE")
+        self.tracer = TraceWriter(trace_path) if trace_path else None
             
         self.running = False
+        # The action the pipelined actuation stage is executing, if any.
+        self.current_action = None
+        # Remaining steps of the last multi-step decision, and how far decisions go.
+        self.plan = None
+        self.plan_stats = {"inferences": 0, "actions": 0, "plans": 0, "invalidated": {}}
 
-    def execute_action(self, action_data: dict):
+    def execute_action(self, action_data: dict, interrupt: threading.Event = None):
         """
         Executes the action specified in the dictionary.
         Expected keys: "type", and type-specific params.
+        Key holds and waits end early once `interrupt` is set.
         """
         action_type = action_data.get("type")
         
@@ -49,7 +141,7 @@ class Agent:
             key = action_data.get("key")
             duration = action_data.get("duration", 0.1)
             print(f"Executing: Press '{key}' for {duration}s")
-            self.controller.press_key(key, duration)
+            self.controller.press_key(key, duration, interrupt)
             
         elif action_type == "move_mouse":
             x = action_data.get("x", 0)
@@ -68,13 +160,18 @@ class Agent:
         elif action_type == "wait":
             duration = action_data.get("duration", 1.0)
             print(f"Executing: Wait for {duration}s")
-            time.sleep(duration)
+            if interrupt is not None:
+                interrupt.wait(duration)
+            else:
+                time.sleep(duration)
 
         elif action_type == "say":
             message = action_data.get("message", "")
             print(f"Agent says: {message}")
-            # Use macOS 'say' command for TTS
-            os.system(f'say "{message}"')
+            # Messages queue behind the one being spoken; only an urgent one cuts it off.
+            # Repeats within the dedup window are skipped.
+            if not self.speech.say(message, interrupt=action_data.get("urgent") is True):
+                print("(already said recently)")
             
         else:
             print(f"Unknown action type: {action_type}")
@@ -82,20 +179,180 @@ class Agent:
     def parse_json_response(self, response: str) -> dict:
         """
         Attempts to extract and parse JSON from the VLM response.
+        A list of actions, or {"steps": [...], "valid_for": <seconds>}, comes
+        back as a single {"type": "plan", "steps": [...], "valid_for": ...}.
         """
+        self.last_parse_ok = True
+        self.last_parse_fallback = False
         try:
             # fast path: if it's pure JSON
-            return json.loads(response)
+            parsed = json.loads(response)
         except json.JSONDecodeError:
-            # slow path: look for markdown code blocks or just braces
-            match = re.search(r'\{.*\}', response, re.DOTALL)
-            if match:
+            self.last_parse_fallback = True
+            parsed = None
+            # slow path: look for an object, then a list, in surrounding prose.
+            # Trying the object first keeps bracketed prose ("[thinking]") from
+            # swallowing it; a list of several actions only parses as a list.
+            for pattern in (r'\{.*\}', r'\[.*\]'):
+                match = re.search(pattern, response, re.DOTALL)
+                if not match:
+                    continue
                 try:
-                    return json.loads(match.group(0))
-                except:
+                    parsed = json.loads(match.group(0))
+                    break
+                except json.JSONDecodeError:
                     pass
-            print(f"Failed to parse JSON from: {response}")
-            return {"type": "wait"}
+
+        if isinstance(parsed, dict) and isinstance(parsed.get("steps"), list):
+            steps, valid_for = parsed["steps"], parsed.get("valid_for")
+        elif isinstance(parsed, list):
+            steps, valid_for = parsed, None
+        elif isinstance(parsed, dict):
+            return parsed
+        else:
+            steps = []
+
+        steps = [step for step in steps if isinstance(step, dict)]
+        if len(steps) == 1:
+            return steps[0]
+        if steps:
+            return {"type": "plan", "steps": steps, "valid_for": valid_for}
+        print(f"Failed to parse JSON from: {response}")
+        self.last_parse_ok = False
+        return {"type": "wait"}
+
+    def act_from_memory_or_vlm(self, frame, prompt: str, pending):
+        """
+        Returns (action, pending) for a frame, replaying a remembered action
+        when the memory has a near-identical frame. `pending` is the previous
+        step's (entry_id, descriptor, action type), judged by how this frame
+        differs from the one it was taken on.
+        """
+        vector = self.memory.describe(frame)
+        if pending is not None:
+            entry_id, previous_vector, action_type = pending
+            if action_type in SCENE_CHANGING_ACTIONS:
+                # An action that should move something but left the frame as it was did not work.
+                self.memory.mark(entry_id, float(previous_vector @ vector) < UNCHANGED_SIMILARITY)
+
+        hit = self.memory.lookup(vector, prompt)
+        self.last_source = "memory" if hit is not None else "vlm"
+        if hit is not None:
+            entry_id, action_data = hit
+            print(f"\n[Action memory] Replaying: {action_data}\n")
+        else:
+            start = time.perf_counter()
+            response = self.vlm.predict(frame, prompt)
+            self.memory.observe_inference(time.perf_counter() - start)
+            print(f"\n[VLM Response]: {response}\n")
+            action_data = self.parse_json_response(response)
+            if not self.last_parse_ok:
+                return action_data, None
+            entry_id = self.memory.add(
+                vector, prompt, action_data,
+                success=None if action_data.get("type") in SCENE_CHANGING_ACTIONS else True,
+            )
+        return action_data, (entry_id, vector, action_data.get("type"))
+
+    @contextmanager
+    def timed(self, name: str, trace: StepTrace = None):
+        """Times a loop stage into the stage clock and, when tracing, the step's trace."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - start
+            self.clock.add(name, seconds)
+            if trace is not None:
+                trace.add(name, seconds, start)
+
+    def trace_inference(self, trace: StepTrace, response: str = None):
+        """Adds the VLM client's breakdown of the last call (whichever parts it measured) to a step's trace."""
+        timings = getattr(self.vlm, "last_timings", None) or {}
+        for name in ("queue", "encode", "upload", "server", "generate"):
+            if name in timings:
+                trace.add(name, timings[name])
+        trace.set(
+            request_bytes=timings.get("request_bytes"),
+            response_bytes=timings.get("response_bytes", len(response.encode()) if response is not None else None),
+            server_stages=timings.get("server_stages"),
+        )
+
+    def start_profile(self, seconds: float, output_dir: str = "profiles"):
+        """Profiles the running loop for `seconds` in the background and prints where the results went."""
+        def profile():
+            result = run_profile(seconds, output_dir, self.clock.snapshot)
+            print(f"[Profile] {result['samples']} samples over {result['seconds']}s -> {result['files']['stacks']}")
+            for name, stage in result["stages"].items():
+                print(f"[Profile]   {name}: {stage['count']}x, mean {stage['mean'] * 1000:.1f} ms")
+
+        threading.Thread(target=profile, name="agent-profile", daemon=True).start()
+
+    def action_prompt(self, instruction: str) -> str:
+        return (
+            f"You are an AI agent playing a game. Your goal is: {instruction}.\n"
+            + ACTIONS_HELP +
+            "Look at the screenshot. Respond ONLY with a valid JSON object representing the best next action.\n"
+            "To chain several actions (e.g. walking somewhere), respond instead with "
+            "{\"steps\": [<action>, ...], \"valid_for\": <float>}: the steps run in order for at most "
+            "valid_for seconds and stop early if the scene changes a lot."
+        )
+
+    def start_plan(self, action_data: dict, frame) -> dict:
+        """Counts a fresh decision and returns its first action, keeping the rest of a plan for later steps."""
+        self.plan_stats["inferences"] += 1
+        self.plan = None
+        self.replace_inputs(action_data)
+        if action_data.get("type") != "plan":
+            return action_data
+        self.plan_stats["plans"] += 1
+        plan = ActionPlan(action_data["steps"], action_data.get("valid_for"), frame)
+        first = plan.next_step()
+        if plan.remaining:
+            self.plan = plan
+        return first
+
+    def wait_for_inputs(self, action_data: dict, interrupt: threading.Event = None):
+        """
+        With an input executor, execute_action only queues the inputs. Waits
+        until they have been sent, so the next step (or frame) comes after them.
+        """
+        if self.controller.executor is None:
+            return
+        action_type = action_data.get("type")
+        if action_type == "press_key":
+            seconds = action_data.get("duration", 0.1)
+        elif action_type == "move_mouse":
+            seconds = 0.1  # execute_action moves over the controller's default duration
+        else:
+            return
+        if interrupt is not None:
+            interrupt.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def replace_inputs(self, action_data: dict):
+        """A new decision overrides inputs still scheduled from the previous one; keys it presses again stay down."""
+        steps = action_data["steps"] if action_data.get("type") == "plan" else [action_data]
+        self.controller.cancel_inputs(keep={step.get("key") for step in steps if step.get("type") == "press_key"})
+
+    def next_plan_step(self, frame):
+        """The plan's next action for this frame, or None when there is no valid plan left."""
+        reason = self.plan.invalidation(frame)
+        if reason is None and self.plan.remaining:
+            return self.plan.next_step()
+        if reason is not None:
+            invalidated = self.plan_stats["invalidated"]
+            invalidated[reason] = invalidated.get(reason, 0) + 1
+            print(f"[Plan] Dropped {self.plan.remaining} step(s): {reason}")
+        self.plan = None
+        return None
+
+    def report_plans(self):
+        stats = self.plan_stats
+        per_inference = stats["actions"] / stats["inferences"] if stats["inferences"] else 0.0
+        print(f"[Plan] {per_inference:.2f} actions per inference ({stats['actions']} actions, "
+              f"{stats['inferences']} inferences, {stats['plans']} plans, invalidated {stats['invalidated']})")
 
     def run(self, instruction: str = "Explore the world", debug_mode: bool = False):
         self.running = True
@@ -106,59 +363,87 @@ class Agent:
             print("Press Ctrl+C to stop or move mouse to corner (failsafe).")
         
         # Define prompts
-        action_prompt = (
-            f"You are an AI agent playing a game. Your goal is: {instruction}.\n"
-            "Available actions:\n"
-            "- {\"type\": \"press_key\", \"key\": \"<key>\", \"duration\": <float>} (keys: w, a, s, d, space, f, etc.)\n"
-            "- {\"type\": \"move_mouse\", \"x\": <int>, \"y\": <int>} (x, y are relative offsets in pixels. Positive x is right, negative is left.)\n"
-            "- {\"type\": \"click\", \"button\": \"left\"| \"right\"}\n"
-            "- {\"type\": \"wait\", \"duration\": <float>}\n"
-            "- {\"type\": \"say\", \"message\": \"<text>\"} (Use this to speak to the user, e.g., to report findings or offer help.)\n\n"
-            "Look at the screenshot. Respond ONLY with a valid JSON object representing the best next action."
-        )
+        action_prompt = self.action_prompt(instruction)
         
         debug_prompt = (
             f"You are an AI agent observing a screen. Your goal is: {instruction}.\\n"
             "Describe what you see in the screenshot. Then explain what you would do next."
         )
 
+        pending = None
+        steps = 0
         try:
             while self.running:
+                trace = StepTrace(steps) if self.tracer is not None else None
                 # 1. Perceive
-                frame = self.perception.capture()
-                
+                with self.timed("capture", trace):
+                    frame = self.perception.capture()
+                steps += 1
+
+                if not debug_mode:
+                    # 2. Reason (or recall), unless a valid plan still has steps for this frame
+                    action_data = self.next_plan_step(frame) if self.plan is not None else None
+                    source = "plan"
+                    if action_data is None:
+                        if self.memory is not None:
+                            with self.timed("reason", trace):
+                                action_data, pending = self.act_from_memory_or_vlm(frame, action_prompt, pending)
+                            source = self.last_source
+                            response = None
+                        else:
+                            with self.timed("reason", trace):
+                                response = self.vlm.predict(frame, action_prompt)
+                            print(f"\n[VLM Response]: {response}\n")
+                            with self.timed("parse", trace):
+                                action_data = self.parse_json_response(response)
+                            source = "vlm"
+                        if trace is not None and source == "vlm":
+                            self.trace_inference(trace, response)
+                            trace.set(parse_ok=self.last_parse_ok, parse_fallback=self.last_parse_fallback)
+                        action_data = self.start_plan(action_data, frame)
+
+                    # 3. Act
+                    with self.timed("act", trace):
+                        self.execute_action(action_data)
+                        self.wait_for_inputs(action_data)
+                    self.plan_stats["actions"] += 1
+                    if trace is not None:
+                        trace.set(source=source, action=action_data, frame_bytes=frame.nbytes)
+                        self.tracer.write(trace.record)
+                    if steps % 50 == 0:
+                        self.report_plans()
+                        if self.memory is not None:
+                            print(f"[Action memory] {self.memory.stats()}")
+                            self.memory.save()
+                    continue
+
                 # 2. Reason
-                prompt = debug_prompt if debug_mode else action_prompt
-                response = self.vlm.predict(frame, prompt)
+                with self.clock.stage("reason"):
+                    response = self.vlm.predict(frame, debug_prompt)
                 
                 print(f"\n[VLM Response]: {response}\n")
                 
-                if not debug_mode:
-                    # 3. Act
-                    action_data = self.parse_json_response(response)
-                    self.execute_action(action_data)
-                else:
-                    # In debug mode, we still want to allow 'say' actions if they are explicitly returned
-                    # But usually debug mode returns natural language. 
-                    # However, if the VLM decides to output JSON in debug mode (which it might if instructed), we should handle it.
-                    # OR, we can check if the response contains the specific banana phrase and say it manually.
+                # In debug mode, we still want to allow 'say' actions if they are explicitly returned
+                # But usually debug mode returns natural language. 
+                # However, if the VLM decides to output JSON in debug mode (which it might if instructed), we should handle it.
+                # OR, we can check if the response contains the specific banana phrase and say it manually.
+                
+                # Better approach: Try to parse JSON. If it's a 'say' action, execute it.
+                try:
+                    possible_action = self.parse_json_response(response)
+                    if possible_action.get("type") == "say":
+                        self.execute_action(possible_action)
+                except:
+                    pass
+
+                # Fallback: If the model mentions the specific phrase in text (but not JSON), say it anyway.
+                # This handles the case where the debug prompt causes the model to just describe the action.
+                target_phrase = "BANANA FOUND, DAN LOOK THERE IS A BANNA HERE LOOK DAN LOOK BANANA!"
+                if "BANANA FOUND, DAN LOOK" in response.upper() and target_phrase not in str(possible_action if 'possible_action' in locals() else ""):
+                     self.execute_action({"type": "say", "message": target_phrase})
                     
-                    # Better approach: Try to parse JSON. If it's a 'say' action, execute it.
-                    try:
-                        possible_action = self.parse_json_response(response)
-                        if possible_action.get("type") == "say":
-                            self.execute_action(possible_action)
-                    except:
-                        pass
-
-                    # Fallback: If the model mentions the specific phrase in text (but not JSON), say it anyway.
-                    # This handles the case where the debug prompt causes the model to just describe the action.
-                    target_phrase = "BANANA FOUND, DAN LOOK THERE IS A BANNA HERE LOOK DAN LOOK BANANA!"
-                    if "BANANA FOUND, DAN LOOK" in response.upper() and target_phrase not in str(possible_action if 'possible_action' in locals() else ""):
-                         self.execute_action({"type": "say", "message": target_phrase})
-                        
-                    # Wait longer in debug mode to let user read
-                    time.sleep(5)
+                # Wait longer in debug mode to let user read
+                time.sleep(5)
                 
         except KeyboardInterrupt:
             print("Agent stopped by user.")
@@ -167,6 +452,289 @@ class Agent:
             traceback.print_exc()
         finally:
             self.running = False
+            self.controller.cancel_inputs()
+            if not debug_mode:
+                self.report_plans()
+            if self.tracer is not None:
+                self.tracer.close()
+                print(f"[Trace] {self.tracer.written} steps written to {self.tracer.path}, {self.tracer.dropped} dropped")
+            if self.memory is not None:
+                print(f"[Action memory] {self.memory.stats()}")
+                self.memory.save()
+
+    def start_stage(self, target) -> threading.Thread:
+        """Runs `target` on a daemon thread; an error there stops the agent."""
+        def loop():
+            try:
+                target()
+            except Exception as e:
+                print(f"Error in {threading.current_thread().name}: {e}")
+                traceback.print_exc()
+                self.running = False
+        thread = threading.Thread(target=loop, name=f"agent-{target.__name__}", daemon=True)
+        thread.start()
+        return thread
+
+    def run_pipelined(self, instruction: str = "Explore the world", preempt: str = "changed"):
+        """
+        Runs capture, inference and actuation as concurrent stages, so the
+        next decision is requested while the current action still executes.
+        Stages hand over through one-slot queues that keep only the newest
+        frame and decision. `preempt` names the PREEMPT_POLICIES entry that
+        decides whether a newer decision cuts the running action short.
+        Step rate and the gap between one action ending and the next
+        starting are printed every PIPELINE_REPORT_SECONDS.
+        """
+        should_preempt = PREEMPT_POLICIES[preempt]
+        prompt = self.action_prompt(instruction)
+        frames = queue.Queue(maxsize=1)
+        decisions = queue.Queue(maxsize=1)
+        # Guards handing a decision to the actuator against preempting it:
+        # a decision only interrupts the action that was running when it arrived.
+        handoff = threading.Condition()
+        interrupt = threading.Event()
+        stats = {"decisions": 0, "actions": 0, "preempted": 0, "gap": 0.0}
+
+        self.running = True
+        print(f"Agent started (pipelined, preempt={preempt}) with instruction: {instruction}")
+        print("Press Ctrl+C to stop or move mouse to corner (failsafe).")
+
+        def capture():
+            perception = self.perception.copy()
+            interval = 1.0 / PIPELINE_CAPTURE_FPS
+            while self.running:
+                start = time.perf_counter()
+                with self.clock.stage("capture"):
+                    frame = perception.capture()
+                put_latest(frames, frame)
+                time.sleep(max(interval - (time.perf_counter() - start), 0.0))
+
+        def reason():
+            pending = None
+            while self.running:
+                try:
+                    frame = frames.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                with self.clock.stage("reason"):
+                    if self.memory is not None:
+                        action_data, pending = self.act_from_memory_or_vlm(frame, prompt, pending)
+                    else:
+                        response = self.vlm.predict(frame, prompt)
+                        print(f"\n[VLM Response]: {response}\n")
+                        action_data = self.parse_json_response(response)
+                with handoff:
+                    stats["decisions"] += 1
+                    put_latest(decisions, action_data)
+                    if self.current_action is not None and should_preempt(self.current_action, action_data):
+                        interrupt.set()
+                    handoff.notify()
+
+        def report(elapsed: float):
+            actions = stats["actions"]
+            print(
+                f"[Pipeline] {actions / elapsed:.2f} actions/s, {stats['decisions'] / elapsed:.2f} decisions/s, "
+                f"mean gap {stats['gap'] / actions * 1000 if actions else 0.0:.0f} ms, "
+                f"{stats['preempted']} preempted, {stats['decisions'] - actions} superseded"
+            )
+
+        threads = [self.start_stage(capture), self.start_stage(reason)]
+
+        start = last_report = time.perf_counter()
+        last_action_end = None
+        try:
+            while self.running:
+                with handoff:
+                    if decisions.empty():
+                        handoff.wait(0.5)
+                    try:
+                        action_data = decisions.get_nowait()
+                    except queue.Empty:
+                        action_data = None
+                    else:
+                        interrupt.clear()
+
+                # A plan's steps run until they end, expire or a newer decision preempts them.
+                if action_data is not None:
+                    self.plan_stats["inferences"] += 1
+                    self.replace_inputs(action_data)
+                    if action_data.get("type") == "plan":
+                        self.plan_stats["plans"] += 1
+                        plan = ActionPlan(action_data["steps"], action_data.get("valid_for"))
+                    else:
+                        plan = ActionPlan([action_data])
+                    while plan.remaining and self.running:
+                        with handoff:
+                            if interrupt.is_set():
+                                break
+                            if plan.expired():
+                                invalidated = self.plan_stats["invalidated"]
+                                invalidated["timeout"] = invalidated.get("timeout", 0) + 1
+                                break
+                            step = plan.next_step()
+                            self.current_action = step
+
+                        action_start = time.perf_counter()
+                        if last_action_end is not None:
+                            stats["gap"] += action_start - last_action_end
+                            self.clock.add("gap", action_start - last_action_end)
+                        with self.clock.stage("act"):
+                            self.execute_action(step, interrupt)
+                            self.wait_for_inputs(step, interrupt)
+                        if interrupt.is_set():
+                            stats["preempted"] += 1
+                        stats["actions"] += 1
+                        self.plan_stats["actions"] += 1
+                        last_action_end = time.perf_counter()
+                        if self.memory is not None and stats["actions"] % 50 == 0:
+                            print(f"[Action memory] {self.memory.stats()}")
+                            self.memory.save()
+                    with handoff:
+                        self.current_action = None
+
+                now = time.perf_counter()
+                if now - last_report >= PIPELINE_REPORT_SECONDS:
+                    report(now - start)
+                    last_report = now
+
+        except KeyboardInterrupt:
+            print("Agent stopped by user.")
+        except Exception as e:
+            print(f"Error: {e}")
+            traceback.print_exc()
+        finally:
+            self.running = False
+            self.controller.cancel_inputs()
+            for thread in threads:
+                thread.join(timeout=5)
+            report(max(time.perf_counter() - start, 1e-9))
+            self.report_plans()
+            if self.memory is not None:
+                print(f"[Action memory] {self.memory.stats()}")
+                self.memory.save()
+
+    def subgoal_prompt(self, instruction: str) -> str:
+        return (
+            f"You are an AI agent playing a game. Your goal is: {instruction}.\n"
+            "Look at the screenshot and pick the next sub-goal. If it is about an object on screen, respond ONLY with "
+            "{\"goal\": \"<short sub-goal>\", \"target\": [x1, y1, x2, y2], \"approach\": true|false}, where target is "
+            "the object's box in 0-1000 screenshot coordinates and approach says whether to walk to it "
+            "(false keeps it centered without walking).\n"
+            "Otherwise respond ONLY with {\"goal\": \"<short sub-goal>\", \"action\": <action>}.\n"
+            + ACTIONS_HELP
+        )
+
+    def start_subgoal(self, frame, goal: dict):
+        """Returns the local policy for a planner decision, or None after executing its direct action."""
+        target = goal.get("target")
+        if isinstance(target, list) and len(target) == 4 and all(isinstance(v, (int, float)) for v in target):
+            # A new sub-goal overrides the last one's inputs; walking may carry on.
+            self.controller.cancel_inputs(keep={FORWARD_KEY})
+            print(f"[Sub-goal] {goal.get('goal', '')} -> target {target}")
+            return ApproachPolicy(TargetTracker(frame, target), approach=goal.get("approach", True) is not False)
+
+        self.controller.cancel_inputs()
+        action_data = goal.get("action", goal)
+        if not isinstance(action_data, dict):
+            action_data = {"type": "wait"}
+        elif action_data.get("type") == "plan":
+            # Sub-goals are re-planned continuously, so only the first step matters.
+            action_data = action_data["steps"][0]
+        print(f"[Sub-goal] {goal.get('goal', '')} -> {action_data}")
+        # Waits would stall the fast loop; without a policy the agent holds still anyway.
+        if action_data.get("type") != "wait":
+            self.execute_action(action_data)
+        return None
+
+    def run_hierarchical(self, instruction: str = "Explore the world"):
+        """
+        Two-tier control. A planner thread asks the VLM for a sub-goal and a
+        target box as often as the VLM allows; the main thread runs the local
+        ApproachPolicy at LOCAL_POLICY_HZ on fresh frames, turning the camera
+        toward the target and walking to it through the input executor.
+        Each tier's rate and latency are printed every PIPELINE_REPORT_SECONDS.
+        """
+        if self.controller.executor is None:
+            # The policy steers every few tens of milliseconds and must not block on holds.
+            self.controller.executor = self.controller.make_executor()
+        prompt = self.subgoal_prompt(instruction)
+        goals = queue.Queue(maxsize=1)
+        tiers = {"planner": {"count": 0, "seconds": 0.0}, "policy": {"count": 0, "seconds": 0.0, "found": 0}}
+
+        self.running = True
+        print(f"Agent started (hierarchical, policy at {LOCAL_POLICY_HZ:g} Hz) with instruction: {instruction}")
+        print("Press Ctrl+C to stop or move mouse to corner (failsafe).")
+
+        def planner():
+            perception = self.perception.copy()
+            while self.running:
+                start = time.perf_counter()
+                frame = perception.capture()
+                with self.clock.stage("plan"):
+                    response = self.vlm.predict(frame, prompt)
+                print(f"\n[VLM Response]: {response}\n")
+                # The target box refers to this frame, so it travels with the goal.
+                put_latest(goals, (frame, self.parse_json_response(response)))
+                elapsed = time.perf_counter() - start
+                tiers["planner"]["count"] += 1
+                tiers["planner"]["seconds"] += elapsed
+                time.sleep(max(HIERARCHY_PLANNER_INTERVAL - elapsed, 0.0))
+
+        def report(elapsed: float):
+            line = []
+            for name, tier in tiers.items():
+                mean = tier["seconds"] / tier["count"] * 1000 if tier["count"] else 0.0
+                line.append(f"{name} {tier['count'] / elapsed:.2f}/s, mean {mean:.0f} ms")
+            policy = tiers["policy"]
+            found = policy["found"] / policy["count"] if policy["count"] else 0.0
+            print(f"[Hierarchy] {' | '.join(line)}, target found {found:.0%}")
+
+        thread = self.start_stage(planner)
+        interval = 1.0 / LOCAL_POLICY_HZ
+        policy = None
+        start = last_report = time.perf_counter()
+        try:
+            while self.running:
+                tick = time.perf_counter()
+                try:
+                    goal_frame, goal = goals.get_nowait()
+                except queue.Empty:
+                    pass
+                else:
+                    policy = self.start_subgoal(goal_frame, goal)
+
+                if policy is not None:
+                    with self.clock.stage("policy"):
+                        move = policy.act(self.perception.capture())
+                        if move["turn"]:
+                            self.controller.move_mouse(move["turn"], 0, duration=interval)
+                        if move["forward"]:
+                            # Re-holding only moves the release, so the key stays down between ticks.
+                            self.controller.press_key(FORWARD_KEY, 2 * interval)
+                    tiers["policy"]["count"] += 1
+                    tiers["policy"]["seconds"] += time.perf_counter() - tick
+                    tiers["policy"]["found"] += move["found"]
+                    if move["reached"]:
+                        print("[Sub-goal] Target reached")
+                        policy = None
+
+                now = time.perf_counter()
+                if now - last_report >= PIPELINE_REPORT_SECONDS:
+                    report(now - start)
+                    last_report = now
+                time.sleep(max(interval - (time.perf_counter() - tick), 0.0))
+
+        except KeyboardInterrupt:
+            print("Agent stopped by user.")
+        except Exception as e:
+            print(f"Error: {e}")
+            traceback.print_exc()
+        finally:
+            self.running = False
+            self.controller.cancel_inputs()
+            thread.join(timeout=5)
+            report(max(time.perf_counter() - start, 1e-9))
+
 
 if __name__ == "__main__":
     # Default to the known TensorDock server
@@ -189,6 +757,9 @@ if __name__ == "__main__":
         # Debug mode uses remote server but sets debug flag
         url = input(f"Enter Server URL [{DEFAULT_SERVER}]: ").strip() or DEFAULT_SERVER
         agent = Agent(remote_url=url)
+        # Debug descriptions are long and nobody is waiting on them; let
+        # latency-critical clients of the same server go first.
+        agent.vlm.priority = "background"
         debug = True
     else:
         # Default to 1
@@ -201,9 +772,26 @@ if __name__ == "__main__":
     
     p_choice = input("Enter choice (1-4) [1]: ").strip() or "1"
     
+    persona = PERSONAS.get(p_choice, PERSONAS["1"])
     if p_choice == "4":
         instruction = input("Enter custom instruction: ").strip()
     else:
-        instruction = PERSONAS.get(p_choice, PERSONAS["1"])["instruction"]
+        instruction = persona["instruction"]
 
-    agent.run(instruction, debug_mode=debug)
+    # Personas can route to a specific server-side model
+    if isinstance(agent.vlm, RemoteVLM):
+        agent.vlm.model = persona.get("model")
+
+    # AGENT_PROFILE=<seconds> profiles the first seconds of the run into profiles/.
+    if os.environ.get("AGENT_PROFILE"):
+        agent.start_profile(float(os.environ["AGENT_PROFILE"]))
+
+    # AGENT_PIPELINE=1 overlaps capture, inference and actuation; AGENT_PREEMPT
+    # picks whether newer decisions cut running actions short (changed|always|never).
+    # AGENT_HIERARCHY=1 lets the VLM pick sub-goals while a local policy steers.
+    if os.environ.get("AGENT_HIERARCHY") == "1" and not debug:
+        agent.run_hierarchical(instruction)
+    elif os.environ.get("AGENT_PIPELINE") == "1" and not debug:
+        agent.run_pipelined(instruction, preempt=os.environ.get("AGENT_PREEMPT", "changed"))
+    else:
+        agent.run(instruction, debug_mode=debug)
@@ -0,0 +1,393 @@
+"""
+Inference backends behind the server's /predict API.
+
+A backend turns one user turn (Qwen chat `content` items holding PIL images,
+video frame lists and text) into a response dict with at least `action`,
+`input_tokens`, `visual_tokens`, `generated_tokens`, `tokens_per_second`,
+`model` and `timings`. The transformers reference implementation lives in
+server.py next to the model pipeline; OpenAIBackend forwards to any
+OpenAI-compatible chat-completions server (vLLM, SGLang, llama.cpp, ...),
+and ModelHostBackend to a model_host.py process on the same machine.
+"""
+
+import base64
+import io
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from scheduler import DeadlineExceeded, expired
+
+
+class UnsupportedRequest(Exception):
+    """A well-formed request this backend cannot serve, e.g. a session on a stateless backend."""
+
+
+class Backend:
+    """Methods block; call them from worker threads."""
+
+    name = "base"
+
+    def start(self):
+        """Loads models or connects; returns once the backend can serve traffic."""
+
+    def resolve_model(self, name) -> str:
+        """Maps a request's `model` field to a served model name. Raises ValueError."""
+        raise NotImplementedError
+
+    def predict(self, model_name: str, content: list, image_keys: list, timings: dict,
+                speculative=None, priority: str = "normal", deadline=None) -> dict:
+        raise NotImplementedError
+
+    def predict_batch(self, model_name: str, contents: list, image_keys: list, timings: dict,
+                      priority: str = "normal", deadline=None) -> list:
+        """
+        Runs independent turns together and returns one response per turn; an
+        item that failed on its own is {"error": message}. Backends without
+        native batching run the turns one after another.
+        """
+        results = []
+        for content in contents:
+            try:
+                results.append(self.predict(model_name, content, [], dict(timings), priority=priority, deadline=deadline))
+            except Exception as e:
+                results.append({"error": str(e)})
+        return results
+
+    def predict_session(self, model_name: str, session_id: str, content: list, image_keys: list, timings: dict,
+                        followup=None, priority: str = "normal", deadline=None) -> dict:
+        raise UnsupportedRequest(f"Sessions are not supported by the {self.name} backend")
+
+    def end_session(self, session_id: str) -> bool:
+        """Drops a session and frees its KV cache; returns whether it existed."""
+        raise UnsupportedRequest(f"Sessions are not supported by the {self.name} backend")
+
+    def load_model(self, name: str):
+        raise UnsupportedRequest(f"Model management is not supported by the {self.name} backend")
+
+    def unload_model(self, name: str) -> bool:
+        raise UnsupportedRequest(f"Model management is not supported by the {self.name} backend")
+
+    def stats(self) -> dict:
+        return {}
+
+
+@contextmanager
+def _timed(timings: dict, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(timings.get(name, 0.0) + time.perf_counter() - start, 6)
+
+
+def _jpeg_data_url(pil_image, max_pixels=None) -> str:
+    """Encodes an image as a data URL, downscaled to the request's pixel budget to save upload time."""
+    width, height = pil_image.size
+    if max_pixels and width * height > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+        pil_image = pil_image.resize((max(1, int(width * scale)), max(1, int(height * scale))))
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format="JPEG", quality=90)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def to_openai_content(content: list) -> list:
+    """Converts Qwen chat content items to OpenAI message parts; video frames become consecutive images."""
+    parts = []
+    for item in content:
+        if item["type"] == "text":
+            parts.append({"type": "text", "text": item["text"]})
+        elif item["type"] == "image":
+            parts.append({"type": "image_url", "image_url": {"url": _jpeg_data_url(item["image"], item.get("max_pixels"))}})
+        elif item["type"] == "video":
+            for frame in item["video"]:
+                parts.append({"type": "image_url", "image_url": {"url": _jpeg_data_url(frame, item.get("max_pixels"))}})
+        else:
+            raise UnsupportedRequest(f"Unsupported content type {item['type']!r}")
+    return parts
+
+
+class OpenAIBackend(Backend):
+    """
+    Client for an OpenAI-compatible /v1/chat/completions endpoint. Responses
+    are streamed so prefill (time to first token) and decode are timed
+    separately. Priority is left to the remote server's own batching; the
+    deadline bounds the HTTP request and closes the stream once it passes.
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url: str, model: str, api_key: str = "", max_tokens: int = 128,
+                 timeout: float = 60.0, stage=None, observe=None, scheduler=None):
+        """
+        stage(timings, name) is a context manager timing a request stage;
+        observe(timings, start, first_token_time, end, input_tokens,
+        visual_tokens, new_tokens) records generation metrics and returns
+        decode tokens per second. Both default to local timing only.
+        `scheduler`, if given, gets the started/dropped/aborted counts.
+        """
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.stage = stage or _timed
+        self.observe = observe
+        self.scheduler = scheduler
+        self.requests = 0
+        self.failures = 0
+        # One pooled session, so requests reuse keep-alive connections.
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def start(self, poll_interval: float = 2.0):
+        """Waits until the remote server answers /models."""
+        import requests
+
+        while True:
+            try:
+                response = self.session.get(f"{self.base_url}/models", timeout=5)
+                response.raise_for_status()
+                return
+            except requests.RequestException as e:
+                print(f"Waiting for {self.base_url}: {e}")
+                time.sleep(poll_interval)
+
+    def resolve_model(self, name) -> str:
+        return name or self.model
+
+    def predict(self, model_name: str, content: list, image_keys: list, timings: dict,
+                speculative=None, priority: str = "normal", deadline=None) -> dict:
+        import requests
+
+        with self.stage(timings, "encode"):
+            payload = {
+                "model": model_name,
+                "messages": [{"role": "user", "content": to_openai_content(content)}],
+                "max_tokens": self.max_tokens,
+                "temperature": 0,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            }
+
+        timeout = self.timeout
+        if deadline is not None:
+            if expired(deadline):
+                self._record("dropped", priority)
+                raise DeadlineExceeded("Deadline passed before the request started")
+            timeout = min(timeout, deadline - time.time())
+
+        self._record("started", priority)
+        self.requests += 1
+        chunks, usage = [], None
+        first_token_time = None
+        start = time.perf_counter()
+        try:
+            with self.session.post(f"{self.base_url}/chat/completions", json=payload,
+                                   stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if expired(deadline):
+                        # Closing the stream makes the remote server abort the request.
+                        self._record("aborted", priority)
+                        raise DeadlineExceeded("Deadline passed during generation")
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    event = json.loads(data)
+                    usage = event.get("usage") or usage
+                    for choice in event.get("choices", []):
+                        text = (choice.get("delta") or {}).get("content")
+                        if text:
+                            if first_token_time is None:
+                                first_token_time = time.perf_counter()
+                            chunks.append(text)
+        except DeadlineExceeded:
+            raise
+        except requests.Timeout:
+            if deadline is not None and expired(deadline):
+                self._record("aborted", priority)
+                raise DeadlineExceeded("Deadline passed during generation")
+            self.failures += 1
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+        end = time.perf_counter()
+
+        # Without usage reporting, each streamed chunk is roughly one token.
+        input_tokens = usage.get("prompt_tokens") if usage else None
+        new_tokens = usage.get("completion_tokens", len(chunks)) if usage else len(chunks)
+        first_token_time = first_token_time or end
+        if self.observe is not None:
+            tokens_per_second = self.observe(
+                timings, start, first_token_time, end, input_tokens, None, new_tokens
+            )
+        else:
+            timings["prefill"] = round(first_token_time - start, 6)
+            timings["decode"] = round(end - first_token_time, 6)
+            tokens_per_second = (new_tokens - 1) / timings["decode"] if new_tokens > 1 and timings["decode"] > 0 else 0.0
+
+        return {
+            "action": "".join(chunks),
+            "input_tokens": input_tokens,
+            "visual_tokens": None,
+            "generated_tokens": new_tokens,
+            "tokens_per_second": round(tokens_per_second, 2),
+            "model": model_name,
+            "timings": timings,
+        }
+
+    def predict_batch(self, model_name: str, contents: list, image_keys: list, timings: dict,
+                      priority: str = "normal", deadline=None) -> list:
+        """Sends the turns concurrently, leaving the batching to the remote server."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def run(content):
+            try:
+                return self.predict(model_name, content, [], dict(timings), priority=priority, deadline=deadline)
+            except Exception as e:
+                return {"error": str(e)}
+
+        with ThreadPoolExecutor(max_workers=len(contents) or 1) as pool:
+            return list(pool.map(run, contents))
+
+    def _record(self, event: str, priority: str):
+        if self.scheduler is not None:
+            self.scheduler.record(event, priority)
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "default_model": self.model,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class ModelHostBackend(Backend):
+    """
+    Client for model_host.py, which keeps the transformers backend loaded in
+    its own long-lived process. Calls are pickled over a Unix socket, so the
+    API process can restart without reloading weights. Sessions, model
+    management and the vision cache all live in the host and survive API
+    restarts.
+    """
+
+    name = "host"
+    # Exceptions the host re-raises by name; anything else arrives as RuntimeError.
+    ERRORS = {"ValueError": ValueError, "DeadlineExceeded": DeadlineExceeded, "UnsupportedRequest": UnsupportedRequest}
+
+    def __init__(self, address: str, observe=None):
+        """
+        observe(stage_timings, responses) records host-side stage timings and
+        token counts in the API process's metrics.
+        """
+        self.address = address
+        self.observe = observe
+        self.reconnects = 0
+        self._pool = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        from multiprocessing.connection import Client
+        return Client(self.address, family="AF_UNIX")
+
+    def _call(self, method: str, *args, **kwargs):
+        with self._lock:
+            conn = self._pool.pop() if self._pool else None
+        if conn is not None:
+            try:
+                conn.send((method, args, kwargs))
+            except OSError:
+                # A pooled connection from before a host restart; nothing was sent.
+                conn.close()
+                conn = None
+                self.reconnects += 1
+        if conn is None:
+            conn = self._connect()
+            conn.send((method, args, kwargs))
+
+        try:
+            reply = conn.recv()
+        except (EOFError, OSError):
+            conn.close()
+            raise ConnectionError(f"Model host at {self.address} closed the connection")
+        with self._lock:
+            self._pool.append(conn)
+
+        if reply[0] == "error":
+            _, error_type, message = reply
+            raise self.ERRORS.get(error_type, RuntimeError)(message)
+        return reply[1]
+
+    def _observed(self, timings: dict, responses: list):
+        """Copies the host's stage timings into the caller's `timings` and records them."""
+        host_timings = responses[0].get("timings", {}) if responses else {}
+        stage_timings = {
+            name: seconds - timings.get(name, 0.0)
+            for name, seconds in host_timings.items() if seconds != timings.get(name)
+        }
+        timings.update(host_timings)
+        for response in responses:
+            if "timings" in response:
+                response["timings"] = timings
+        if self.observe is not None:
+            self.observe(stage_timings, responses)
+
+    def start(self, poll_interval: float = 2.0):
+        """Waits until the host has its default model loaded."""
+        while True:
+            try:
+                status = self._call("status")
+            except (OSError, ConnectionError) as e:
+                status = f"unreachable ({e})"
+            if status == "ready":
+                return
+            if status == "failed":
+                raise RuntimeError(f"Model host at {self.address} failed to start")
+            print(f"Waiting for model host: {status}")
+            time.sleep(poll_interval)
+
+    def resolve_model(self, name) -> str:
+        return self._call("resolve_model", name)
+
+    def predict(self, model_name, content, image_keys, timings, speculative=None, priority="normal", deadline=None):
+        response = self._call("predict", model_name, content, image_keys, timings, speculative, priority, deadline)
+        self._observed(timings, [response])
+        return response
+
+    def predict_session(self, model_name, session_id, content, image_keys, timings, followup=None,
+                        priority="normal", deadline=None):
+        response = self._call(
+            "predict_session", model_name, session_id, content, image_keys, timings, followup, priority, deadline
+        )
+        self._observed(timings, [response])
+        return response
+
+    def end_session(self, session_id):
+        return self._call("end_session", session_id)
+
+    def predict_batch(self, model_name, contents, image_keys, timings, priority="normal", deadline=None):
+        responses = self._call("predict_batch", model_name, contents, image_keys, timings, priority, deadline)
+        self._observed(timings, responses)
+        return responses
+
+    def load_model(self, name):
+        return self._call("load_model", name)
+
+    def unload_model(self, name):
+        return self._call("unload_model", name)
+
+    def stats(self) -> dict:
+        return {
+            **self._call("stats"),
+            "host": {"address": self.address, "pooled_connections": len(self._pool), "reconnects": self.reconnects},
+        }
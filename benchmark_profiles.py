@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Compare the server's acceleration profiles (ACCEL_PROFILE) on this machine.
+Each profile runs in its own process, loads the model through server.py's
+loader, warms up, then generates for every image in testing/screenshots/.
+Reports load time, prefill time, decode tokens/s and peak memory, and names
+the fastest profile.
+
+Run on the inference machine, from the server's directory:
+    python benchmark_profiles.py [--profiles default,sdpa,compiled] [--model qwen2-vl-2b] [--repeats 2]
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SCREENSHOTS_DIR = "testing/screenshots"
+INSTRUCTION = (
+    "You are a game-playing AI agent. Analyze this Genshin Impact screenshot "
+    "and describe: 1) What you see in the scene, 2) Character/UI information visible, "
+    "3) What action or objective seems most appropriate next."
+)
+RESULT_PREFIX = "RESULT "
+
+def get_screenshots():
+    extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+    return sorted(p for p in Path(SCREENSHOTS_DIR).glob('*') if p.suffix.lower() in extensions)
+
+def run_profile(model_name: str, repeats: int):
+    """Child process: benchmark the profile in ACCEL_PROFILE and print one result line."""
+    import torch
+    import server
+
+    with server.registry.acquire(model_name) as entry:
+        load_seconds = sum(server.registry.load_timings[model_name].values())
+        if torch.cuda.is_available():
+            for device in range(torch.cuda.device_count()):
+                torch.cuda.reset_peak_memory_stats(device)
+
+        prefill, decode_rates, latencies, new_tokens = [], [], [], []
+        for _ in range(repeats):
+            for path in get_screenshots():
+                pil_image = server.decode_image(path.read_bytes(), server.MAX_PIXELS)
+                content = [
+                    {"type": "image", "image": pil_image, "min_pixels": server.MIN_PIXELS, "max_pixels": server.MAX_PIXELS},
+                    {"type": "text", "text": INSTRUCTION},
+                ]
+                start = time.perf_counter()
+                response = server.generate_response(entry, content, [], {})
+                latencies.append(time.perf_counter() - start)
+                prefill.append(response["timings"]["prefill"])
+                new_tokens.append(response["generated_tokens"])
+                if response["tokens_per_second"]:
+                    decode_rates.append(response["tokens_per_second"])
+
+    if torch.cuda.is_available():
+        peak_bytes = sum(torch.cuda.max_memory_allocated(d) for d in range(torch.cuda.device_count()))
+    else:
+        # ru_maxrss is KB on Linux.
+        peak_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    print(RESULT_PREFIX + json.dumps({
+        "load_seconds": round(load_seconds, 1),
+        "requests": len(latencies),
+        "mean_latency": statistics.mean(latencies),
+        "mean_prefill": statistics.mean(prefill),
+        "median_prefill": statistics.median(prefill),
+        "tokens_per_second": statistics.mean(decode_rates) if decode_rates else 0.0,
+        "mean_new_tokens": statistics.mean(new_tokens),
+        "peak_memory_gb": peak_bytes / 1024 ** 3,
+    }), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ACCEL_PROFILE settings")
+    parser.add_argument("--profiles", help="comma-separated profiles (default: all that fit this machine)")
+    parser.add_argument("--model", default=None, help="registry model name (default: the server's default)")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--run-profile", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_profile:
+        run_profile(args.model, args.repeats)
+        return
+
+    import torch
+    from server import ACCEL_PROFILES, DEFAULT_MODEL
+
+    model_name = args.model or DEFAULT_MODEL
+    if args.profiles:
+        profiles = args.profiles.split(",")
+    else:
+        on_gpu = torch.cuda.is_available()
+        profiles = [name for name, profile in ACCEL_PROFILES.items() if (profile.get("device_map") != "cpu") == on_gpu]
+
+    screenshots = get_screenshots()
+    if not screenshots:
+        print(f"❌ No screenshots found in {SCREENSHOTS_DIR}")
+        sys.exit(1)
+
+    print("=" * 70)
+    print("ACCELERATION PROFILE BENCHMARK")
+    print("=" * 70)
+    print(f"Model: {model_name}")
+    print(f"Profiles: {', '.join(profiles)}")
+    print(f"{len(screenshots)} screenshot(s), {args.repeats} repeat(s) each")
+
+    results = {}
+    for profile in profiles:
+        print(f"\n▶ {profile}...")
+        # Vision cache off so repeats measure the encoder every time.
+        env = dict(os.environ, ACCEL_PROFILE=profile, VISION_CACHE_MB="0", BACKEND="transformers")
+        child = subprocess.run(
+            [sys.executable, __file__, "--run-profile", profile, "--model", model_name, "--repeats", str(args.repeats)],
+            env=env, capture_output=True, text=True,
+        )
+        lines = [line for line in child.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+        if child.returncode != 0 or not lines:
+            error = (child.stderr.strip().splitlines() or ["no output"])[-1]
+            print(f"  ✗ failed: {error}")
+            results[profile] = None
+            continue
+        results[profile] = json.loads(lines[-1][len(RESULT_PREFIX):])
+        r = results[profile]
+        print(f"  ✓ prefill {r['mean_prefill']:.3f}s, {r['tokens_per_second']:.1f} tok/s, "
+              f"peak {r['peak_memory_gb']:.2f} GB")
+
+    print(f"\n{'='*70}")
+    print(f"{'Profile':<12} {'Load s':>8} {'Prefill s':>10} {'p50 s':>8} {'Tok/s':>8} {'Latency s':>10} {'Peak GB':>8}")
+    print(f"{'-'*70}")
+    for profile, r in results.items():
+        if r is None:
+            print(f"{profile:<12} {'failed':>8}")
+            continue
+        print(f"{profile:<12} {r['load_seconds']:>8.1f} {r['mean_prefill']:>10.3f} {r['median_prefill']:>8.3f} "
+              f"{r['tokens_per_second']:>8.1f} {r['mean_latency']:>10.2f} {r['peak_memory_gb']:>8.2f}")
+
+    finished = {profile: r for profile, r in results.items() if r is not None}
+    if finished:
+        fastest = min(finished, key=lambda profile: finished[profile]["mean_latency"])
+        print(f"{'='*70}")
+        print(f"Fastest: {fastest} (ACCEL_PROFILE={fastest})")
+    print(f"{'='*70}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark speculative decoding against plain generate on the screenshot set.
+Sends every image in testing/screenshots/ to the server with speculative
+decoding off and on, and compares latency, decode speed and acceptance rate.
+
+The server must be started with DRAFT_MODEL set and the result cache off, e.g.:
+    DRAFT_MODEL=qwen2-vl-2b RESULT_CACHE_TTL=0 python server.py
+Usage: python benchmark_speculative.py [server_url] [repeats]
+"""
+
+import sys
+import time
+import statistics
+from pathlib import Path
+
+import requests
+
+from test_batch_screenshots import SCREENSHOTS_DIR, SERVER_URL, get_screenshots
+
+INSTRUCTION = (
+    "You are a game-playing AI agent. Analyze this Genshin Impact screenshot "
+    "and describe: 1) What you see in the scene, 2) Character/UI information visible, "
+    "3) What action or objective seems most appropriate next."
+)
+
+def run_once(server_url: str, image_path: Path, speculative: bool) -> dict:
+    """Sends one screenshot and returns the server's response plus round-trip time."""
+    with open(image_path, "rb") as f:
+        files = {"image": (image_path.name, f.read(), "image/jpeg")}
+    data = {"instruction": INSTRUCTION, "speculative": str(speculative).lower()}
+
+    start = time.perf_counter()
+    response = requests.post(f"{server_url}/predict", files=files, data=data, timeout=300)
+    response.raise_for_status()
+    result = response.json()
+    result["round_trip"] = time.perf_counter() - start
+    return result
+
+def summarize(label: str, results: list):
+    decode_rates = [r["tokens_per_second"] for r in results if r["tokens_per_second"]]
+    print(f"\n{label}")
+    print(f"{'-'*70}")
+    print(f"Requests:            {len(results)}")
+    print(f"Mean round trip:     {statistics.mean(r['round_trip'] for r in results):.2f}s")
+    print(f"Mean prefill:        {statistics.mean(r['timings']['prefill'] for r in results):.3f}s")
+    print(f"Mean decode:         {statistics.mean(r['timings']['decode'] for r in results):.3f}s")
+    print(f"Mean tokens/s:       {statistics.mean(decode_rates) if decode_rates else 0.0:.1f}")
+    print(f"Mean new tokens:     {statistics.mean(r['generated_tokens'] for r in results):.1f}")
+
+    speculative = [r for r in results if r.get("speculative")]
+    if speculative:
+        accepted = sum(r["speculative"]["accepted_tokens"] for r in speculative)
+        proposed = sum(r["speculative"]["proposed_tokens"] for r in speculative)
+        print(f"Acceptance rate:     {accepted / proposed if proposed else 0.0:.1%}")
+        print(f"Tokens per step:     {statistics.mean(r['generated_tokens'] / r['speculative']['steps'] for r in speculative):.2f}")
+
+def main():
+    server_url = sys.argv[1] if len(sys.argv) > 1 else SERVER_URL
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    print("=" * 70)
+    print("SPECULATIVE DECODING BENCHMARK")
+    print("=" * 70)
+    print(f"Server: {server_url}")
+    print(f"Screenshots directory: {SCREENSHOTS_DIR}")
+
+    screenshots = get_screenshots()
+    print(f"Found {len(screenshots)} screenshot(s), {repeats} repeat(s) each")
+
+    # One untimed pass so both modes see loaded models and a warm vision cache.
+    print("\nWarming up...")
+    for screenshot in screenshots:
+        run_once(server_url, screenshot, speculative=True)
+
+    plain, assisted = [], []
+    for i in range(repeats):
+        for screenshot in screenshots:
+            # Alternate modes per image so drift affects both equally.
+            plain.append(run_once(server_url, screenshot, speculative=False))
+            assisted.append(run_once(server_url, screenshot, speculative=True))
+            print(f"  [{i + 1}/{repeats}] {screenshot.name}: "
+                  f"plain {plain[-1]['round_trip']:.2f}s, speculative {assisted[-1]['round_trip']:.2f}s")
+
+    if not any(r.get("speculative") for r in assisted):
+        print("\n⚠️  Server did not use a draft model; start it with DRAFT_MODEL set.")
+
+    summarize("PLAIN GENERATE", plain)
+    summarize("SPECULATIVE (ASSISTED) GENERATE", assisted)
+
+    speedup = statistics.mean(r["round_trip"] for r in plain) / statistics.mean(r["round_trip"] for r in assisted)
+    print(f"\n{'='*70}")
+    print(f"Speedup: {speedup:.2f}x")
+    print(f"{'='*70}")
+
+if __name__ == "__main__":
+    main()
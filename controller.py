@@ -1,29 +1,58 @@
 import pyautogui
+import heapq
+import itertools
+import threading
 import time
 import random
+from contextlib import nullcontext
 from typing import Literal
 
 # Fail-safe: moving mouse to corner will throw exception
 pyautogui.FAILSAFE = True
 
 class Controller:
-    def __init__(self):
-        pass
+    def __init__(self, concurrent: bool = False):
+        # With `concurrent`, key presses, mouse moves and clicks are handed to
+        # an InputExecutor and return immediately instead of blocking.
+        self.executor = self.make_executor() if concurrent else None
+
+    def make_executor(self) -> "InputExecutor":
+        """Creates the executor that concurrent inputs go through."""
+        return InputExecutor()
 
     def move_mouse(self, x_offset: int, y_offset: int, duration: float = 0.1):
         """Moves mouse relative to current position by (x_offset, y_offset)."""
+        if self.executor is not None:
+            self.executor.move(x_offset, y_offset, duration)
+            return
         pyautogui.move(x_offset, y_offset, duration=duration)
 
     def click(self, button: Literal['left', 'right', 'middle'] = 'left'):
         """Clicks the specified mouse button."""
+        if self.executor is not None:
+            self.executor.click(button)
+            return
         pyautogui.click(button=button)
 
-    def press_key(self, key: str, duration: float = 0.1):
-        """Presses a key for a specific duration."""
+    def press_key(self, key: str, duration: float = 0.1, interrupt=None):
+        """Presses a key for a specific duration, or until `interrupt` (a threading.Event) is set."""
+        if self.executor is not None:
+            self.executor.hold(key, duration)
+            return
         pyautogui.keyDown(key)
-        time.sleep(duration)
-        pyautogui.keyUp(key)
+        try:
+            if interrupt is not None:
+                interrupt.wait(duration)
+            else:
+                time.sleep(duration)
+        finally:
+            pyautogui.keyUp(key)
         
+    def cancel_inputs(self, keep=()):
+        """Drops scheduled inputs and releases held keys other than `keep` (concurrent mode only)."""
+        if self.executor is not None:
+            self.executor.cancel(keep)
+
     def type_text(self, text: str):
         """Types text."""
         pyautogui.write(text)
@@ -32,6 +61,139 @@ class Controller:
         """Scrolls the mouse wheel."""
         pyautogui.scroll(clicks)
 
+def release(key: str):
+    """Releases a key even after the failsafe fired; it only guards new input."""
+    try:
+        pyautogui.keyUp(key, _pause=False)
+    except pyautogui.FailSafeException:
+        failsafe, pyautogui.FAILSAFE = pyautogui.FAILSAFE, False
+        try:
+            pyautogui.keyUp(key, _pause=False)
+        finally:
+            pyautogui.FAILSAFE = failsafe
+
+class InputExecutor:
+    """
+    Runs inputs on its own thread from a time-ordered schedule, so callers
+    return immediately and holds can overlap: `w` can stay down while the
+    mouse turns, and several keys form a chord. Each key has one release
+    time; holding a key that is already down moves its release instead of
+    pressing it again. `cancel` drops everything not yet executed so a new
+    decision can replace it.
+
+    `dispatch`, if given, returns a context manager that the executor thread
+    enters around every batch of inputs it sends, e.g. to focus the target
+    window and hold a shared input lock.
+    """
+
+    # Mouse moves are split into steps this far apart.
+    MOVE_INTERVAL = 1 / 60
+
+    def __init__(self, dispatch=None):
+        self.dispatch = dispatch or nullcontext
+        self._events = []  # heap of (due, seq, kind, args)
+        self._seq = itertools.count()
+        self._release_at = {}  # held key -> monotonic release time
+        self._cond = threading.Condition()
+        # Set when the failsafe fired on this thread; re-raised to the next caller.
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name="input-executor", daemon=True)
+        self._thread.start()
+
+    def _schedule(self, delay: float, kind: str, *args):
+        if self.error is not None:
+            raise self.error
+        heapq.heappush(self._events, (time.monotonic() + delay, next(self._seq), kind, args))
+
+    def hold(self, key: str, duration: float = 0.1, delay: float = 0.0):
+        """Holds `key` for `duration` seconds, starting in `delay` seconds."""
+        with self._cond:
+            self._schedule(delay, "hold", key, duration)
+            self._cond.notify()
+
+    def chord(self, keys: list, duration: float = 0.1, delay: float = 0.0):
+        """Holds several keys together."""
+        with self._cond:
+            for key in keys:
+                self._schedule(delay, "hold", key, duration)
+            self._cond.notify()
+
+    def move(self, x_offset: int, y_offset: int, duration: float = 0.1, delay: float = 0.0):
+        """Moves the mouse by (x_offset, y_offset), spread evenly over `duration` seconds."""
+        steps = max(1, int(duration / self.MOVE_INTERVAL))
+        with self._cond:
+            done_x = done_y = 0
+            for i in range(1, steps + 1):
+                # Rounded cumulative targets, so the steps add up to the exact offset.
+                x, y = round(x_offset * i / steps), round(y_offset * i / steps)
+                self._schedule(delay + duration * (i - 1) / steps, "move", x - done_x, y - done_y)
+                done_x, done_y = x, y
+            self._cond.notify()
+
+    def click(self, button: str = "left", delay: float = 0.0):
+        with self._cond:
+            self._schedule(delay, "click", button)
+            self._cond.notify()
+
+    def cancel(self, keep=()):
+        """
+        Drops every input not yet executed and releases held keys, except
+        the keys in `keep`, which stay down until their scheduled release.
+        """
+        with self._cond:
+            self._events.clear()
+            released = [key for key in self._release_at if key not in keep]
+            if released:
+                # Through dispatch like every other input, so it reaches the right window.
+                with self.dispatch():
+                    for key in released:
+                        del self._release_at[key]
+                        release(key)
+            self._cond.notify()
+
+    def held_keys(self) -> set:
+        with self._cond:
+            return set(self._release_at)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due = [t for t in (self._events[0][0] if self._events else None,
+                                   min(self._release_at.values(), default=None)) if t is not None]
+                if not due or min(due) > now:
+                    self._cond.wait(min(due) - now if due else None)
+                    continue
+
+                try:
+                    with self.dispatch():
+                        self._execute_due(now)
+                except pyautogui.FailSafeException as e:
+                    print(f"Input executor stopped: {e}")
+                    self.error = e
+                    self._events.clear()
+                    for key in self._release_at:
+                        release(key)
+                    self._release_at.clear()
+
+    def _execute_due(self, now: float):
+        for key, release_at in list(self._release_at.items()):
+            if release_at <= now:
+                del self._release_at[key]
+                pyautogui.keyUp(key, _pause=False)
+
+        while self._events and self._events[0][0] <= now:
+            _, _, kind, args = heapq.heappop(self._events)
+            if kind == "hold":
+                key, duration = args
+                if key not in self._release_at:
+                    pyautogui.keyDown(key, _pause=False)
+                self._release_at[key] = now + duration
+            elif kind == "move":
+                pyautogui.move(*args, _pause=False)
+            elif kind == "click":
+                pyautogui.click(button=args[0], _pause=False)
+
 if __name__ == "__main__":
     # Test controller
     ctrl = Controller()
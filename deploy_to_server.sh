@@ -13,6 +13,9 @@ SERVER_IP="91.150.160.37"
 SSH_PORT="43001"
 SSH_KEY="tensordock_key"
 
+# Python modules the model server needs on the remote host
+SERVER_FILES="server.py vision_cache.py metrics.py singleflight.py model_registry.py sessions.py scheduler.py backends.py supervisor.py model_host.py profiling.py benchmark_profiles.py"
+
 echo "Server: $SERVER_IP:$SSH_PORT"
 echo ""
 
@@ -20,9 +23,12 @@ echo ""
 echo "[1/4] Testing SSH connection..."
 ssh -i "$SSH_KEY" -p "$SSH_PORT" -o StrictHostKeyChecking=no user@"$SERVER_IP" "echo 'Connection successful!'"
 
-# Copy setup script to server
-echo "[2/4] Copying setup script to server..."
-scp -i "$SSH_KEY" -P "$SSH_PORT" -o StrictHostKeyChecking=no setup_server.sh user@"$SERVER_IP":~/
+# Copy setup script and server code to server
+echo "[2/4] Copying setup script and server code to server..."
+scp -i "$SSH_KEY" -P "$SSH_PORT" -o StrictHostKeyChecking=no setup_server.sh $SERVER_FILES user@"$SERVER_IP":~/
+# benchmark_profiles.py runs on these frames from the server directory
+ssh -i "$SSH_KEY" -p "$SSH_PORT" -o StrictHostKeyChecking=no user@"$SERVER_IP" "mkdir -p ~/lumine-agent/testing"
+scp -i "$SSH_KEY" -P "$SSH_PORT" -o StrictHostKeyChecking=no -r testing/screenshots user@"$SERVER_IP":~/lumine-agent/testing/
 
 # Make setup script executable and run it
 echo "[3/4] Running setup script on server..."
@@ -0,0 +1,135 @@
+import os
+
+import cv2
+import numpy as np
+
+# Frames are tracked at this width; a 1080p frame becomes 320x180.
+TRACK_WIDTH = int(os.environ.get("TRACK_WIDTH", 320))
+# Below this normalized template correlation the target counts as lost.
+TRACK_MIN_SCORE = float(os.environ.get("TRACK_MIN_SCORE", 0.5))
+# Below this hue-histogram correlation a template match is treated as a different object.
+TRACK_MIN_COLOR = float(os.environ.get("TRACK_MIN_COLOR", 0.3))
+# Template scales tried every step, to follow a target that grows as it is approached.
+TRACK_SCALES = (0.9, 1.0, 1.1)
+# Mouse pixels per policy step when the target is at the frame edge, and the
+# centered band (fraction of half the width) in which the policy does not turn.
+TURN_PIXELS = int(os.environ.get("LOCAL_TURN_PIXELS", 60))
+TURN_DEAD_ZONE = 0.05
+# The target counts as reached once it is this wide relative to the frame.
+REACH_WIDTH = float(os.environ.get("LOCAL_REACH_WIDTH", 0.25))
+
+
+def downscale(frame: np.ndarray) -> np.ndarray:
+    scale = TRACK_WIDTH / frame.shape[1]
+    return cv2.resize(frame, (TRACK_WIDTH, max(1, round(frame.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+
+
+def hue_histogram(patch: np.ndarray) -> np.ndarray:
+    hsv = cv2.cvtColor(patch, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 8], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).ravel()
+
+
+class TargetTracker:
+    """
+    Follows one target between planner decisions, cheaply enough to run
+    tens of times per second on a CPU.
+
+    The target box comes from the VLM in 0-1000 coordinates of the frame it
+    saw. Its patch becomes a grayscale template (matched with normalized
+    cross-correlation in a window around the last position, at a few
+    scales) plus a hue/saturation histogram that confirms a match is the
+    same colored object.
+    """
+
+    def __init__(self, frame: np.ndarray, box):
+        small = downscale(frame)
+        height, width = small.shape[:2]
+        x1, y1, x2, y2 = (float(v) / 1000 for v in box)
+        x1, x2 = sorted((int(x1 * width), int(x2 * width)))
+        y1, y2 = sorted((int(y1 * height), int(y2 * height)))
+        # Tiny boxes give meaningless correlations; grow them to 8 px.
+        x2, y2 = max(x2, x1 + 8), max(y2, y1 + 8)
+        x1, y1 = max(0, min(x1, width - 8)), max(0, min(y1, height - 8))
+        patch = small[y1:y2, x1:x2]
+
+        self.template = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+        self.histogram = hue_histogram(patch)
+        self.scale = 1.0
+        self.center = ((x1 + x2) / 2, (y1 + y2) / 2)
+        self.size = (patch.shape[1], patch.shape[0])
+        self.steps = 0
+        self.found = 0
+
+    def step(self, frame: np.ndarray) -> dict:
+        """
+        Locates the target in a new frame. Returns {"found": False} when it
+        is lost, otherwise its offset from the frame center (-1..1 on each
+        axis), its width as a fraction of the frame and the match score.
+        """
+        self.steps += 1
+        small = downscale(frame)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
+
+        # Search three target sizes around the last position.
+        w, h = self.size
+        cx, cy = self.center
+        left, top = max(0, int(cx - 1.5 * w)), max(0, int(cy - 1.5 * h))
+        window = gray[top:min(height, int(cy + 1.5 * h)), left:min(width, int(cx + 1.5 * w))]
+
+        best = None
+        for factor in TRACK_SCALES:
+            scale = self.scale * factor
+            tw, th = max(8, round(self.template.shape[1] * scale)), max(8, round(self.template.shape[0] * scale))
+            if tw > window.shape[1] or th > window.shape[0]:
+                continue
+            result = cv2.matchTemplate(window, cv2.resize(self.template, (tw, th)), cv2.TM_CCOEFF_NORMED)
+            _, score, _, location = cv2.minMaxLoc(result)
+            if best is None or score > best[0]:
+                best = (score, scale, left + location[0], top + location[1], tw, th)
+
+        if best is None or best[0] < TRACK_MIN_SCORE:
+            return {"found": False}
+        score, scale, x, y, tw, th = best
+        color = cv2.compareHist(self.histogram, hue_histogram(small[y:y + th, x:x + tw]), cv2.HISTCMP_CORREL)
+        if color < TRACK_MIN_COLOR:
+            return {"found": False}
+
+        self.found += 1
+        self.scale = scale
+        self.center = (x + tw / 2, y + th / 2)
+        self.size = (tw, th)
+        return {
+            "found": True,
+            "offset_x": (self.center[0] - width / 2) / (width / 2),
+            "offset_y": (self.center[1] - height / 2) / (height / 2),
+            "width": tw / width,
+            "score": round(float(score), 3),
+        }
+
+
+class ApproachPolicy:
+    """
+    Walks toward a tracked target: turns the camera so the target drifts
+    to the frame center and keeps the forward key down until the target is
+    REACH_WIDTH wide. Stops (no turn, no walking) while the target is lost.
+    """
+
+    def __init__(self, tracker: TargetTracker, approach: bool = True):
+        self.tracker = tracker
+        self.approach = approach
+
+    def act(self, frame: np.ndarray) -> dict:
+        """Returns {"found", "reached", "turn" (mouse x pixels), "forward" (bool)} for this frame."""
+        seen = self.tracker.step(frame)
+        if not seen["found"]:
+            return {"found": False, "reached": False, "turn": 0, "forward": False}
+        offset = seen["offset_x"]
+        reached = seen["width"] >= REACH_WIDTH
+        return {
+            "found": True,
+            "reached": reached,
+            "turn": round(offset * TURN_PIXELS) if abs(offset) > TURN_DEAD_ZONE else 0,
+            "forward": self.approach and not reached,
+        }
@@ -0,0 +1,230 @@
+"""
+Lightweight in-process metrics for the inference server.
+
+Counters, gauges and histograms are plain Python objects guarded by a lock,
+so recording a sample costs a dict lookup and a bisect. A registry renders
+everything in the Prometheus text exposition format or as JSON.
+"""
+
+import bisect
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers per-stage timings from sub-millisecond decode steps to slow prefills.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 200)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + sorted((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def to_dict(self):
+        with self._lock:
+            return {_format_labels(key) or "value": value for key, value in self._values.items()}
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn=None):
+        """`fn`, if given, is called at scrape time and returns {labels-tuple: value} or a number."""
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Increments the gauge for the duration of the block."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _current(self) -> dict:
+        if self.fn is not None:
+            value = self.fn()
+            return value if isinstance(value, dict) else {(): value}
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in self._current().items()]
+
+    def to_dict(self):
+        return {_format_labels(key) or "value": value for key, value in self._current().items()}
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall-clock duration of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, series in self._series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    out.append((f"{self.name}_bucket", key, cumulative, {"le": le}))
+                out.append((f"{self.name}_count", key, cumulative))
+                out.append((f"{self.name}_sum", key, series[-1]))
+        return out
+
+    def to_dict(self):
+        result = {}
+        with self._lock:
+            for key, series in self._series.items():
+                count = sum(series[:-1])
+                result[_format_labels(key) or "value"] = {
+                    "count": count,
+                    "sum": series[-1],
+                    "mean": series[-1] / count if count else 0.0,
+                    "p50": self._quantile(series, count, 0.50),
+                    "p95": self._quantile(series, count, 0.95),
+                    "p99": self._quantile(series, count, 0.99),
+                }
+        return result
+
+    def _quantile(self, series, count, q):
+        """Upper bucket bound containing quantile `q`; None when it falls in +Inf."""
+        if not count:
+            return None
+        target = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, series):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return None
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _register(self, metric):
+        metric.name = self.prefix + metric.name
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def gauge(self, name: str, help: str, fn=None) -> Gauge:
+        return self._register(Gauge(name, help, fn))
+
+    def histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample in metric.samples():
+                name, key, value = sample[:3]
+                extra = sample[3] if len(sample) > 3 else None
+                lines.append(f"{name}{_format_labels(key, extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        return {metric.name: metric.to_dict() for metric in self._metrics}
+
+
+def memory_usage() -> dict:
+    """Current process memory by kind, in bytes. Includes CUDA allocator stats when torch has a GPU."""
+    usage = {}
+    try:
+        with open("/proc/self/statm") as f:
+            usage[(("kind", "cpu_rss"),)] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is KB on Linux and bytes on macOS; this is only the peak.
+        usage[(("kind", "cpu_peak_rss"),)] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    try:
+        import torch
+    except ImportError:
+        return usage
+    if torch.cuda.is_available():
+        for device in range(torch.cuda.device_count()):
+            usage[(("device", str(device)), ("kind", "gpu_allocated"))] = torch.cuda.memory_allocated(device)
+            usage[(("device", str(device)), ("kind", "gpu_reserved"))] = torch.cuda.memory_reserved(device)
+            usage[(("device", str(device)), ("kind", "gpu_peak_allocated"))] = torch.cuda.max_memory_allocated(device)
+    return usage
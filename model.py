@@ -1,6 +1,9 @@
 import numpy as np
 from PIL import Image
 import sys
+import time
+import uuid
+from collections import deque
 
 # Lazy imports for heavy libraries
 torch = None
@@ -11,6 +14,8 @@ process_vision_info = None
 class VLM:
     def __init__(self, model_path="Qwen/Qwen2-VL-7B-Instruct", device="auto", load_in_4bit=False, dummy=False):
         self.dummy = dummy
+        # Seconds spent preparing the inputs ("encode") and generating ("generate") in the last predict().
+        self.last_timings = {}
         if self.dummy:
             print("VLM initialized in DUMMY mode. No model loaded.")
             return
@@ -46,6 +51,7 @@ class VLM:
                 return '{"type": "say", "message": "BANANA FOUND, DAN LOOK THERE IS A BANNA HERE LOOK DAN LOOK BANANA!"}'
             return '{"type": "press_key", "key": "w", "duration": 1.0}'
 
+        encode_start = time.perf_counter()
         # Convert numpy (BGR) to PIL (RGB)
         pil_image = Image.fromarray(image[..., ::-1]) # BGR to RGB
 
@@ -77,7 +83,12 @@ class VLM:
         
         inputs = inputs.to(self.model.device)
 
+        generate_start = time.perf_counter()
         generated_ids = self.model.generate(**inputs, max_new_tokens=128)
+        self.last_timings = {
+            "encode": generate_start - encode_start,
+            "generate": time.perf_counter() - generate_start,
+        }
         generated_ids_trimmed = [
             out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
         ]
@@ -87,42 +98,181 @@ class VLM:
         
         return output_text[0]
 
+# Sent instead of the full instruction on later steps of a server-side session.
+SESSION_FOLLOWUP = "Here is the next screenshot. Continue with the same task and respond in the same format."
+
 class RemoteVLM:
-    def __init__(self, server_url="http://localhost:8000"):
+    def __init__(self, server_url="http://localhost:8000", min_pixels=None, max_pixels=None,
+                 clip_frames=0, clip_width=448, model=None, session=False,
+                 priority=None, deadline_seconds=None, http=None):
         self.server_url = server_url
+        # Optional requests.Session shared between clients, so they reuse pooled connections.
+        self.http = http
+        # Name of the server-side model to use; None means the server's default.
+        self.model = model
+        # With session=True the server keeps this client's conversation (and its
+        # KV cache) between calls; repeated instructions are sent once and later
+        # steps only carry the new frame.
+        self.session_id = uuid.uuid4().hex if session else None
+        # Scheduling hints: "realtime", "normal" or "background", and how many
+        # seconds after capture the answer stops being useful. The server skips
+        # or aborts requests past their deadline.
+        self.priority = priority
+        self.deadline_seconds = deadline_seconds
+        # Optional per-request visual token budget; the server default applies when None.
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        # With clip_frames > 0, the previous frames (downscaled to clip_width) are
+        # sent along with the current one through the server's video path.
+        self.clip_frames = clip_frames
+        self.clip_width = clip_width
+        self.recent_frames = deque(maxlen=clip_frames) if clip_frames > 0 else None
+        # Breakdown of the last predict() call: seconds spent encoding, on the
+        # wire ("upload": round trip minus server time) and on the server, plus
+        # the server's own stage timings and the request/response sizes.
+        self.last_timings = {}
         print(f"Initialized RemoteVLM connecting to {self.server_url}")
 
-    def predict(self, image: np.ndarray, instruction: str) -> str:
-        import requests
+    def _encode_jpeg(self, image: np.ndarray, max_width: int) -> bytes:
         import cv2
-        
-        # Encode image to bytes
-        # Resize if too large to save bandwidth? For now, send full.
-        # Actually, let's resize to max 1024px width to be safe on latency
+
         h, w = image.shape[:2]
-        if w > 1024:
-            scale = 1024 / w
-            image = cv2.resize(image, (0, 0), fx=scale, fy=scale)
-            
+        if w > max_width:
+            scale = max_width / w
+            image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
         success, encoded_img = cv2.imencode('.jpg', image)
         if not success:
             raise ValueError("Could not encode image")
-            
-        files = {
-            'image': ('screenshot.jpg', encoded_img.tobytes(), 'image/jpeg')
-        }
+        return encoded_img.tobytes()
+
+    def predict(self, image: np.ndarray, instruction: str) -> str:
+        import requests
+
+        captured_at = time.time()
+        encode_start = time.perf_counter()
+
+        # Resize to max 1024px width to be safe on latency
+        files = [
+            ('image', ('screenshot.jpg', self._encode_jpeg(image, 1024), 'image/jpeg'))
+        ]
         data = {
             'instruction': instruction
         }
-        
+        if self.min_pixels:
+            data['min_pixels'] = self.min_pixels
+        if self.max_pixels:
+            data['max_pixels'] = self.max_pixels
+        if self.model:
+            data['model'] = self.model
+        if self.session_id:
+            data['session_id'] = self.session_id
+            data['session_followup'] = SESSION_FOLLOWUP
+        if self.priority:
+            data['priority'] = self.priority
+        if self.deadline_seconds:
+            # Absolute, so time spent encoding and uploading counts against it.
+            data['deadline'] = captured_at + self.deadline_seconds
+
+        endpoint = "/predict"
+        # Clips go through the stateless clip endpoint; sessions carry their own history.
+        if self.recent_frames is not None and not self.session_id:
+            if self.recent_frames:
+                endpoint = "/predict_clip"
+                files += [
+                    ('frames', (f'frame_{i}.jpg', frame, 'image/jpeg'))
+                    for i, frame in enumerate(self.recent_frames)
+                ]
+            self.recent_frames.append(self._encode_jpeg(image, self.clip_width))
+
+        # Lets a multi-worker front end keep the session on the worker holding its cache.
+        headers = {'X-Session-Id': self.session_id} if self.session_id else None
+
+        request_start = time.perf_counter()
+        self.last_timings = {
+            "encode": request_start - encode_start,
+            "request_bytes": sum(len(file[1]) for _, file in files),
+        }
         try:
-            response = requests.post(f"{self.server_url}/predict", files=files, data=data, timeout=10)
+            response = (self.http or requests).post(f"{self.server_url}{endpoint}", files=files, data=data,
+                                                    headers=headers, timeout=10)
+            round_trip = time.perf_counter() - request_start
             response.raise_for_status()
-            return response.json().get("action", "")
+            body = response.json()
+            server_stages = body.get("timings") or {}
+            server = sum(v for v in server_stages.values() if isinstance(v, (int, float)))
+            self.last_timings.update(
+                upload=max(round_trip - server, 0.0),
+                server=server,
+                server_stages=server_stages,
+                response_bytes=len(response.content),
+            )
+            return body.get("action", "")
         except Exception as e:
             print(f"Remote VLM Error: {e}")
+            self.last_timings["error"] = str(e)
             return "wait" # Default safe action
 
+    def predict_multi(self, image: np.ndarray, instructions: list) -> list:
+        """
+        Asks several instructions about one frame in a single request; returns
+        one answer per instruction. The server encodes the frame's vision
+        features once for all of them, but prefills each instruction's prompt
+        separately (no shared prefix KV cache).
+        """
+        import requests
+
+        files = [('image', ('screenshot.jpg', self._encode_jpeg(image, 1024), 'image/jpeg'))]
+        data = [('instructions', instruction) for instruction in instructions]
+        if self.min_pixels:
+            data.append(('min_pixels', self.min_pixels))
+        if self.max_pixels:
+            data.append(('max_pixels', self.max_pixels))
+        if self.model:
+            data.append(('model', self.model))
+        if self.priority:
+            data.append(('priority', self.priority))
+
+        try:
+            response = (self.http or requests).post(f"{self.server_url}/predict_multi", files=files, data=data, timeout=30)
+            response.raise_for_status()
+            return [answer.get("action", "") for answer in response.json()["answers"]]
+        except Exception as e:
+            print(f"Remote VLM Error: {e}")
+            return ["wait"] * len(instructions)
+
+    def predict_batch(self, images: list, instructions: list, batch_size=None, timeout=600):
+        """
+        Sends many images in one /predict_batch request and yields each
+        result dict (with its `index`) as the server streams it back.
+        `instructions` is one per image, or a single shared one.
+        """
+        import json
+        import requests
+
+        files = [
+            ('images', (f'image_{i}.jpg', self._encode_jpeg(image, 1024), 'image/jpeg'))
+            for i, image in enumerate(images)
+        ]
+        data = [('instructions', instruction) for instruction in instructions]
+        if self.min_pixels:
+            data.append(('min_pixels', self.min_pixels))
+        if self.max_pixels:
+            data.append(('max_pixels', self.max_pixels))
+        if self.model:
+            data.append(('model', self.model))
+        if batch_size:
+            data.append(('batch_size', batch_size))
+
+        with (self.http or requests).post(f"{self.server_url}/predict_batch", files=files, data=data,
+                                          stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    result = json.loads(line)
+                    if not result.get("done"):
+                        yield result
+
 if __name__ == "__main__":
     # Test with dummy
     vlm = VLM(dummy=True)
@@ -0,0 +1,87 @@
+"""
+Long-lived model host.
+
+Loads the transformers backend once and serves it to API processes over a
+Unix socket (multiprocessing.connection, pickled calls). The API layer runs
+with BACKEND=host and can be restarted or redeployed in seconds while the
+weights, vision cache and sessions stay resident here.
+
+    python model_host.py                      # once; keeps the model loaded
+    BACKEND=host python server.py             # restart freely
+
+The socket path comes from MODEL_HOST_SOCKET; it is created mode 0600, so
+only the same user can connect.
+"""
+
+import os
+
+# This process is the transformers backend, whatever the API layer uses.
+os.environ["BACKEND"] = "transformers"
+
+import threading
+import traceback
+from multiprocessing.connection import Listener
+
+import server
+from backends import UnsupportedRequest
+from scheduler import DeadlineExceeded
+
+METHODS = {
+    "status": lambda: server.server_state,
+    "resolve_model": server.backend.resolve_model,
+    "predict": server.backend.predict,
+    "predict_session": server.backend.predict_session,
+    "end_session": server.backend.end_session,
+    "predict_batch": server.backend.predict_batch,
+    "load_model": server.backend.load_model,
+    "unload_model": server.backend.unload_model,
+    "stats": lambda: {**server.backend.stats(), "scheduler": server.scheduler.stats()},
+}
+
+
+def serve(conn):
+    """Answers one API connection's calls until it disconnects."""
+    with conn:
+        while True:
+            try:
+                method, args, kwargs = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", METHODS[method](*args, **kwargs))
+            except (ValueError, DeadlineExceeded, UnsupportedRequest) as e:
+                reply = ("error", type(e).__name__, str(e))
+            except Exception as e:
+                traceback.print_exc()
+                reply = ("error", type(e).__name__, str(e))
+            try:
+                conn.send(reply)
+            except OSError:
+                return
+
+
+def main():
+    socket_path = server.MODEL_HOST_SOCKET
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    old_umask = os.umask(0o177)
+    try:
+        listener = Listener(socket_path, family="AF_UNIX")
+    finally:
+        os.umask(old_umask)
+    print(f"Model host listening on {socket_path}")
+
+    # Accept connections while loading so API processes can report progress.
+    threading.Thread(target=server.start_backend, name="model-loader", daemon=True).start()
+    try:
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=serve, args=(conn,), name="model-host-conn", daemon=True).start()
+    except KeyboardInterrupt:
+        print("Model host stopped")
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Registry of loaded models with on-demand loading and memory-budgeted LRU eviction.
+
+Requests hold a model through `acquire()`. Evicting a model first marks it as
+draining: new requests for it wait, requests already running finish, and
+only then are its weights released.
+"""
+
+import gc
+import glob
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class ModelEntry:
+    def __init__(self, name: str, model_id: str, model, processor, nbytes: int):
+        self.name = name
+        self.model_id = model_id
+        self.model = model
+        self.processor = processor
+        self.nbytes = nbytes
+        self.last_used = time.monotonic()
+        self.in_flight = 0
+        self.draining = False
+        # generate() is not re-entrant on one model, so inference on it is serialized.
+        self.lock = threading.Lock()
+
+
+def model_nbytes(model) -> int:
+    """Bytes held by a model's parameters and buffers."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def estimate_nbytes(model_path: str) -> int:
+    """Pre-load estimate of a model's size from its safetensors shards on disk."""
+    return sum(os.path.getsize(path) for path in glob.glob(os.path.join(model_path, "*.safetensors")))
+
+
+class ModelRegistry:
+    def __init__(self, specs: dict, default: str, memory_budget: int, loader, resolve_path=None,
+                 warmup=None, on_event=None):
+        """
+        specs: model name -> model id.
+        loader(model_path) -> (model, processor); resolve_path(model_id) -> local dir.
+        warmup(entry) runs after a load, before the model takes traffic.
+        on_event(event, name) is called for "load", "hit" and "evict".
+        """
+        if default not in specs:
+            raise ValueError(f"Default model {default!r} is not in {sorted(specs)}")
+        self.specs = specs
+        self.default = default
+        self.memory_budget = memory_budget
+        self.loader = loader
+        self.resolve_path = resolve_path
+        self.warmup = warmup
+        self.on_event = on_event
+        self.counts = {"load": 0, "hit": 0, "evict": 0}
+        self.events = deque(maxlen=50)
+        # Per-model duration of each load phase, from the most recent load.
+        self.load_timings = {}
+        self._entries = {}
+        self._cond = threading.Condition()
+        # Loads and evictions are serialized; two concurrent loads could both
+        # pass the budget check.
+        self._load_lock = threading.Lock()
+
+    def _record(self, event: str, name: str, **details):
+        self.counts[event] += 1
+        self.events.append({"time": time.time(), "event": event, "model": name, **details})
+        if self.on_event is not None:
+            self.on_event(event, name)
+
+    def resolve(self, name) -> str:
+        name = name or self.default
+        if name not in self.specs:
+            raise ValueError(f"Unknown model {name!r}; available: {sorted(self.specs)}")
+        return name
+
+    @contextmanager
+    def acquire(self, name=None, keep=()):
+        """
+        Yields the loaded ModelEntry for `name` (default model if None), loading
+        it if needed. Models in `keep` are never evicted to make room.
+        """
+        with self.acquire_many([name], keep) as (entry,):
+            yield entry
+
+    @contextmanager
+    def acquire_many(self, names, keep=()):
+        """
+        Yields the loaded ModelEntry of every model in `names`, checked out
+        together. A request that needs several models (a model and its draft)
+        must take them here rather than nesting acquire(): holding one model
+        while waiting to load another can deadlock with a request doing the
+        same the other way round, each waiting for the other's model to drain.
+        """
+        names = list(dict.fromkeys(self.resolve(name) for name in names))
+        entries = self._checkout(names, keep)
+        try:
+            yield entries
+        finally:
+            with self._cond:
+                for entry in entries:
+                    entry.in_flight -= 1
+                    entry.last_used = time.monotonic()
+                self._cond.notify_all()
+
+    def _checkout(self, names: list, keep=()) -> list:
+        # Fast path: everything is loaded and none of it is draining.
+        with self._cond:
+            entries = [self._entries.get(name) for name in names]
+            if all(entry is not None and not entry.draining for entry in entries):
+                for entry in entries:
+                    entry.in_flight += 1
+                    entry.last_used = time.monotonic()
+                    self._record("hit", entry.name)
+                return entries
+
+        # Nothing is held while waiting here, so the evictions below can
+        # always drain: models are only held by requests that have all they need.
+        with self._load_lock:
+            entries = []
+            try:
+                for name in names:
+                    entries.append(self._checkout_locked(name, keep={*names, *keep}))
+            except BaseException:
+                with self._cond:
+                    for entry in entries:
+                        entry.in_flight -= 1
+                    self._cond.notify_all()
+                raise
+            return entries
+
+    def _checkout_locked(self, name: str, keep) -> ModelEntry:
+        """Checks out `name`, loading it if needed. Caller holds _load_lock."""
+        with self._cond:
+            entry = self._ready_entry(name)
+            if entry is not None:
+                self._record("hit", name)
+                return entry
+
+        model_id = self.specs[name]
+        timings = self.load_timings[name] = {}
+        with self._phase(timings, "resolve"):
+            model_path = self.resolve_path(model_id) if self.resolve_path else model_id
+        with self._phase(timings, "evict"):
+            needed = estimate_nbytes(model_path) if os.path.isdir(model_path) else 0
+            self._make_room(needed, keep=keep)
+
+        with self._phase(timings, "load"):
+            model, processor = self.loader(model_path)
+        entry = ModelEntry(name, model_id, model, processor, model_nbytes(model))
+        if self.warmup is not None:
+            with self._phase(timings, "warmup"):
+                self.warmup(entry)
+
+        with self._cond:
+            self._entries[name] = entry
+            entry.in_flight += 1
+            self._record("load", name, seconds=round(sum(timings.values()), 3), bytes=entry.nbytes)
+            self._cond.notify_all()
+        return entry
+
+    @contextmanager
+    def _phase(self, timings: dict, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[name] = round(time.perf_counter() - start, 3)
+
+    def _ready_entry(self, name: str):
+        """Returns a checked-out entry if loaded; waits out a drain in progress. Caller holds _cond."""
+        while True:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if not entry.draining:
+                entry.in_flight += 1
+                entry.last_used = time.monotonic()
+                return entry
+            self._cond.wait()
+
+    def _make_room(self, needed: int, keep=()):
+        """Evicts least recently used models until `needed` bytes fit. Caller holds _load_lock."""
+        while True:
+            with self._cond:
+                used = sum(entry.nbytes for entry in self._entries.values())
+                candidates = [entry for name, entry in self._entries.items() if name not in keep]
+                if used + needed <= self.memory_budget or not candidates:
+                    return
+                victim = min(candidates, key=lambda entry: entry.last_used)
+            self._evict(victim)
+
+    def unload(self, name: str) -> bool:
+        """Drains and evicts `name`. Returns False if it was not loaded."""
+        with self._load_lock:
+            with self._cond:
+                entry = self._entries.get(name)
+            if entry is None:
+                return False
+            self._evict(entry)
+            return True
+
+    def _evict(self, entry: ModelEntry):
+        with self._cond:
+            entry.draining = True
+            while entry.in_flight > 0:
+                self._cond.wait()
+            del self._entries[entry.name]
+            self._record("evict", entry.name, bytes=entry.nbytes)
+            self._cond.notify_all()
+
+        entry.model = None
+        entry.processor = None
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def loaded(self) -> list:
+        with self._cond:
+            return list(self._entries)
+
+    def stats(self) -> dict:
+        with self._cond:
+            loaded = {
+                name: {
+                    "model_id": entry.model_id,
+                    "bytes": entry.nbytes,
+                    "in_flight": entry.in_flight,
+                    "draining": entry.draining,
+                    "idle_seconds": round(time.monotonic() - entry.last_used, 1),
+                }
+                for name, entry in self._entries.items()
+            }
+            return {
+                "default": self.default,
+                "available": self.specs,
+                "memory_budget": self.memory_budget,
+                "memory_used": sum(entry.nbytes for entry in self._entries.values()),
+                "loaded": loaded,
+                "counts": dict(self.counts),
+                "load_seconds": {name: dict(timings) for name, timings in self.load_timings.items()},
+                "recent_events": list(self.events),
+            }
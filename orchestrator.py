@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Runs several agents in one process, one per game window or monitor region.
+
+    python orchestrator.py agents.json
+
+agents.json:
+    {
+      "server_url": "http://91.150.160.37:43002",
+      "max_in_flight": 2,
+      "agents": [
+        {"name": "left", "region": {"left": 0, "top": 0, "width": 960, "height": 1080},
+         "focus": [480, 540], "persona": "1"},
+        {"name": "right", "region": {"left": 960, "top": 0, "width": 960, "height": 1080},
+         "focus": [1440, 540], "persona": "2", "mode": "pipelined"},
+        {"name": "second-screen", "monitor": 2, "instruction": "Collect every chest", "model": "qwen2-vl-2b"}
+      ]
+    }
+
+Per agent: "monitor" (mss index, default 1) and "region" (relative to that
+monitor) select what it sees; "focus" is a screen point clicked to focus its
+window before its inputs; "persona" (a key of agent.PERSONAS) or
+"instruction" says what to do; "mode" is run, pipelined or hierarchical;
+"model", "priority", "trace" and "memory" are optional. Hierarchical mode
+drives the keyboard and mouse many times per second, and focusing a window
+takes a click, so it is only allowed for a config's single agent.
+
+Without "trace" or "memory", AGENT_TRACE and ACTION_MEMORY still apply, with
+the agent's name added to the file name (memory.npz becomes
+memory.left.npz), so agents never share a file.
+
+All agents share one pooled HTTP session to the server. At most
+"max_in_flight" requests run at once, and a free slot goes to the waiting
+agent that was served least recently, so a fast agent cannot starve the
+others. Per-agent and aggregate decision rates are printed every
+"report_seconds".
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import pyautogui
+import requests
+from requests.adapters import HTTPAdapter
+
+from agent import Agent, PERSONAS
+from controller import Controller, InputExecutor
+from model import RemoteVLM
+from perception import ScreenCapture
+from speech import Speaker
+
+MODES = ("run", "pipelined", "hierarchical")
+
+
+class FairScheduler:
+    """Admits at most `max_in_flight` requests; a free slot goes to the least recently served waiter."""
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.waiting = {}  # agent name -> monotonic time it started waiting
+        self.last_served = {}
+        self._cond = threading.Condition()
+
+    def _next(self) -> str:
+        return min(self.waiting, key=lambda name: (self.last_served.get(name, 0.0), self.waiting[name]))
+
+    @contextmanager
+    def slot(self, name: str):
+        with self._cond:
+            self.waiting[name] = time.monotonic()
+            while self.in_flight >= self.max_in_flight or self._next() != name:
+                self._cond.wait()
+            del self.waiting[name]
+            self.in_flight += 1
+            self.last_served[name] = time.monotonic()
+            # Whoever is next may fit in a slot that is still free.
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+
+class ScheduledVLM:
+    """Puts one agent's VLM calls through the shared scheduler and counts its decisions."""
+
+    def __init__(self, vlm: RemoteVLM, scheduler: FairScheduler, name: str):
+        self.vlm = vlm
+        self.scheduler = scheduler
+        self.name = name
+        self.decisions = 0
+        self.seconds = 0.0
+        self.waited = 0.0
+        self.last_queue = 0.0
+
+    @property
+    def last_timings(self) -> dict:
+        """The wrapped client's timings of the last call, plus how long it waited for a slot."""
+        return {**(getattr(self.vlm, "last_timings", None) or {}), "queue": self.last_queue}
+
+    def predict(self, image, instruction: str) -> str:
+        start = time.perf_counter()
+        with self.scheduler.slot(self.name):
+            granted = time.perf_counter()
+            response = self.vlm.predict(image, instruction)
+        self.decisions += 1
+        self.last_queue = granted - start
+        self.waited += self.last_queue
+        self.seconds += time.perf_counter() - start
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.vlm, name)
+
+
+class TargetedController(Controller):
+    """
+    Sends an agent's inputs to its own window. All agents share one keyboard
+    and mouse, so inputs are serialized, and the agent's window is focused
+    (clicked at `focus`) whenever input moves over from another agent.
+    Inputs that go through an input executor (concurrent or hierarchical
+    mode) are focused and serialized on the executor thread, when they are
+    actually sent.
+    """
+
+    _lock = threading.RLock()
+    _active = None
+
+    def __init__(self, focus=None):
+        super().__init__()
+        self.focus = focus
+
+    def make_executor(self) -> InputExecutor:
+        return InputExecutor(dispatch=self._targeted)
+
+    @contextmanager
+    def _targeted(self):
+        with TargetedController._lock:
+            if self.focus and TargetedController._active is not self:
+                pyautogui.click(*self.focus)
+            TargetedController._active = self
+            yield
+
+    def _direct(self):
+        # Scheduling only queues the input; holding the lock here as well
+        # would invert the order the executor thread takes the two locks in.
+        return self._targeted() if self.executor is None else nullcontext()
+
+    def move_mouse(self, x_offset: int, y_offset: int, duration: float = 0.1):
+        with self._direct():
+            super().move_mouse(x_offset, y_offset, duration)
+
+    def click(self, button="left"):
+        with self._direct():
+            super().click(button)
+
+    def press_key(self, key: str, duration: float = 0.1, interrupt=None):
+        with self._direct():
+            super().press_key(key, duration, interrupt)
+
+    def type_text(self, text: str):
+        with self._targeted():
+            super().type_text(text)
+
+    def scroll(self, clicks: int):
+        with self._targeted():
+            super().scroll(clicks)
+
+
+def agent_path(spec: dict, key: str, env: str):
+    """spec[key], else the path in `env` made unique to the agent, else None."""
+    if spec.get(key):
+        return spec[key]
+    path = os.environ.get(env)
+    if not path:
+        return None
+    root, ext = os.path.splitext(path)
+    return f"{root}.{spec['name']}{ext}"
+
+
+def run_agent(spec: dict, vlm: ScheduledVLM, speech: Speaker, agents: dict):
+    """Builds and runs one agent on the calling thread (mss captures belong to the thread that opened them)."""
+    persona = PERSONAS.get(str(spec.get("persona", "1")), PERSONAS["1"])
+    agent = Agent(
+        perception=ScreenCapture(spec.get("monitor", 1), spec.get("region")),
+        controller=TargetedController(spec.get("focus")),
+        vlm=vlm,
+        speech=speech,
+        memory_path=agent_path(spec, "memory", "ACTION_MEMORY"),
+        trace_path=agent_path(spec, "trace", "AGENT_TRACE"),
+    )
+    agents[spec["name"]] = agent
+
+    instruction = spec.get("instruction") or persona["instruction"]
+    mode = spec.get("mode", "run")
+    if mode == "pipelined":
+        agent.run_pipelined(instruction, preempt=spec.get("preempt", "changed"))
+    elif mode == "hierarchical":
+        agent.run_hierarchical(instruction)
+    else:
+        agent.run(instruction)
+
+
+def report(vlms: dict, elapsed: float):
+    total = sum(vlm.decisions for vlm in vlms.values())
+    print(f"\n[Orchestrator] {total / elapsed:.2f} decisions/s across {len(vlms)} agents")
+    for name, vlm in vlms.items():
+        mean = vlm.seconds / vlm.decisions * 1000 if vlm.decisions else 0.0
+        waited = vlm.waited / vlm.decisions * 1000 if vlm.decisions else 0.0
+        print(f"[Orchestrator]   {name:<16} {vlm.decisions / elapsed:.2f}/s, {vlm.decisions} decisions, "
+              f"mean {mean:.0f} ms ({waited:.0f} ms waiting for a slot)")
+
+
+def load_config(path: str) -> dict:
+    with open(path) as f:
+        config = json.load(f)
+    specs = config.get("agents") or []
+    if not specs:
+        raise ValueError("The config lists no agents")
+    for i, spec in enumerate(specs):
+        spec.setdefault("name", f"agent-{i}")
+        if spec.get("mode", "run") not in MODES:
+            raise ValueError(f"Agent {spec['name']}: mode must be one of {', '.join(MODES)}")
+        if spec.get("mode") == "hierarchical" and len(specs) > 1:
+            # Agents sharing the input devices would refocus (click) on nearly
+            # every policy tick, and one agent's held keys would reach the other's window.
+            raise ValueError(f"Agent {spec['name']}: hierarchical mode needs the input devices to itself")
+    names = [spec["name"] for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError("Agent names must be unique")
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several agents from one config file")
+    parser.add_argument("config", help="JSON config (see the module docstring)")
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    specs = config["agents"]
+
+    # One connection pool for everyone, sized so no agent waits for a socket.
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=len(specs))
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    scheduler = FairScheduler(int(config.get("max_in_flight", 2)))
+    speech = Speaker()
+
+    vlms = {}
+    for spec in specs:
+        persona = PERSONAS.get(str(spec.get("persona", "1")), PERSONAS["1"])
+        remote = RemoteVLM(
+            server_url=spec.get("server_url", config.get("server_url", "http://localhost:8000")),
+            model=spec.get("model", persona.get("model")),
+            priority=spec.get("priority"),
+            http=http,
+        )
+        vlms[spec["name"]] = ScheduledVLM(remote, scheduler, spec["name"])
+
+    agents = {}
+    threads = [
+        threading.Thread(target=run_agent, args=(spec, vlms[spec["name"]], speech, agents),
+                         name=f"agent-{spec['name']}", daemon=True)
+        for spec in specs
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"Started {len(threads)} agents; press Ctrl+C to stop.")
+
+    report_seconds = float(config.get("report_seconds", 10))
+    start = time.perf_counter()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(report_seconds)
+            report(vlms, time.perf_counter() - start)
+    except KeyboardInterrupt:
+        print("Stopping agents...")
+    finally:
+        for agent in agents.values():
+            agent.running = False
+        for thread in threads:
+            thread.join(timeout=15)
+        report(vlms, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
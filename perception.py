@@ -5,10 +5,24 @@ import time
 from typing import Optional, Tuple
 
 class ScreenCapture:
-    def __init__(self, monitor_index: int = 1):
+    def __init__(self, monitor_index: int = 1, region: Optional[dict] = None):
+        """`region` ({"left", "top", "width", "height"}, relative to the monitor) captures part of it."""
+        self.monitor_index = monitor_index
+        self.region = region
         self.sct = mss.mss()
         self.monitor = self.sct.monitors[monitor_index]
+        if region:
+            self.monitor = {
+                "left": self.monitor["left"] + region.get("left", 0),
+                "top": self.monitor["top"] + region.get("top", 0),
+                "width": region["width"],
+                "height": region["height"],
+            }
         
+    def copy(self) -> "ScreenCapture":
+        """A capture of the same area for another thread (mss handles belong to the thread that opened them)."""
+        return ScreenCapture(self.monitor_index, self.region)
+
     def capture(self) -> np.ndarray:
         """
         Captures the screen and returns it as a BGR numpy array (OpenCV format).
@@ -0,0 +1,49 @@
+import os
+import time
+
+from action_memory import ActionMemory
+
+# Plans never run longer than this, whatever validity the VLM asked for.
+PLAN_HORIZON_SECONDS = float(os.environ.get("PLAN_HORIZON_SECONDS", 5.0))
+# Consecutive frames less similar than this mean the scene changed under the plan.
+PLAN_SCENE_SIMILARITY = float(os.environ.get("PLAN_SCENE_SIMILARITY", 0.8))
+
+
+class ActionPlan:
+    """
+    A multi-step decision from one VLM call: actions executed in order
+    without asking the VLM again until the steps run out or the plan is
+    invalidated. A plan expires after its validity horizon (`valid_for`
+    seconds, capped at PLAN_HORIZON_SECONDS) and is dropped when the frame
+    before a step differs sharply from the frame before the previous one,
+    using the same cheap descriptor as the action memory.
+    """
+
+    def __init__(self, steps: list, valid_for: float = None, frame=None):
+        self.steps = list(steps)
+        self.index = 0
+        horizon = min(float(valid_for), PLAN_HORIZON_SECONDS) if valid_for else PLAN_HORIZON_SECONDS
+        self.deadline = time.monotonic() + horizon
+        self.last_vector = ActionMemory.describe(frame) if frame is not None else None
+
+    @property
+    def remaining(self) -> int:
+        return len(self.steps) - self.index
+
+    def expired(self) -> bool:
+        return time.monotonic() > self.deadline
+
+    def invalidation(self, frame) -> str:
+        """Why the plan should not continue on this frame ("timeout", "scene change"), or None."""
+        if self.expired():
+            return "timeout"
+        vector = ActionMemory.describe(frame)
+        previous, self.last_vector = self.last_vector, vector
+        if previous is not None and float(previous @ vector) < PLAN_SCENE_SIMILARITY:
+            return "scene change"
+        return None
+
+    def next_step(self) -> dict:
+        step = self.steps[self.index]
+        self.index += 1
+        return step
@@ -0,0 +1,163 @@
+"""
+On-demand, time-boxed profiling shared by the server and the agent.
+
+StackSampler periodically snapshots every thread's Python stack with
+sys._current_frames() and writes them in the folded format that
+flamegraph.pl, speedscope and inferno read. Nothing runs until a profile
+is started, so the cost when profiling is off is zero. A profile can also
+record the torch profiler (Chrome trace) and the wall-clock time each
+request/loop stage took during the window.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class StackSampler:
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def write_folded(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top_frames(self, limit: int = 10) -> list:
+        """Leaf frames that appeared in the most samples, as (frame, share of samples)."""
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(frame, round(count / total, 3)) for frame, count in leaves.most_common(limit)]
+
+
+class StageClock:
+    """Accumulates wall-clock seconds and counts per named stage."""
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            total = self.totals.setdefault(name, {"count": 0, "sum": 0.0})
+            total["count"] += 1
+            total["sum"] += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: dict(total) for name, total in self.totals.items()}
+
+
+def stage_delta(before: dict, after: dict) -> dict:
+    """Per-stage {"count", "sum", "mean"} between two snapshots of {stage: {"count", "sum"}}."""
+    delta = {}
+    for name, total in after.items():
+        count = total["count"] - before.get(name, {}).get("count", 0)
+        seconds = total["sum"] - before.get(name, {}).get("sum", 0.0)
+        if count:
+            delta[name] = {"count": count, "sum": round(seconds, 4), "mean": round(seconds / count, 4)}
+    return delta
+
+
+_profile_lock = threading.Lock()
+
+
+def run_profile(seconds: float, output_dir: str, stage_snapshot=None, use_torch: bool = False,
+                interval: float = 0.005) -> dict:
+    """
+    Profiles the whole process for `seconds`, blocking the calling thread,
+    and writes stacks.folded, stages.json and (with `use_torch`)
+    torch_trace.json into a new timestamped directory under `output_dir`.
+    `stage_snapshot()` returns {stage: {"count", "sum"}}. Only one profile
+    runs at a time; raises RuntimeError if another is running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        path = os.path.join(output_dir, time.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(path, exist_ok=True)
+
+        torch_profiler = None
+        if use_torch:
+            import torch
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            torch_profiler = torch.profiler.profile(activities=activities)
+
+        sampler = StackSampler(interval)
+        before = stage_snapshot() if stage_snapshot else {}
+        start = time.perf_counter()
+        if torch_profiler is not None:
+            torch_profiler.start()
+        sampler.start()
+        try:
+            time.sleep(seconds)
+        finally:
+            sampler.stop()
+            if torch_profiler is not None:
+                torch_profiler.stop()
+        elapsed = time.perf_counter() - start
+        stages = stage_delta(before, stage_snapshot()) if stage_snapshot else {}
+
+        files = {"stacks": os.path.join(path, "stacks.folded"), "stages": os.path.join(path, "stages.json")}
+        sampler.write_folded(files["stacks"])
+        with open(files["stages"], "w") as f:
+            json.dump({"seconds": round(elapsed, 3), "stages": stages}, f, indent=2)
+        if torch_profiler is not None:
+            files["torch_trace"] = os.path.join(path, "torch_trace.json")
+            torch_profiler.export_chrome_trace(files["torch_trace"])
+
+        return {
+            "seconds": round(elapsed, 3),
+            "samples": sampler.sample_count,
+            "files": files,
+            "stages": stages,
+            "top_frames": sampler.top_frames(),
+        }
+    finally:
+        _profile_lock.release()
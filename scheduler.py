@@ -0,0 +1,111 @@
+"""
+Priority and deadline-aware admission to the models.
+
+Each model runs one request at a time. Requests waiting for a model are
+ordered by priority class, then earliest deadline first, then arrival.
+Deadlines are absolute Unix timestamps. A request whose deadline passes
+while it is still queued is dropped without touching the model; one whose
+deadline passes mid-generation is aborted by the caller (see `expired`).
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+# Lower rank runs first.
+PRIORITIES = {"realtime": 0, "normal": 1, "background": 2}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def expired(deadline) -> bool:
+    return deadline is not None and time.time() >= deadline
+
+
+class Scheduler:
+    def __init__(self, on_event=None):
+        """on_event(event, priority) is called for "started", "dropped" and "aborted"."""
+        self.on_event = on_event
+        self.counts = {priority: {"started": 0, "dropped": 0, "aborted": 0} for priority in PRIORITIES}
+        self._queues = {}  # resource -> heap of [rank, deadline, seq, priority]
+        self._busy = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def resolve(self, priority) -> str:
+        priority = priority or "normal"
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}; available: {list(PRIORITIES)}")
+        return priority
+
+    def record(self, event: str, priority: str):
+        with self._cond:
+            self.counts[priority][event] += 1
+        if self.on_event is not None:
+            self.on_event(event, priority)
+
+    def acquire(self, resource: str, priority: str = "normal", deadline=None):
+        """Blocks until `resource` is free and this request is first in line. Raises DeadlineExceeded."""
+        item = [PRIORITIES[priority], deadline if deadline is not None else float("inf"), next(self._seq), priority]
+        with self._cond:
+            queue = self._queues.setdefault(resource, [])
+            heapq.heappush(queue, item)
+            while True:
+                if expired(deadline):
+                    queue.remove(item)
+                    heapq.heapify(queue)
+                    # The head of the queue may have changed.
+                    self._cond.notify_all()
+                    started = False
+                    break
+                if resource not in self._busy and queue[0] is item:
+                    heapq.heappop(queue)
+                    self._busy.add(resource)
+                    started = True
+                    break
+                # Wake up at the deadline even if nothing else happens, so stale
+                # requests leave the queue promptly.
+                self._cond.wait(timeout=deadline - time.time() if deadline is not None else None)
+
+        if not started:
+            self.record("dropped", priority)
+            raise DeadlineExceeded("Deadline passed before the request started")
+        self.record("started", priority)
+
+    def release(self, resource: str):
+        with self._cond:
+            self._busy.discard(resource)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, resource: str, priority: str = "normal", deadline=None):
+        self.acquire(resource, priority, deadline)
+        try:
+            yield
+        finally:
+            self.release(resource)
+
+    def depth(self) -> dict:
+        """Queued requests per priority class, keyed by label tuples for a metrics gauge."""
+        with self._cond:
+            depth = {priority: 0 for priority in PRIORITIES}
+            for queue in self._queues.values():
+                for item in queue:
+                    depth[item[3]] += 1
+        return {(("priority", priority),): count for priority, count in depth.items()}
+
+    def stats(self) -> dict:
+        depth = self.depth()
+        with self._cond:
+            return {
+                priority: {
+                    "queued": depth[(("priority", priority),)],
+                    **counts,
+                    "deadline_misses": counts["dropped"] + counts["aborted"],
+                }
+                for priority, counts in self.counts.items()
+            }
@@ -1,96 +1,1300 @@
 import io
+import os
+import json
+import math
+import time
 import base64
+import asyncio
+import inspect
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
 import torch
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from PIL import Image
 import numpy as np
-from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
+from transformers import Qwen2VLForConditionalGeneration, AutoProcessor, DynamicCache, StoppingCriteria, StoppingCriteriaList
 from qwen_vl_utils import process_vision_info
+from vision_cache import VisionFeatureCache
+from metrics import MetricsRegistry, TOKEN_BUCKETS, RATE_BUCKETS, RATIO_BUCKETS, memory_usage
+from singleflight import SingleFlight, request_key
+from model_registry import ModelRegistry
+from sessions import SessionStore
+from scheduler import Scheduler, DeadlineExceeded, expired
+from backends import Backend, OpenAIBackend, ModelHostBackend, UnsupportedRequest
+from profiling import run_profile
 
 app = FastAPI(title="Lumine Agent Brain")
 
-# Global model variables
-model = None
-processor = None
+# Visual token budget. Qwen2-VL emits one visual token per 28x28 pixel block,
+# so these bound the prefill cost of every image. Set per deployment through
+# the environment, or per request through the min_pixels/max_pixels fields.
+PATCH_PIXELS = 28 * 28
+MIN_PIXELS = int(os.getenv("MIN_PIXELS", 256 * PATCH_PIXELS))
+MAX_PIXELS = int(os.getenv("MAX_PIXELS", 1280 * PATCH_PIXELS))
 
-@app.on_event("startup")
-async def load_model():
-    global model, processor
-    print("Loading Qwen2-VL model... This may take a while.")
-    model_path = "Qwen/Qwen2-VL-7B-Instruct"
-    
-    # Load model - assuming CUDA is available on the cloud GPU
+# Vision encoder outputs are cached by image content so repeated frames skip
+# the vision tower. VISION_CACHE_MB=0 disables the cache.
+VISION_CACHE_MB = int(os.getenv("VISION_CACHE_MB", 512))
+vision_cache = VisionFeatureCache(max_bytes=VISION_CACHE_MB * 1024 * 1024)
+
+# Clips go through Qwen2-VL's video path, which merges every two frames into
+# one temporal patch. History frames get a much smaller budget than the
+# current frame.
+CLIP_MAX_PIXELS = int(os.getenv("CLIP_MAX_PIXELS", 128 * PATCH_PIXELS))
+MAX_CLIP_FRAMES = int(os.getenv("MAX_CLIP_FRAMES", 16))
+
+# Byte-identical requests that arrive while one is running share its result.
+# RESULT_CACHE_TTL > 0 also keeps completed results for that many seconds.
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 0))
+singleflight = SingleFlight(result_ttl=RESULT_CACHE_TTL)
+
+MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", 128))
+
+# /predict_batch runs its items through the model PREDICT_BATCH_SIZE at a time
+# (overridable per request with `batch_size`, up to MAX_BATCH_SIZE).
+PREDICT_BATCH_SIZE = int(os.getenv("PREDICT_BATCH_SIZE", 8))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 32))
+
+# Requests with a session_id keep their conversation's KV cache on the server,
+# so each step only prefills the new turn. Sessions keep the last
+# SESSION_MAX_TURNS turns, expire after SESSION_IDLE_SECONDS, and the least
+# recently used are dropped when all caches together exceed SESSION_MEMORY_MB.
+sessions = SessionStore(
+    max_turns=int(os.getenv("SESSION_MAX_TURNS", 8)),
+    idle_timeout=float(os.getenv("SESSION_IDLE_SECONDS", 300)),
+    max_bytes=int(os.getenv("SESSION_MEMORY_MB", 4096)) * 1024 * 1024,
+)
+
+# Models served, as "name=model_id,..."; requests pick one with the `model`
+# field and fall back to DEFAULT_MODEL. Loaded models are LRU-evicted to stay
+# within MODEL_MEMORY_BUDGET_GB (default: 90% of GPU 0, or half of RAM on CPU).
+MODELS = dict(
+    spec.split("=", 1) for spec in os.getenv(
+        "MODELS", "qwen2-vl-7b=Qwen/Qwen2-VL-7B-Instruct,qwen2-vl-2b=Qwen/Qwen2-VL-2B-Instruct"
+    ).split(",") if spec
+)
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", next(iter(MODELS)))
+
+def default_memory_budget() -> int:
+    if torch.cuda.is_available():
+        return int(torch.cuda.get_device_properties(0).total_memory * 0.9)
+    return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+
+MODEL_MEMORY_BUDGET = (
+    int(float(os.environ["MODEL_MEMORY_BUDGET_GB"]) * 1024 ** 3)
+    if os.getenv("MODEL_MEMORY_BUDGET_GB") else default_memory_budget()
+)
+
+# Speculative decoding (opt-in): when DRAFT_MODEL names a registry model, it
+# proposes NUM_ASSISTANT_TOKENS tokens per step and the requested model
+# verifies them. Requests can turn it off or on with the `speculative` field.
+DRAFT_MODEL = os.getenv("DRAFT_MODEL", "")
+NUM_ASSISTANT_TOKENS = int(os.getenv("NUM_ASSISTANT_TOKENS", 5))
+if DRAFT_MODEL and DRAFT_MODEL not in MODELS:
+    raise ValueError(f"DRAFT_MODEL {DRAFT_MODEL!r} is not in MODELS")
+
+def cpu_thread_count() -> int:
+    """OMP_NUM_THREADS if set, else the CPUs this process may run on (not every CPU on a pinned host)."""
+    if os.getenv("OMP_NUM_THREADS", "").isdigit() and int(os.environ["OMP_NUM_THREADS"]) > 0:
+        return int(os.environ["OMP_NUM_THREADS"])
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+# ACCEL_PROFILE picks how models are loaded and run. `compile` wraps the
+# forward in torch.compile, which pays off with a static KV cache (fixed
+# decode shapes); prefill shapes vary per image size, so warm up at the sizes
+# real traffic uses. `flash` needs the flash-attn package. Compare profiles
+# on a machine with benchmark_profiles.py.
+ACCEL_PROFILES = {
+    "default": {"dtype": "float16"},
+    "sdpa": {"dtype": "float16", "attn_implementation": "sdpa"},
+    "flash": {"dtype": "bfloat16", "attn_implementation": "flash_attention_2"},
+    "compiled": {"dtype": "bfloat16", "attn_implementation": "sdpa", "compile": True, "static_cache": True},
+    "cpu": {"dtype": "float32", "attn_implementation": "sdpa", "device_map": "cpu", "cpu_threads": cpu_thread_count()},
+    "cpu-bf16": {"dtype": "bfloat16", "attn_implementation": "sdpa", "device_map": "cpu", "cpu_threads": cpu_thread_count()},
+}
+ACCEL_PROFILE = os.getenv("ACCEL_PROFILE", "default")
+if ACCEL_PROFILE not in ACCEL_PROFILES:
+    raise ValueError(f"Unknown ACCEL_PROFILE {ACCEL_PROFILE!r}; available: {sorted(ACCEL_PROFILES)}")
+accel = ACCEL_PROFILES[ACCEL_PROFILE]
+
+# Weights are cached under MODEL_CACHE_DIR so boots after the first load from
+# local disk. Warmup runs WARMUP_RUNS synthetic requests at each of
+# WARMUP_RESOLUTIONS ("WxH,WxH") before a model takes traffic.
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.expanduser("~/lumine-agent/models"))
+WARMUP_RESOLUTIONS = [
+    tuple(int(v) for v in size.split("x"))
+    for size in os.getenv("WARMUP_RESOLUTIONS", "1024x576").split(",") if size
+]
+WARMUP_RUNS = int(os.getenv("WARMUP_RUNS", 1))
+
+# BACKEND picks what runs behind /predict: "transformers" (the pipeline in
+# this file), "openai", which forwards to an OpenAI-compatible
+# chat-completions server at OPENAI_BASE_URL serving OPENAI_MODEL, or "host",
+# which talks to a model_host.py process on MODEL_HOST_SOCKET so this API
+# process can restart without reloading weights.
+BACKEND = os.getenv("BACKEND", "transformers")
+MODEL_HOST_SOCKET = os.getenv("MODEL_HOST_SOCKET", "/tmp/lumine-model-host.sock")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "http://localhost:8001/v1")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", MODELS[DEFAULT_MODEL])
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+
+# POST /admin/profile writes time-boxed profiles (Python stacks, optional
+# torch profiler trace, per-stage timings) under PROFILE_DIR. With
+# ADMIN_TOKEN set, callers must send it in the X-Admin-Token header.
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+MAX_PROFILE_SECONDS = float(os.getenv("MAX_PROFILE_SECONDS", 120))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# loading -> warming -> ready (or failed), for the default model; traffic is
+# only accepted when ready.
+server_state = "loading"
+
+metrics = MetricsRegistry(prefix="lumine_")
+STAGE_SECONDS = metrics.histogram("stage_seconds", "Latency of each request stage")
+REQUEST_SECONDS = metrics.histogram("request_seconds", "End-to-end request latency per endpoint")
+DECODE_RATE = metrics.histogram("decode_tokens_per_second", "Decode throughput per request", RATE_BUCKETS)
+INPUT_TOKENS = metrics.histogram("input_tokens", "Prompt tokens per request", TOKEN_BUCKETS)
+VISUAL_TOKENS = metrics.histogram("visual_tokens", "Visual tokens per request", TOKEN_BUCKETS)
+GENERATED_TOKENS = metrics.counter("generated_tokens_total", "Tokens generated")
+REQUESTS = metrics.counter("requests_total", "Requests by endpoint and status")
+ERRORS = metrics.counter("errors_total", "Failed requests by endpoint and exception type")
+DEDUPLICATED = metrics.counter("deduplicated_requests_total", "Requests answered by a coalesced call or the result cache")
+IN_FLIGHT = metrics.gauge("in_flight_requests", "Requests currently being handled")
+SCHEDULED = metrics.counter(
+    "scheduled_requests_total",
+    "Scheduler outcomes by priority class: started, dropped (deadline passed while queued) "
+    "or aborted (deadline passed during generation)",
+)
+SPEC_ACCEPTED = metrics.counter("speculative_accepted_tokens_total", "Draft tokens accepted by the main model")
+SPEC_PROPOSED = metrics.counter("speculative_proposed_tokens_total", "Draft tokens proposed")
+SPEC_ACCEPTANCE = metrics.histogram("speculative_acceptance_rate", "Per-request draft acceptance rate", RATIO_BUCKETS)
+MODEL_EVENTS = metrics.counter("model_events_total", "Model registry load, hit and evict events")
+
+# Requests carry a priority class (realtime, normal, background) and an
+# optional absolute deadline; each model serves them in that order and
+# skips or aborts the ones that go stale.
+scheduler = Scheduler(on_event=lambda event, priority: SCHEDULED.inc(event=event, priority=priority))
+QUEUE_DEPTH = metrics.gauge("queue_depth", "Requests waiting for a model, by priority class", fn=scheduler.depth)
+metrics.gauge("memory_bytes", "Process memory by kind", fn=memory_usage)
+metrics.gauge("model_load_seconds", "Duration of each phase of the latest load of each model",
+              fn=lambda: {
+                  (("model", name), ("phase", phase)): value
+                  for name, timings in registry.load_timings.items()
+                  for phase, value in timings.items()
+              })
+
+def download_complete(local_dir: str) -> bool:
+    """Whether `local_dir` has the config and every weight shard (per the index, if sharded)."""
+    if not os.path.exists(os.path.join(local_dir, "config.json")):
+        return False
+    index_path = os.path.join(local_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        try:
+            with open(index_path) as f:
+                shards = set(json.load(f)["weight_map"].values())
+        except (OSError, ValueError, KeyError):
+            return False
+        return all(os.path.exists(os.path.join(local_dir, shard)) for shard in shards)
+    return os.path.exists(os.path.join(local_dir, "model.safetensors"))
+
+def resolve_model_path(model_id: str) -> str:
+    """
+    Returns a local directory holding `model_id`'s weights, downloading them
+    into MODEL_CACHE_DIR the first time. Later boots never touch the hub; an
+    interrupted download is resumed rather than loaded.
+    """
+    local_dir = os.path.join(MODEL_CACHE_DIR, model_id.replace("/", "--"))
+    if download_complete(local_dir):
+        return local_dir
+
+    from huggingface_hub import snapshot_download
+    print(f"Downloading {model_id} to {local_dir}...")
+    snapshot_download(
+        model_id,
+        local_dir=local_dir,
+        allow_patterns=["*.json", "*.safetensors", "*.txt", "*.model", "*.py"],
+    )
+    return local_dir
+
+def load_weights(model_path: str):
+    """Loads a model and its processor from a local directory, as the ACCEL_PROFILE says."""
+    if accel.get("cpu_threads"):
+        torch.set_num_threads(accel["cpu_threads"])
+    load_kwargs = {}
+    if accel.get("attn_implementation"):
+        load_kwargs["attn_implementation"] = accel["attn_implementation"]
+
+    # Safetensors shards are memory-mapped, so weights stream straight to the device.
     model = Qwen2VLForConditionalGeneration.from_pretrained(
         model_path,
-        torch_dtype=torch.float16,
-        device_map="auto",
-        trust_remote_code=True
+        torch_dtype=getattr(torch, accel["dtype"]),
+        device_map=accel.get("device_map", "auto"),
+        use_safetensors=True,
+        low_cpu_mem_usage=True,
+        trust_remote_code=True,
+        **load_kwargs,
     )
-    
     processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
-    print("Model loaded successfully!")
+    if VISION_CACHE_MB > 0:
+        vision_cache.install(vision_tower(model), namespace=model_path)
+    if accel.get("compile"):
+        # Installed after the vision cache wrapper, which stays eager.
+        model.forward = torch.compile(model.forward, mode="reduce-overhead")
+    return model, processor
+
+def warmup(entry):
+    """Runs synthetic requests so CUDA kernels and allocator pools are ready before real traffic."""
+    global server_state
+    if server_state == "loading":
+        server_state = "warming"
+    for width, height in WARMUP_RESOLUTIONS:
+        # A gradient rather than a flat color, so the image isn't trivially compressible.
+        x = np.linspace(0, 255, width, dtype=np.uint8)
+        y = np.linspace(0, 255, height, dtype=np.uint8)
+        pixels = np.stack(np.broadcast_arrays(x[None, :], y[:, None], x[None, :] // 2 + y[:, None] // 2), axis=-1)
+        pil_image = Image.fromarray(pixels.astype(np.uint8))
+        content = [
+            {"type": "image", "image": pil_image, "min_pixels": MIN_PIXELS, "max_pixels": MAX_PIXELS},
+            {"type": "text", "text": "Describe the screen."},
+        ]
+        for _ in range(WARMUP_RUNS):
+            generate_response(entry, content, [], {})
+
+registry = ModelRegistry(
+    MODELS,
+    default=DEFAULT_MODEL,
+    memory_budget=MODEL_MEMORY_BUDGET,
+    loader=load_weights,
+    resolve_path=resolve_model_path,
+    warmup=warmup,
+    on_event=lambda event, name: MODEL_EVENTS.inc(event=event, model=name),
+)
+
+def start_backend():
+    """Startup: load (or connect to) the backend, then flip to ready."""
+    global server_state
+    try:
+        print(f"Starting the {backend.name} backend... This may take a while.")
+        backend.start()
+        server_state = "ready"
+        print(f"Backend {backend.name} ready")
+    except Exception as e:
+        server_state = "failed"
+        print(f"Backend startup failed: {e}")
+        raise
+
+@app.on_event("startup")
+async def start_loading():
+    # Load in the background so /health can report progress while weights load.
+    threading.Thread(target=start_backend, name="model-loader", daemon=True).start()
+
+class DecodeTimer(StoppingCriteria):
+    """
+    Never stops generation; records when the first new token appears to split
+    prefill from decode, and counts decoding steps (one per token, or one per
+    verification round in assisted generation).
+    """
+
+    def __init__(self):
+        self.first_token_time = None
+        self.steps = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.steps += 1
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+class DeadlineStop(StoppingCriteria):
+    """Stops generation once the request's deadline has passed. Prefill itself cannot be interrupted."""
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.stopped = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.stopped = self.stopped or expired(self.deadline)
+        return torch.full((input_ids.shape[0],), self.stopped, dtype=torch.bool, device=input_ids.device)
+
+@contextmanager
+def stage(timings: dict, name: str):
+    """Times a request stage into the stage histogram and the request's own `timings`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings[name] = round(timings.get(name, 0.0) + elapsed, 6)
+
+def vision_tower(model):
+    """Returns the vision encoder module, which moved under `model.model` in newer transformers."""
+    visual = getattr(model, "visual", None)
+    return visual if visual is not None else model.model.visual
+
+def decode_image(contents: bytes, max_pixels: int) -> Image.Image:
+    """Decodes an uploaded image, using JPEG draft mode when the budget is smaller than the upload."""
+    pil_image = Image.open(io.BytesIO(contents))
+    width, height = pil_image.size
+    if pil_image.format == "JPEG" and width * height > max_pixels:
+        # draft() picks the largest DCT scale (1/2, 1/4, 1/8) that still covers
+        # the requested size; the processor does the final resize.
+        scale = math.sqrt(max_pixels / (width * height))
+        pil_image.draft("RGB", (int(width * scale), int(height * scale)))
+    return pil_image.convert("RGB")
+
+def count_visual_tokens(processor, inputs) -> int:
+    """Number of visual tokens the processor inserted for the images and videos in `inputs`."""
+    merge_size = processor.image_processor.merge_size
+    patches = 0
+    for grid_key in ("image_grid_thw", "video_grid_thw"):
+        grid_thw = inputs.get(grid_key)
+        if grid_thw is not None:
+            patches += int(grid_thw.prod(dim=-1).sum())
+    return patches // (merge_size ** 2)
+
+def resolve_budget(min_pixels: Optional[int], max_pixels: Optional[int]):
+    """Applies deployment defaults to a per-request pixel budget."""
+    min_pixels = min_pixels or MIN_PIXELS
+    max_pixels = max_pixels or MAX_PIXELS
+    if min_pixels > max_pixels:
+        raise ValueError("min_pixels must not exceed max_pixels")
+    return min_pixels, max_pixels
+
+def observe_generation(timings: dict, start: float, first_token_time: float, end: float,
+                       input_tokens: Optional[int], visual_tokens: Optional[int], new_tokens: int) -> float:
+    """
+    Records prefill/decode timings and token counts; returns decode tokens per
+    second. Token counts a backend cannot report are None and not recorded.
+    """
+    timings["prefill"] = round(first_token_time - start, 6)
+    timings["decode"] = round(end - first_token_time, 6)
+    STAGE_SECONDS.observe(timings["prefill"], stage="prefill")
+    STAGE_SECONDS.observe(timings["decode"], stage="decode")
+    if input_tokens is not None:
+        INPUT_TOKENS.observe(input_tokens)
+    if visual_tokens is not None:
+        VISUAL_TOKENS.observe(visual_tokens)
+    GENERATED_TOKENS.inc(new_tokens)
+    # The first token is produced by prefill, so decode throughput counts the rest.
+    tokens_per_second = (new_tokens - 1) / timings["decode"] if new_tokens > 1 and timings["decode"] > 0 else 0.0
+    if tokens_per_second:
+        DECODE_RATE.observe(tokens_per_second)
+    return tokens_per_second
+
+def generate_response(entry, content: list, image_keys: list, timings: dict, draft=None,
+                      priority: str = "normal", deadline: Optional[float] = None) -> dict:
+    """
+    Runs one user turn through the model held by registry `entry`, with
+    `draft` (another entry) as assistant model if given. `image_keys` tag the
+    turn's images for the vision cache. Waits its turn in the scheduler and
+    raises DeadlineExceeded if `deadline` passes first or during generation.
+    Blocking; call from a worker thread.
+    """
+    model, processor = entry.model, entry.processor
+    messages = [{"role": "user", "content": content}]
+
+    generate_kwargs = {}
+    locks = [entry.lock]
+    if draft is not None:
+        generate_kwargs["assistant_model"] = draft.model
+        locks.append(draft.lock)
+    elif accel.get("static_cache"):
+        # Assisted generation needs a dynamic cache, so only plain decoding uses it.
+        generate_kwargs["cache_implementation"] = "static"
+
+    with stage(timings, "queue"):
+        scheduler.acquire(entry.name, priority, deadline)
+    for lock in locks:
+        lock.acquire()
+    try:
+        if draft is not None:
+            # A constant schedule keeps proposals per step fixed, so the
+            # acceptance rate below is exact apart from the final step.
+            draft.model.generation_config.num_assistant_tokens = NUM_ASSISTANT_TOKENS
+            draft.model.generation_config.num_assistant_tokens_schedule = "constant"
+
+        with stage(timings, "chat_template"):
+            text = processor.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+
+        with stage(timings, "processor"):
+            image_inputs, video_inputs = process_vision_info(messages)
+            inputs = processor(
+                text=[text],
+                images=image_inputs,
+                videos=video_inputs,
+                padding=True,
+                return_tensors="pt",
+            )
+            inputs = inputs.to(model.device)
+
+        decode_timer = DecodeTimer()
+        stopping_criteria = [decode_timer]
+        if deadline is not None:
+            deadline_stop = DeadlineStop(deadline)
+            stopping_criteria.append(deadline_stop)
+        start = time.perf_counter()
+        with vision_cache.images(image_keys) as cache_lookup:
+            generated_ids = model.generate(
+                **inputs,
+                **generate_kwargs,
+                max_new_tokens=MAX_NEW_TOKENS,
+                stopping_criteria=StoppingCriteriaList(stopping_criteria),
+            )
+        end = time.perf_counter()
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+        scheduler.release(entry.name)
+
+    if deadline is not None and deadline_stop.stopped:
+        scheduler.record("aborted", priority)
+        raise DeadlineExceeded("Deadline passed during generation")
+
+    first_token_time = decode_timer.first_token_time or end
+
+    generated_ids_trimmed = [
+        out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+    ]
+    output_text = processor.batch_decode(
+        generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+    )
+
+    input_tokens = int(inputs.input_ids.shape[1])
+    visual_tokens = count_visual_tokens(processor, inputs)
+    new_tokens = len(generated_ids_trimmed[0])
+    tokens_per_second = observe_generation(
+        timings, start, first_token_time, end, input_tokens, visual_tokens, new_tokens
+    )
+
+    response = {
+        "action": output_text[0],
+        "input_tokens": input_tokens,
+        "visual_tokens": visual_tokens,
+        "generated_tokens": new_tokens,
+        "tokens_per_second": round(tokens_per_second, 2),
+        "model": entry.name,
+        "vision_cache_hit": cache_lookup["hits"] > 0,
+        "timings": timings,
+    }
+
+    if draft is not None:
+        # Each verification step yields the accepted draft tokens plus one
+        # token from the main model.
+        steps = decode_timer.steps
+        accepted = max(new_tokens - steps, 0)
+        proposed = steps * NUM_ASSISTANT_TOKENS
+        acceptance_rate = accepted / proposed if proposed else 0.0
+        SPEC_ACCEPTED.inc(accepted)
+        SPEC_PROPOSED.inc(proposed)
+        SPEC_ACCEPTANCE.observe(acceptance_rate)
+        response["speculative"] = {
+            "draft_model": draft.name,
+            "steps": steps,
+            "accepted_tokens": accepted,
+            "proposed_tokens": proposed,
+            "acceptance_rate": round(acceptance_rate, 3),
+        }
+    return response
+
+def generate_batch(entry, contents: list, image_keys: list, timings: dict,
+                   priority: str = "normal", deadline: Optional[float] = None) -> list:
+    """
+    Runs several independent user turns through one padded generate() call
+    and returns one response per turn. `image_keys` cover every image of the
+    batch in order. Blocking; call from a worker thread.
+    """
+    model, processor = entry.model, entry.processor
+    tokenizer = processor.tokenizer
+    conversations = [[{"role": "user", "content": content}] for content in contents]
+
+    with stage(timings, "queue"):
+        scheduler.acquire(entry.name, priority, deadline)
+    entry.lock.acquire()
+    # Decoder-only models need left padding so every row's new tokens start
+    # at the same column.
+    padding_side, tokenizer.padding_side = tokenizer.padding_side, "left"
+    try:
+        with stage(timings, "chat_template"):
+            texts = [
+                processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+                for messages in conversations
+            ]
+
+        with stage(timings, "processor"):
+            image_inputs, video_inputs = process_vision_info(conversations)
+            inputs = processor(
+                text=texts,
+                images=image_inputs,
+                videos=video_inputs,
+                padding=True,
+                return_tensors="pt",
+            )
+            inputs = inputs.to(model.device)
+
+        decode_timer = DecodeTimer()
+        stopping_criteria = [decode_timer]
+        if deadline is not None:
+            deadline_stop = DeadlineStop(deadline)
+            stopping_criteria.append(deadline_stop)
+        start = time.perf_counter()
+        with vision_cache.images(image_keys) as cache_lookup:
+            generated_ids = model.generate(
+                **inputs,
+                max_new_tokens=MAX_NEW_TOKENS,
+                stopping_criteria=StoppingCriteriaList(stopping_criteria),
+                **({"cache_implementation": "static"} if accel.get("static_cache") else {}),
+            )
+        end = time.perf_counter()
+    finally:
+        tokenizer.padding_side = padding_side
+        entry.lock.release()
+        scheduler.release(entry.name)
+
+    if deadline is not None and deadline_stop.stopped:
+        scheduler.record("aborted", priority)
+        raise DeadlineExceeded("Deadline passed during generation")
+
+    first_token_time = decode_timer.first_token_time or end
+    generated_ids_trimmed = generated_ids[:, inputs.input_ids.shape[1]:]
+    output_texts = processor.batch_decode(
+        generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+    )
+
+    # Finished rows are padded out to the longest one.
+    new_tokens = (generated_ids_trimmed != tokenizer.pad_token_id).sum(dim=1).tolist()
+    input_tokens = inputs.attention_mask.sum(dim=1).tolist()
+    visual_tokens = count_visual_tokens(processor, inputs)
+    tokens_per_second = observe_generation(
+        timings, start, first_token_time, end, sum(input_tokens), visual_tokens, sum(new_tokens)
+    )
+
+    return [
+        {
+            "action": output_text,
+            "input_tokens": int(row_input_tokens),
+            "generated_tokens": int(row_new_tokens),
+            "model": entry.name,
+            "batch_size": len(contents),
+            "batch_tokens_per_second": round(tokens_per_second, 2),
+            "vision_cache_hit": cache_lookup["hits"] > 0,
+            "timings": timings,
+        }
+        for output_text, row_input_tokens, row_new_tokens in zip(output_texts, input_tokens, new_tokens)
+    ]
+
+def use_draft(model_name: str, speculative: Optional[bool]) -> bool:
+    """Speculative decoding applies when a draft model is configured and not turned off per request."""
+    return bool(DRAFT_MODEL) and model_name != DRAFT_MODEL and speculative is not False
+
+def infer(model_name: str, content: list, image_keys: list, timings: dict, speculative: Optional[bool] = None,
+          priority: str = "normal", deadline: Optional[float] = None) -> dict:
+    """Checks out `model_name` (and the draft model, if used) from the registry and generates."""
+    if not use_draft(model_name, speculative):
+        with registry.acquire(model_name) as entry:
+            return generate_response(entry, content, image_keys, timings, priority=priority, deadline=deadline)
+    # Both in one checkout: holding the model while loading the draft can deadlock.
+    with registry.acquire_many([model_name, DRAFT_MODEL]) as (entry, draft):
+        return generate_response(
+            entry, content, image_keys, timings, draft=draft, priority=priority, deadline=deadline
+        )
+
+@contextmanager
+def track_request(endpoint: str):
+    """Counts a request as in flight and records its latency."""
+    start = time.perf_counter()
+    with IN_FLIGHT.track():
+        try:
+            yield
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+
+async def run_once(endpoint: str, key: str, compute, deadline: Optional[float] = None) -> dict:
+    """
+    Runs `compute` through single-flight deduplication and tags the response
+    with its source. A request that joins an identical one still answers by
+    its own `deadline`, and is not failed by the other request's deadline.
+    """
+    timeout = max(deadline - time.time(), 0.0) if deadline else None
+    try:
+        response, source = await singleflight.run(key, compute, timeout=timeout, retry_on=(DeadlineExceeded,))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Deadline passed waiting for an identical request")
+    if source != "executed":
+        DEDUPLICATED.inc(endpoint=endpoint, source=source)
+    response["source"] = source
+    REQUESTS.inc(endpoint=endpoint, status="200")
+    return response
+
+def error_response(endpoint: str, status_code: int, e: Exception) -> JSONResponse:
+    REQUESTS.inc(endpoint=endpoint, status=str(status_code))
+    if status_code >= 500:
+        ERRORS.inc(endpoint=endpoint, type=type(e).__name__)
+    return JSONResponse(status_code=status_code, content={"error": str(e)})
+
+def rope_positions(model, input_ids, image_grid_thw, video_grid_thw):
+    """Qwen2-VL's 3D (M-RoPE) position ids for `input_ids`, starting at 0."""
+    get_rope_index = getattr(model, "get_rope_index", None) or model.model.get_rope_index
+    position_ids, _ = get_rope_index(input_ids, image_grid_thw, video_grid_thw, torch.ones_like(input_ids))
+    return position_ids
+
+def last_logits_kwargs(model) -> dict:
+    """Asks the model for last-position logits only; the argument was renamed across transformers versions."""
+    params = inspect.signature(model.forward).parameters
+    for name in ("logits_to_keep", "num_logits_to_keep"):
+        if name in params:
+            return {name: 1}
+    return {}
+
+def session_step(entry, session, content: list, image_keys: list, timings: dict,
+                 priority: str = "normal", deadline: Optional[float] = None) -> dict:
+    """
+    Runs one turn of a session: prefills only the new turn on top of the
+    session's KV cache, then decodes greedily, extending the same cache.
+    Blocking; call from a worker thread with `session.lock` held.
+    """
+    model, processor = entry.model, entry.processor
+    tokenizer = processor.tokenizer
+    messages = [{"role": "user", "content": content}]
+    im_end_id = tokenizer.convert_tokens_to_ids("<|im_end|>")
+    eos_ids = {im_end_id, tokenizer.eos_token_id}
+    newline_ids = tokenizer("\n", add_special_tokens=False).input_ids
+    logits_kwargs = last_logits_kwargs(model)
+
+    with stage(timings, "queue"):
+        scheduler.acquire(entry.name, priority, deadline)
+    entry.lock.acquire()
+    try:
+        with stage(timings, "chat_template"):
+            text = processor.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+            # The template prepends a system prompt to every rendering; only
+            # the first turn of a session keeps it.
+            system_text = ""
+            if text.startswith("<|im_start|>system"):
+                split = text.index("<|im_end|>\n") + len("<|im_end|>\n")
+                system_text, text = text[:split], text[split:]
+            if session.is_new:
+                text = system_text + text
+
+        with stage(timings, "processor"):
+            image_inputs, video_inputs = process_vision_info(messages)
+            inputs = processor(
+                text=[text],
+                images=image_inputs,
+                videos=video_inputs,
+                padding=True,
+                return_tensors="pt",
+            )
+            inputs = inputs.to(model.device)
+
+        if session.is_new:
+            session.cache = DynamicCache()
+            session.prefix_len = len(tokenizer(system_text, add_special_tokens=False).input_ids)
+            turn_start = session.prefix_len
+        else:
+            # The previous turn's closing tokens are fed now and belong to it.
+            session.turns[-1][1] += len(session.pending_ids)
+            turn_start = session.seq_len + len(session.pending_ids)
+
+        pending = torch.tensor([session.pending_ids], dtype=inputs.input_ids.dtype, device=model.device)
+        chunk_ids = torch.cat([pending, inputs.input_ids], dim=1)
+        chunk_len = chunk_ids.shape[1]
+        position_ids = rope_positions(
+            model, chunk_ids, inputs.get("image_grid_thw"), inputs.get("video_grid_thw")
+        ) + session.next_position
+
+        start = time.perf_counter()
+        with torch.no_grad(), vision_cache.images(image_keys) as cache_lookup:
+            outputs = model(
+                input_ids=chunk_ids,
+                attention_mask=torch.ones((1, session.seq_len + chunk_len), dtype=torch.long, device=model.device),
+                position_ids=position_ids,
+                past_key_values=session.cache,
+                pixel_values=inputs.get("pixel_values"),
+                pixel_values_videos=inputs.get("pixel_values_videos"),
+                image_grid_thw=inputs.get("image_grid_thw"),
+                video_grid_thw=inputs.get("video_grid_thw"),
+                cache_position=torch.arange(session.seq_len, session.seq_len + chunk_len, device=model.device),
+                use_cache=True,
+                **logits_kwargs,
+            )
+            session.seq_len += chunk_len
+            next_position = int(position_ids.max()) + 1
+            token = int(outputs.logits[0, -1].argmax())
+            first_token_time = time.perf_counter()
+
+            generated = [token]
+            # An expired deadline ends the turn early but still leaves the
+            # cache consistent, so the session survives the abort.
+            aborted = False
+            while token not in eos_ids and len(generated) < MAX_NEW_TOKENS:
+                if expired(deadline):
+                    aborted = True
+                    break
+                outputs = model(
+                    input_ids=torch.tensor([[token]], device=model.device),
+                    attention_mask=torch.ones((1, session.seq_len + 1), dtype=torch.long, device=model.device),
+                    position_ids=torch.full((3, 1, 1), next_position, device=model.device),
+                    past_key_values=session.cache,
+                    cache_position=torch.tensor([session.seq_len], device=model.device),
+                    use_cache=True,
+                    **logits_kwargs,
+                )
+                session.seq_len += 1
+                next_position += 1
+                token = int(outputs.logits[0, -1].argmax())
+                generated.append(token)
+        end = time.perf_counter()
+
+        # The last token is not in the cache yet; it is fed, with the turn's
+        # closing tokens, at the start of the next step.
+        closing = [im_end_id] + newline_ids
+        session.pending_ids = closing if token in eos_ids else [token] + closing
+        session.next_position = next_position
+        session.turns.append([turn_start, session.seq_len])
+        session.steps += 1
+        session.trim(sessions.max_turns)
+    except Exception:
+        # A half-applied step leaves the cache inconsistent; start over next time.
+        sessions.end(session.id)
+        raise
+    finally:
+        entry.lock.release()
+        scheduler.release(entry.name)
+
+    if aborted:
+        scheduler.record("aborted", priority)
+        raise DeadlineExceeded("Deadline passed during generation")
+
+    output_text = tokenizer.decode(generated, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+    visual_tokens = count_visual_tokens(processor, inputs)
+    tokens_per_second = observe_generation(
+        timings, start, first_token_time, end, chunk_len, visual_tokens, len(generated)
+    )
+
+    return {
+        "action": output_text,
+        "input_tokens": chunk_len,
+        "visual_tokens": visual_tokens,
+        "generated_tokens": len(generated),
+        "tokens_per_second": round(tokens_per_second, 2),
+        "model": entry.name,
+        "vision_cache_hit": cache_lookup["hits"] > 0,
+        "timings": timings,
+        "session": {
+            "id": session.id,
+            "step": session.steps,
+            "turns": len(session.turns),
+            "context_tokens": session.seq_len,
+        },
+    }
+
+def infer_session(model_name: str, session_id: str, content: list, image_keys: list, timings: dict,
+                  followup: Optional[str] = None, priority: str = "normal", deadline: Optional[float] = None) -> dict:
+    """
+    Runs a session step. After the first step, `followup` (if given) replaces
+    the instruction text, since the full instruction is already in the cache.
+    """
+    with registry.acquire(model_name) as entry:
+        session = sessions.get(session_id, entry)
+        with session.lock:
+            if followup and not session.is_new:
+                content = [
+                    {"type": "text", "text": followup} if item["type"] == "text" else item
+                    for item in content
+                ]
+            try:
+                response = session_step(entry, session, content, image_keys, timings, priority, deadline)
+            finally:
+                sessions.update(session)
+        return response
+
+class TransformersBackend(Backend):
+    """The reference backend: the transformers pipeline above, with the model registry, sessions and speculative decoding."""
+
+    name = "transformers"
+
+    def start(self):
+        print(f"Loading {MODELS[DEFAULT_MODEL]}...")
+        with registry.acquire(DEFAULT_MODEL):
+            pass
+        timings = registry.load_timings[DEFAULT_MODEL]
+        print(f"Model loaded in {sum(timings.values()):.1f}s: {timings}")
+
+    def resolve_model(self, name) -> str:
+        return registry.resolve(name)
+
+    def predict(self, model_name, content, image_keys, timings, speculative=None, priority="normal", deadline=None):
+        return infer(model_name, content, image_keys, timings, speculative, priority, deadline)
+
+    def predict_session(self, model_name, session_id, content, image_keys, timings, followup=None,
+                        priority="normal", deadline=None):
+        return infer_session(model_name, session_id, content, image_keys, timings, followup, priority, deadline)
+
+    def end_session(self, session_id):
+        return sessions.end(session_id)
+
+    def predict_batch(self, model_name, contents, image_keys, timings, priority="normal", deadline=None):
+        with registry.acquire(model_name) as entry:
+            return generate_batch(entry, contents, image_keys, timings, priority, deadline)
+
+    def load_model(self, name):
+        with registry.acquire(name):
+            pass
+
+    def unload_model(self, name):
+        if name == DEFAULT_MODEL:
+            raise ValueError("The default model cannot be unloaded")
+        return registry.unload(name)
+
+    def stats(self):
+        return {
+            "accel_profile": {"name": ACCEL_PROFILE, **accel},
+            "vision_cache": vision_cache.stats(),
+            "models": registry.stats(),
+            "sessions": sessions.stats(),
+            "speculative": {
+                "draft_model": DRAFT_MODEL or None,
+                "num_assistant_tokens": NUM_ASSISTANT_TOKENS,
+                "accepted_tokens": SPEC_ACCEPTED.value(),
+                "proposed_tokens": SPEC_PROPOSED.value(),
+                "acceptance_rate": SPEC_ACCEPTED.value() / SPEC_PROPOSED.value() if SPEC_PROPOSED.value() else 0.0,
+            },
+        }
+
+def observe_remote(stage_timings: dict, responses: list):
+    """Records stages and token counts that a model host measured, so this process's metrics stay complete."""
+    for name, seconds in stage_timings.items():
+        STAGE_SECONDS.observe(seconds, stage=name)
+    for response in responses:
+        if "error" in response:
+            continue
+        if response.get("input_tokens") is not None:
+            INPUT_TOKENS.observe(response["input_tokens"])
+        if response.get("visual_tokens") is not None:
+            VISUAL_TOKENS.observe(response["visual_tokens"])
+        GENERATED_TOKENS.inc(response.get("generated_tokens", 0))
+        if response.get("tokens_per_second"):
+            DECODE_RATE.observe(response["tokens_per_second"])
+
+BACKENDS = {
+    "transformers": TransformersBackend,
+    "host": lambda: ModelHostBackend(MODEL_HOST_SOCKET, observe=observe_remote),
+    "openai": lambda: OpenAIBackend(
+        OPENAI_BASE_URL, OPENAI_MODEL, api_key=OPENAI_API_KEY, max_tokens=MAX_NEW_TOKENS,
+        stage=stage, observe=observe_generation, scheduler=scheduler,
+    ),
+}
+if BACKEND not in BACKENDS:
+    raise ValueError(f"Unknown BACKEND {BACKEND!r}; available: {sorted(BACKENDS)}")
+backend = BACKENDS[BACKEND]()
 
 @app.get("/health")
 def health_check():
-    return {"status": "ready" if model else "loading"}
+    return {
+        "status": server_state,
+        "backend": backend.name,
+        "startup_seconds": registry.load_timings.get(DEFAULT_MODEL, {}),
+    }
+
+@app.get("/metrics")
+def get_metrics(format: str = "prometheus"):
+    """Server metrics in Prometheus text format, or JSON with ?format=json."""
+    if format == "json":
+        return metrics.to_dict()
+    return PlainTextResponse(metrics.render_prometheus())
+
+@app.get("/stats")
+def stats():
+    return {
+        "backend": backend.name,
+        "coalescing": singleflight.stats(),
+        "scheduler": scheduler.stats(),
+        **backend.stats(),
+    }
+
+def stage_snapshot() -> dict:
+    """Cumulative count and seconds per request stage and per endpoint, for profile windows."""
+    snapshot = {}
+    for prefix, histogram in (("stage", STAGE_SECONDS), ("request", REQUEST_SECONDS)):
+        for labels, series in histogram.to_dict().items():
+            snapshot[f"{prefix}{labels}"] = {"count": series["count"], "sum": series["sum"]}
+    return snapshot
+
+@app.post("/admin/profile")
+async def profile(
+    seconds: float = Form(10.0),
+    torch_profiler: bool = Form(False),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Samples every thread's Python stack (and optionally runs the torch
+    profiler) for `seconds` while traffic continues, then returns where the
+    files were written along with per-stage timings for the window.
+    """
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        return JSONResponse(status_code=403, content={"error": "Invalid admin token"})
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return JSONResponse(status_code=400, content={"error": f"seconds must be in (0, {MAX_PROFILE_SECONDS}]"})
+    try:
+        return await run_in_threadpool(run_profile, seconds, PROFILE_DIR, stage_snapshot, torch_profiler)
+    except RuntimeError as e:
+        return JSONResponse(status_code=409, content={"error": str(e)})
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    """Drops a session and frees its KV cache."""
+    try:
+        ended = await run_in_threadpool(backend.end_session, session_id)
+    except UnsupportedRequest as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return {"ended": ended}
+
+@app.get("/models")
+def list_models():
+    backend_stats = backend.stats()
+    return backend_stats.get("models", backend_stats)
+
+@app.post("/models/load")
+async def load_named_model(name: str = Form(...)):
+    """Preloads a model so the first request routed to it doesn't pay for the load."""
+    try:
+        backend.resolve_model(name)
+    except ValueError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+
+    try:
+        await run_in_threadpool(backend.load_model, name)
+    except (ValueError, UnsupportedRequest) as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return list_models()
+
+@app.post("/models/unload")
+async def unload_named_model(name: str = Form(...)):
+    """Drains in-flight requests on a model, then evicts it."""
+    try:
+        unloaded = await run_in_threadpool(backend.unload_model, name)
+    except (ValueError, UnsupportedRequest) as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return {"unloaded": unloaded, **list_models()}
 
 @app.post("/predict")
 async def predict(
     image: UploadFile = File(...),
-    instruction: str = Form(...)
+    instruction: str = Form(...),
+    min_pixels: Optional[int] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+    model: Optional[str] = Form(None),
+    speculative: Optional[bool] = Form(None),
+    session_id: Optional[str] = Form(None),
+    session_followup: Optional[str] = Form(None),
+    priority: Optional[str] = Form(None),
+    deadline: Optional[float] = Form(None)
 ):
-    if not model:
-        return JSONResponse(status_code=503, content={"error": "Model not loaded yet"})
+    """
+    Predicts the next action for one frame. With `session_id`, the turn is
+    appended to that server-side conversation instead of starting fresh;
+    `session_followup` then replaces the instruction after the first step.
+    `priority` is realtime, normal or background; `deadline` is a Unix
+    timestamp after which the answer is useless (504 if it is missed).
+    """
+    if server_state != "ready":
+        return JSONResponse(status_code=503, content={"error": f"Model not ready ({server_state})"})
 
     try:
-        # Read image
-        contents = await image.read()
-        pil_image = Image.open(io.BytesIO(contents)).convert("RGB")
-        
-        # Prepare messages
-        messages = [
-            {
-                "role": "user",
-                "content": [
+        min_pixels, max_pixels = resolve_budget(min_pixels, max_pixels)
+        model_name = backend.resolve_model(model)
+        priority = scheduler.resolve(priority)
+    except ValueError as e:
+        return error_response("predict", 400, e)
+
+    with track_request("predict"):
+        try:
+            timings = {}
+            with stage(timings, "upload_read"):
+                contents = await image.read()
+
+            async def compute():
+                with stage(timings, "image_decode"):
+                    pil_image = decode_image(contents, max_pixels)
+                    image_key = vision_cache.image_key(contents, pil_image, (min_pixels, max_pixels))
+
+                content = [
                     {
                         "type": "image",
                         "image": pil_image,
+                        "min_pixels": min_pixels,
+                        "max_pixels": max_pixels,
                     },
                     {"type": "text", "text": instruction},
-                ],
-            }
-        ]
+                ]
+                if session_id:
+                    return await run_in_threadpool(
+                        backend.predict_session, model_name, session_id, content, [image_key], timings, session_followup,
+                        priority, deadline,
+                    )
+                return await run_in_threadpool(
+                    backend.predict, model_name, content, [image_key], timings, speculative, priority, deadline
+                )
 
-        # Inference
-        text = processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
-        
-        image_inputs, video_inputs = process_vision_info(messages)
-        inputs = processor(
-            text=[text],
-            images=image_inputs,
-            videos=video_inputs,
-            padding=True,
-            return_tensors="pt",
-        )
-        
-        inputs = inputs.to(model.device)
+            if session_id:
+                # Session steps mutate server state, so they are never deduplicated.
+                response = await compute()
+                response["source"] = "session"
+                REQUESTS.inc(endpoint="predict", status="200")
+                return response
 
-        generated_ids = model.generate(**inputs, max_new_tokens=128)
-        generated_ids_trimmed = [
-            out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-        ]
-        output_text = processor.batch_decode(
-            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )
-        
-        return {"action": output_text[0]}
+            key = request_key(
+                "predict", model_name, use_draft(model_name, speculative), priority, contents, instruction,
+                min_pixels, max_pixels,
+            )
+            return await run_once("predict", key, compute, deadline)
 
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        except DeadlineExceeded as e:
+            return error_response("predict", 504, e)
+        except UnsupportedRequest as e:
+            # e.g. a session on a backend without sessions
+            return error_response("predict", 400, e)
+        except Exception as e:
+            return error_response("predict", 500, e)
+
+@app.post("/predict_clip")
+async def predict_clip(
+    frames: List[UploadFile] = File(...),
+    instruction: str = Form(...),
+    image: Optional[UploadFile] = File(None),
+    frame_max_pixels: Optional[int] = Form(None),
+    min_pixels: Optional[int] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+    model: Optional[str] = Form(None),
+    speculative: Optional[bool] = Form(None),
+    priority: Optional[str] = Form(None),
+    deadline: Optional[float] = Form(None)
+):
+    """
+    Predicts from a short clip. `frames` are ordered oldest to newest and are
+    fed through the video path; the optional `image` is the current frame at
+    full budget, placed after the clip.
+    """
+    if server_state != "ready":
+        return JSONResponse(status_code=503, content={"error": f"Model not ready ({server_state})"})
+    if len(frames) > MAX_CLIP_FRAMES:
+        return error_response("predict_clip", 400, ValueError(f"At most {MAX_CLIP_FRAMES} frames per clip"))
+
+    try:
+        min_pixels, max_pixels = resolve_budget(min_pixels, max_pixels)
+        model_name = backend.resolve_model(model)
+        priority = scheduler.resolve(priority)
+    except ValueError as e:
+        return error_response("predict_clip", 400, e)
+    frame_max_pixels = frame_max_pixels or CLIP_MAX_PIXELS
+
+    with track_request("predict_clip"):
+        try:
+            timings = {}
+            with stage(timings, "upload_read"):
+                frame_contents = [await frame.read() for frame in frames]
+                contents = await image.read() if image is not None else None
+
+            async def compute():
+                # Every frame must come out of the processor at the same size, so they
+                # all share one budget.
+                with stage(timings, "image_decode"):
+                    clip = [decode_image(frame, frame_max_pixels) for frame in frame_contents]
+                    content = [
+                        {
+                            "type": "video",
+                            "video": clip,
+                            "min_pixels": min(min_pixels, frame_max_pixels),
+                            "max_pixels": frame_max_pixels,
+                        },
+                    ]
+
+                    image_keys = []
+                    if contents is not None:
+                        pil_image = decode_image(contents, max_pixels)
+                        image_keys.append(vision_cache.image_key(contents, pil_image, (min_pixels, max_pixels)))
+                        content.append({
+                            "type": "image",
+                            "image": pil_image,
+                            "min_pixels": min_pixels,
+                            "max_pixels": max_pixels,
+                        })
+                content.append({"type": "text", "text": instruction})
+
+                response = await run_in_threadpool(
+                    backend.predict, model_name, content, image_keys, timings, speculative, priority, deadline
+                )
+                response["frames"] = len(clip)
+                return response
+
+            key = request_key(
+                "predict_clip", model_name, use_draft(model_name, speculative), priority, *frame_contents, contents, instruction,
+                frame_max_pixels, min_pixels, max_pixels,
+            )
+            return await run_once("predict_clip", key, compute, deadline)
+
+        except DeadlineExceeded as e:
+            return error_response("predict_clip", 504, e)
+        except UnsupportedRequest as e:
+            return error_response("predict_clip", 400, e)
+        except Exception as e:
+            return error_response("predict_clip", 500, e)
+
+@app.post("/predict_multi")
+async def predict_multi(
+    image: UploadFile = File(...),
+    instructions: List[str] = Form(...),
+    min_pixels: Optional[int] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+    model: Optional[str] = Form(None),
+    priority: Optional[str] = Form(None),
+    deadline: Optional[float] = Form(None)
+):
+    """
+    Answers several instructions about one image. The image is uploaded and
+    decoded once, all instructions run as one padded batch, and (unless
+    VISION_CACHE_MB=0) the vision tower encodes it once and every row reuses
+    those features. Only the vision features are shared: each row still
+    prefills the whole prompt, image tokens included, into its own KV cache.
+    Returns `answers`, one per instruction, in order.
+    """
+    if server_state != "ready":
+        return JSONResponse(status_code=503, content={"error": f"Model not ready ({server_state})"})
+    if len(instructions) > MAX_BATCH_SIZE:
+        return error_response("predict_multi", 400, ValueError(f"At most {MAX_BATCH_SIZE} instructions per image"))
+
+    try:
+        min_pixels, max_pixels = resolve_budget(min_pixels, max_pixels)
+        model_name = backend.resolve_model(model)
+        priority = scheduler.resolve(priority)
+    except ValueError as e:
+        return error_response("predict_multi", 400, e)
+
+    with track_request("predict_multi"):
+        try:
+            timings = {}
+            with stage(timings, "upload_read"):
+                contents = await image.read()
+
+            async def compute():
+                with stage(timings, "image_decode"):
+                    pil_image = decode_image(contents, max_pixels)
+                    image_key = vision_cache.image_key(contents, pil_image, (min_pixels, max_pixels))
+
+                # One image key for every row, so the vision cache encodes it once.
+                image_item = {"type": "image", "image": pil_image, "min_pixels": min_pixels, "max_pixels": max_pixels}
+                batch = [[image_item, {"type": "text", "text": instruction}] for instruction in instructions]
+                results = await run_in_threadpool(
+                    backend.predict_batch, model_name, batch, [image_key] * len(batch), timings, priority, deadline
+                )
+                return {
+                    "answers": [
+                        {key: value for key, value in result.items() if key != "timings"}
+                        for result in results
+                    ],
+                    "model": model_name,
+                    "timings": timings,
+                }
+
+            key = request_key(
+                "predict_multi", model_name, priority, contents, instructions, min_pixels, max_pixels,
+            )
+            return await run_once("predict_multi", key, compute, deadline)
+
+        except DeadlineExceeded as e:
+            return error_response("predict_multi", 504, e)
+        except UnsupportedRequest as e:
+            return error_response("predict_multi", 400, e)
+        except Exception as e:
+            return error_response("predict_multi", 500, e)
+
+@app.post("/predict_batch")
+async def predict_batch(
+    images: List[UploadFile] = File(...),
+    instructions: List[str] = Form(...),
+    min_pixels: Optional[int] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+    model: Optional[str] = Form(None),
+    batch_size: Optional[int] = Form(None),
+    priority: Optional[str] = Form("background")
+):
+    """
+    Offline evaluation: predicts for many images in padded batches of
+    `batch_size`. `instructions` holds one instruction per image, or a single
+    one shared by all. Streams one JSON line per image, tagged with its
+    `index`, as each batch completes, then a final summary line.
+    """
+    if server_state != "ready":
+        return JSONResponse(status_code=503, content={"error": f"Model not ready ({server_state})"})
+    if len(instructions) not in (1, len(images)):
+        return error_response("predict_batch", 400, ValueError("Send one instruction, or one per image"))
+
+    try:
+        min_pixels, max_pixels = resolve_budget(min_pixels, max_pixels)
+        model_name = backend.resolve_model(model)
+        priority = scheduler.resolve(priority)
+    except ValueError as e:
+        return error_response("predict_batch", 400, e)
+    batch_size = max(1, min(batch_size or PREDICT_BATCH_SIZE, MAX_BATCH_SIZE))
+    instructions = instructions * len(images) if len(instructions) == 1 else instructions
+    uploads = [await image.read() for image in images]
+
+    def prepare(indices):
+        """Decodes one batch's images; runs in a worker thread while the previous batch generates."""
+        contents, image_keys = [], []
+        for i in indices:
+            pil_image = decode_image(uploads[i], max_pixels)
+            image_keys.append(vision_cache.image_key(uploads[i], pil_image, (min_pixels, max_pixels)))
+            contents.append([
+                {"type": "image", "image": pil_image, "min_pixels": min_pixels, "max_pixels": max_pixels},
+                {"type": "text", "text": instructions[i]},
+            ])
+        return contents, image_keys
+
+    async def stream():
+        with track_request("predict_batch"):
+            start = time.perf_counter()
+            batches = [list(range(i, min(i + batch_size, len(uploads)))) for i in range(0, len(uploads), batch_size)]
+            failed = 0
+            next_batch = asyncio.ensure_future(run_in_threadpool(prepare, batches[0])) if batches else None
+            for n, indices in enumerate(batches):
+                timings = {}
+                prepared = next_batch
+                if n + 1 < len(batches):
+                    next_batch = asyncio.ensure_future(run_in_threadpool(prepare, batches[n + 1]))
+                try:
+                    with stage(timings, "image_decode"):
+                        contents, image_keys = await prepared
+                    results = await run_in_threadpool(
+                        backend.predict_batch, model_name, contents, image_keys, timings, priority
+                    )
+                except Exception as e:
+                    ERRORS.inc(endpoint="predict_batch", type=type(e).__name__)
+                    results = [{"error": str(e)}] * len(indices)
+                for i, result in zip(indices, results):
+                    failed += "error" in result
+                    yield json.dumps({"index": i, **result}) + "\n"
+            REQUESTS.inc(endpoint="predict_batch", status="200")
+            yield json.dumps({
+                "done": True,
+                "count": len(uploads),
+                "failed": failed,
+                "batch_size": batch_size,
+                "seconds": round(time.perf_counter() - start, 3),
+            }) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
     # Run with: uvicorn server:app --host 0.0.0.0 --port 8000
@@ -0,0 +1,142 @@
+"""
+Server-side conversation sessions that keep the model's KV cache between steps.
+
+Each step appends only the new turn to the cached conversation, so prefill
+cost stays flat as history grows. Old turns are cut out of the cache once a
+session exceeds its turn limit. Sessions expire after an idle timeout, and
+the least recently used ones are dropped when their caches exceed a global
+memory cap.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+
+def _cache_tensors(cache):
+    """(keys, values) tensor pairs per layer, for old (key_cache lists) and new (layers) DynamicCache."""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers if getattr(layer, "keys", None) is not None]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def cache_nbytes(cache) -> int:
+    return sum(
+        t.numel() * t.element_size()
+        for pair in _cache_tensors(cache) for t in pair
+    )
+
+
+def drop_cache_span(cache, start: int, end: int):
+    """Removes cached positions [start, end) from every layer."""
+    def cut(t):
+        return torch.cat([t[..., :start, :], t[..., end:, :]], dim=-2)
+
+    if hasattr(cache, "layers"):
+        for layer in cache.layers:
+            if getattr(layer, "keys", None) is not None:
+                layer.keys, layer.values = cut(layer.keys), cut(layer.values)
+    else:
+        for i in range(len(cache.key_cache)):
+            cache.key_cache[i] = cut(cache.key_cache[i])
+            cache.value_cache[i] = cut(cache.value_cache[i])
+    if hasattr(cache, "_seen_tokens"):
+        cache._seen_tokens -= end - start
+
+
+class Session:
+    def __init__(self, session_id: str, entry):
+        self.id = session_id
+        # Registry entry the cache was built with; a reloaded model invalidates it.
+        self.entry = entry
+        self.cache = None
+        self.seq_len = 0          # tokens currently in the cache
+        self.next_position = 0    # next M-RoPE position; keeps growing when turns are cut
+        self.pending_ids = []     # turn-closing tokens not yet fed to the model
+        self.prefix_len = 0       # system prompt tokens, never cut
+        # [start, end) cache span of each retained turn. The first turn carries
+        # the real instruction (later ones only a follow-up), so it is never cut.
+        self.turns = []
+        self.steps = 0
+        self.nbytes = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def is_new(self) -> bool:
+        return self.cache is None
+
+    def trim(self, max_turns: int):
+        """
+        Cuts the oldest turns after the first out of the cache until at most
+        `max_turns` remain (never fewer than the first and the latest).
+        """
+        while len(self.turns) > max(max_turns, 2):
+            start, end = self.turns.pop(1)
+            drop_cache_span(self.cache, start, end)
+            length = end - start
+            self.seq_len -= length
+            self.turns = [[s - length, e - length] if s >= end else [s, e] for s, e in self.turns]
+
+
+class SessionStore:
+    def __init__(self, max_turns: int, idle_timeout: float, max_bytes: int):
+        self.max_turns = max_turns
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, entry) -> Session:
+        """Returns the session for `session_id`, creating or resetting it if needed."""
+        self.expire_idle()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.entry is not entry:
+                session = self._sessions[session_id] = Session(session_id, entry)
+                self.created += 1
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def update(self, session: Session):
+        """Re-measures a session after a step and evicts LRU sessions over the memory cap."""
+        session.nbytes = cache_nbytes(session.cache) if session.cache is not None else 0
+        with self._lock:
+            total = sum(s.nbytes for s in self._sessions.values())
+            for session_id in list(self._sessions):
+                if total <= self.max_bytes:
+                    break
+                if session_id == session.id:
+                    continue
+                total -= self._sessions.pop(session_id).nbytes
+                self.evicted += 1
+
+    def expire_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            for session_id in [sid for sid, s in self._sessions.items() if s.last_used < cutoff]:
+                del self._sessions[session_id]
+                self.expired += 1
+
+    def end(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "bytes": sum(s.nbytes for s in self._sessions.values()),
+                "max_bytes": self.max_bytes,
+                "max_turns": self.max_turns,
+                "idle_timeout": self.idle_timeout,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
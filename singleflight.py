@@ -0,0 +1,94 @@
+"""
+Single-flight deduplication of identical requests.
+
+While a computation for a key is running, later callers with the same key
+await its result instead of starting their own. Completed results can
+optionally be kept for a short TTL. All methods run on the event loop
+thread, so no locking is needed.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+
+def request_key(*parts) -> str:
+    """Content hash of a request; bytes parts are hashed raw, everything else by repr."""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else repr(part).encode()
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    def __init__(self, result_ttl: float = 0.0, max_results: int = 256):
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self.executed = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self._inflight = {}  # key -> asyncio.Future
+        self._results = OrderedDict()  # key -> (expires_at, result)
+
+    async def run(self, key: str, fn, timeout=None, retry_on=()):
+        """
+        Returns (result, source) for `key`, where source is "executed" when this
+        caller ran `fn`, "coalesced" when it joined a running call, or "cache".
+        `fn` is an async callable returning a dict; its exceptions propagate to
+        every waiter, except those in `retry_on`, which only concern the caller
+        that ran it: a follower that sees one runs (or joins) the call again.
+        A follower gives up with asyncio.TimeoutError after `timeout` seconds.
+        """
+        while True:
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    self.cache_hits += 1
+                    return dict(cached[1]), "cache"
+                del self._results[key]
+
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            self.coalesced += 1
+            try:
+                # shield() so a disconnecting follower cannot cancel the leader's work.
+                return dict(await asyncio.wait_for(asyncio.shield(future), timeout)), "coalesced"
+            except retry_on:
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.executed += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody else was waiting.
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        future.set_result(result)
+        if self.result_ttl > 0:
+            self._results[key] = (time.monotonic() + self.result_ttl, result)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return dict(result), "executed"
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "cache_hits": self.cache_hits,
+            "cached_results": len(self._results),
+            "result_ttl": self.result_ttl,
+        }
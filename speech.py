@@ -0,0 +1,187 @@
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+# The same message again within this many seconds is not repeated.
+SPEECH_DEDUP_SECONDS = float(os.environ.get("SPEECH_DEDUP_SECONDS", 10))
+# Messages that waited longer than this are no longer worth saying.
+SPEECH_MAX_AGE_SECONDS = float(os.environ.get("SPEECH_MAX_AGE_SECONDS", 5))
+
+
+class CommandBackend:
+    """Speaks through a TTS command that takes the message as its last argument (no shell involved)."""
+
+    def __init__(self, command: list):
+        self.command = command
+
+    def speak(self, message: str):
+        return subprocess.Popen(self.command + [message], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait(self, handle):
+        handle.wait()
+
+    def stop(self, handle):
+        if handle.poll() is None:
+            handle.terminate()
+
+
+class NullBackend:
+    """Says nothing."""
+
+    def speak(self, message: str):
+        return None
+
+    def wait(self, handle):
+        pass
+
+    def stop(self, handle):
+        pass
+
+
+class RecordingBackend:
+    """Records what would have been said, taking `seconds` per message; for tests."""
+
+    def __init__(self, seconds: float = 0.0):
+        self.seconds = seconds
+        self.spoken = []  # (monotonic time, message)
+        self.interrupted = []
+
+    def speak(self, message: str):
+        self.spoken.append((time.monotonic(), message))
+        return {"message": message, "done": threading.Event()}
+
+    def wait(self, handle):
+        handle["done"].wait(self.seconds)
+
+    def stop(self, handle):
+        self.interrupted.append(handle["message"])
+        handle["done"].set()
+
+
+# Linux TTS commands in order of preference; spd-say needs --wait to block until done.
+LINUX_COMMANDS = [["espeak-ng"], ["espeak"], ["spd-say", "--wait"]]
+
+
+def pick_backend(name: str = None):
+    """
+    The backend named by `name` or SPEECH_BACKEND (say, espeak-ng, espeak,
+    spd-say, null, recording), or by default the first TTS command this
+    platform has: `say` on macOS, then espeak-ng, espeak or spd-say.
+    Falls back to the null backend when none is installed.
+    """
+    name = name or os.environ.get("SPEECH_BACKEND", "auto")
+    if name == "null":
+        return NullBackend()
+    if name == "recording":
+        return RecordingBackend()
+    if name != "auto":
+        command = next((c for c in LINUX_COMMANDS if c[0] == name), [name])
+        return CommandBackend(command)
+
+    candidates = [["say"]] if platform.system() == "Darwin" else LINUX_COMMANDS
+    for command in candidates:
+        if shutil.which(command[0]):
+            return CommandBackend(command)
+    print("No text-to-speech command found; speech is printed only")
+    return NullBackend()
+
+
+class Speaker:
+    """
+    Speaks messages on a background thread so callers continue at once.
+
+    Messages wait in a bounded queue; when it is full the oldest waiting one
+    is dropped. A message repeated within `dedup_seconds` of the last time
+    it was queued is ignored, and one that waited more than `max_age`
+    seconds is skipped. `say(..., interrupt=True)` cuts off the message
+    being spoken and discards the waiting ones.
+    """
+
+    def __init__(self, backend=None, max_pending: int = 4, dedup_seconds: float = SPEECH_DEDUP_SECONDS,
+                 max_age: float = SPEECH_MAX_AGE_SECONDS):
+        self.backend = backend if backend is not None else pick_backend()
+        self.dedup_seconds = dedup_seconds
+        self.max_age = max_age
+        self.counts = {"spoken": 0, "deduplicated": 0, "dropped": 0, "stale": 0, "interrupted": 0}
+        self._last_queued = {}  # normalized message -> monotonic time
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._current = None
+        self._thread = threading.Thread(target=self._run, name="speech", daemon=True)
+        self._thread.start()
+
+    def say(self, message: str, interrupt: bool = False) -> bool:
+        """Queues a message; returns False when it was suppressed as a duplicate."""
+        now = time.monotonic()
+        key = " ".join(message.lower().split())
+        with self._lock:
+            if now - self._last_queued.get(key, float("-inf")) < self.dedup_seconds:
+                self.counts["deduplicated"] += 1
+                return False
+            self._last_queued[key] = now
+            if interrupt:
+                self._discard_pending()
+                if self._current is not None:
+                    self.backend.stop(self._current)
+                    self.counts["interrupted"] += 1
+            # One producer side under the lock, so the slot freed here stays free.
+            if self._queue.full():
+                self._discard_pending(1)
+            self._queue.put_nowait((now, message))
+        return True
+
+    def stop(self):
+        """Silences the current message and drops the waiting ones."""
+        with self._lock:
+            self._discard_pending()
+            if self._current is not None:
+                self.backend.stop(self._current)
+
+    def close(self):
+        self.stop()
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts, pending=self._queue.qsize())
+
+    def _discard_pending(self, limit: int = None):
+        discarded = 0
+        while limit is None or discarded < limit:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Keep the close() sentinel.
+                self._queue.put_nowait(None)
+                break
+            discarded += 1
+        self.counts["dropped"] += discarded
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            queued_at, message = item
+            with self._lock:
+                if time.monotonic() - queued_at > self.max_age:
+                    self.counts["stale"] += 1
+                    continue
+                try:
+                    self._current = handle = self.backend.speak(message)
+                except OSError as e:
+                    print(f"Speech failed: {e}")
+                    continue
+                self.counts["spoken"] += 1
+            try:
+                self.backend.wait(handle)
+            finally:
+                with self._lock:
+                    self._current = None
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Minimal OpenAI-compatible chat-completions server for exercising the
+server's openai backend without a GPU. Answers every request with a fixed
+action, streamed word by word, and reports how many images it received.
+
+    python stub_openai_server.py [port] [token_delay_seconds]
+    BACKEND=openai OPENAI_BASE_URL=http://localhost:8001/v1 python server.py
+    python test_server.py
+"""
+
+import json
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ACTION = '{"type": "wait", "duration": 1.0}'
+MODEL = "stub"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    token_delay = 0.01
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": MODEL, "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        parts = [part for message in request["messages"] for part in message["content"]]
+        images = sum(1 for part in parts if part.get("type") == "image_url")
+        tokens = ACTION.split(" ")
+        tokens = [token + " " for token in tokens[:-1]] + tokens[-1:]
+        # Pretend every image costs a fixed number of prompt tokens.
+        usage = {"prompt_tokens": 20 + 256 * images, "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        print(f"chat completion: {images} image(s), stream={request.get('stream', False)}")
+
+        if not request.get("stream"):
+            time.sleep(self.token_delay * len(tokens))
+            self._send_json(200, {
+                "object": "chat.completion",
+                "model": request.get("model", MODEL),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ACTION}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(self.token_delay)
+                self._send_event({"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+            self._send_event({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self._send_event({"choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            print("client closed the stream")
+
+    def _send_event(self, event: dict):
+        event = {"object": "chat.completion.chunk", "model": MODEL, **event}
+        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+    StubHandler.token_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    server = ThreadingHTTPServer(("0.0.0.0", port), StubHandler)
+    print(f"Stub OpenAI server on http://localhost:{port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
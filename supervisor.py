@@ -0,0 +1,264 @@
+"""
+Multi-replica front end for the model server.
+
+Starts WORKERS copies of server.py, each on its own local port and pinned to
+a disjoint set of cores and, with WORKER_GPUS, to one GPU. Without
+WORKER_GPUS the workers see every GPU; they are hidden only on hosts without
+one or with WORKER_CPU_ONLY=1. The supervisor listens on the public port and forwards every request to the
+ready worker with the fewest requests in flight. Requests carrying an
+X-Session-Id header stick to one worker, since session caches live there.
+Workers that exit are restarted; the public port stays up meanwhile and
+traffic goes to the remaining workers.
+
+    WORKERS=4 python supervisor.py
+    WORKERS=2 WORKER_GPUS=0,1 python supervisor.py
+
+Worker memory budgets are per process; when workers share a GPU, lower
+MODEL_MEMORY_BUDGET_GB accordingly.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+import requests
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+WORKERS = int(os.getenv("WORKERS", 2))
+WORKER_GPUS = [gpu for gpu in os.getenv("WORKER_GPUS", "").split(",") if gpu]
+WORKER_CPU_ONLY = os.getenv("WORKER_CPU_ONLY") == "1"
+PORT = int(os.getenv("PORT", 8000))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 8100))
+# A worker that keeps crashing is restarted at most this often.
+RESTART_BACKOFF_SECONDS = float(os.getenv("RESTART_BACKOFF_SECONDS", 5))
+HEALTH_INTERVAL_SECONDS = float(os.getenv("HEALTH_INTERVAL_SECONDS", 1))
+
+# Hop-by-hop and length headers are recomputed on each leg of the proxy.
+# requests also undoes any content encoding while streaming.
+SKIPPED_HEADERS = {"host", "content-length", "connection", "transfer-encoding", "keep-alive", "content-encoding"}
+
+app = FastAPI(title="Lumine Agent Brain (supervisor)")
+
+
+def cpu_sets(count: int) -> list:
+    """Splits the cores this process may use into `count` disjoint, contiguous sets."""
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * count
+    cores = sorted(os.sched_getaffinity(0))
+    size = max(1, len(cores) // count)
+    return [set(cores[i * size:(i + 1) * size]) or set(cores) for i in range(count)]
+
+
+def has_gpu() -> bool:
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.device_count() > 0
+
+
+class Worker:
+    def __init__(self, index: int, port: int, gpu=None, cpus=None, hide_gpus: bool = False):
+        self.index = index
+        self.port = port
+        self.gpu = gpu
+        self.cpus = cpus
+        self.hide_gpus = hide_gpus
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = None
+        self.status = "stopped"
+        self.in_flight = 0
+        self.served = 0
+        self.restarts = 0
+        self.started_at = 0.0
+
+    def start(self):
+        env = dict(os.environ)
+        if self.gpu is not None:
+            env["CUDA_VISIBLE_DEVICES"] = self.gpu
+        elif self.hide_gpus:
+            env["CUDA_VISIBLE_DEVICES"] = ""
+        if self.cpus:
+            # Size the intra-op thread pools to the pinned cores.
+            for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+                env[name] = str(len(self.cpus))
+
+        cpus = self.cpus
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(self.port)],
+            env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None,
+        )
+        self.status = "loading"
+        self.started_at = time.monotonic()
+        print(f"Worker {self.index} started (pid {self.process.pid}, port {self.port}, "
+              f"gpu {'none' if self.hide_gpus else self.gpu or 'all'}, cpus {sorted(cpus) if cpus else 'all'})")
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "pid": self.process.pid if self.process else None,
+            "status": self.status,
+            "gpu": self.gpu,
+            "cpus": sorted(self.cpus) if self.cpus else None,
+            "in_flight": self.in_flight,
+            "served": self.served,
+            "restarts": self.restarts,
+        }
+
+
+class Supervisor:
+    def __init__(self, count: int, base_port: int, gpus: list):
+        sets = cpu_sets(count)
+        hide_gpus = not gpus and (WORKER_CPU_ONLY or not has_gpu())
+        self.workers = [
+            Worker(i, base_port + i, gpus[i % len(gpus)] if gpus else None, sets[i], hide_gpus)
+            for i in range(count)
+        ]
+        self.retried = 0
+        self.stopping = False
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self._monitor, name="worker-monitor", daemon=True).start()
+
+    def _monitor(self):
+        """Restarts exited workers and tracks readiness through each worker's /health."""
+        while not self.stopping:
+            for worker in self.workers:
+                if worker.process.poll() is not None:
+                    if worker.status != "crashed":
+                        print(f"Worker {worker.index} exited with code {worker.process.returncode}")
+                        worker.status = "crashed"
+                    if time.monotonic() - worker.started_at >= RESTART_BACKOFF_SECONDS:
+                        worker.restarts += 1
+                        worker.start()
+                    continue
+                try:
+                    status = self._session.get(f"{worker.url}/health", timeout=2).json().get("status")
+                except (requests.RequestException, ValueError):
+                    status = "loading"
+                worker.status = status or "loading"
+            time.sleep(HEALTH_INTERVAL_SECONDS)
+
+    def stop(self):
+        self.stopping = True
+        for worker in self.workers:
+            if worker.process and worker.process.poll() is None:
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process:
+                worker.process.wait()
+
+    def pick(self, session_id=None, exclude=()):
+        """The ready worker with the fewest requests in flight, or the session's sticky worker."""
+        with self._lock:
+            ready = [w for w in self.workers if w.status == "ready" and w.index not in exclude]
+            if not ready:
+                return None
+            if session_id:
+                # Hash over all workers so a session keeps its worker while
+                # others come and go; fall back if that one is down.
+                worker = self.workers[zlib.crc32(session_id.encode()) % len(self.workers)]
+                if worker in ready:
+                    worker.in_flight += 1
+                    return worker
+            worker = min(ready, key=lambda w: w.in_flight)
+            worker.in_flight += 1
+            return worker
+
+    def done(self, worker: Worker):
+        with self._lock:
+            worker.in_flight -= 1
+            worker.served += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": [worker.stats() for worker in self.workers],
+            "retried": self.retried,
+        }
+
+
+supervisor = Supervisor(WORKERS, WORKER_BASE_PORT, WORKER_GPUS)
+
+
+@app.on_event("startup")
+async def start_workers():
+    supervisor.start()
+
+
+@app.on_event("shutdown")
+def stop_workers():
+    supervisor.stop()
+
+
+@app.get("/health")
+def health_check():
+    """Ready as soon as one worker is."""
+    statuses = [worker.status for worker in supervisor.workers]
+    return {
+        "status": "ready" if "ready" in statuses else "loading",
+        "workers_ready": statuses.count("ready"),
+        "workers": len(statuses),
+    }
+
+
+@app.get("/supervisor/stats")
+def supervisor_stats():
+    return supervisor.stats()
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "DELETE"])
+async def proxy(path: str, request: Request):
+    body = await request.body()
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in SKIPPED_HEADERS}
+    session_id = request.headers.get("x-session-id")
+    url_path = f"/{path}" + (f"?{request.url.query}" if request.url.query else "")
+
+    # A worker that dies before answering gets the request retried once on another.
+    tried = set()
+    for _ in range(2):
+        worker = supervisor.pick(session_id, exclude=tried)
+        if worker is None:
+            break
+        tried.add(worker.index)
+        try:
+            response = await run_in_threadpool(
+                supervisor._session.request, request.method, worker.url + url_path,
+                data=body, headers=headers, stream=True, timeout=(5, None),
+            )
+        except requests.ConnectionError:
+            supervisor.done(worker)
+            with supervisor._lock:
+                supervisor.retried += 1
+            continue
+
+        async def relay(response=response, worker=worker):
+            try:
+                async for chunk in iterate_in_threadpool(response.iter_content(chunk_size=None)):
+                    yield chunk
+            finally:
+                response.close()
+                supervisor.done(worker)
+
+        return StreamingResponse(
+            relay(),
+            status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in SKIPPED_HEADERS},
+        )
+
+    return JSONResponse(status_code=503, content={"error": "No model worker is ready"})
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=PORT)
@@ -2,10 +2,16 @@
 """
 Batch test script for testing multiple game screenshots with RemoteVLM.
 Tests all images in testing/screenshots/ and generates a detailed report.
+
+By default all screenshots go to the server's /predict_batch endpoint in one
+request; --sequential sends them one at a time through /predict instead.
+Usage: python test_batch_screenshots.py [--sequential] [--batch-size N]
 """
 
 import os
 import sys
+import time
+import argparse
 import base64
 from pathlib import Path
 from PIL import Image
@@ -23,6 +29,11 @@ from model import RemoteVLM
 SCREENSHOTS_DIR = "testing/screenshots"
 RESULTS_DIR = "testing/results"
 SERVER_URL = "http://91.150.160.37:43002"
+INSTRUCTION = (
+    "You are a game-playing AI agent. Analyze this Genshin Impact screenshot "
+    "and describe: 1) What you see in the scene, 2) Character/UI information visible, "
+    "3) What action or objective seems most appropriate next."
+)
 
 def setup_directories():
     """Create necessary directories if they don't exist."""
@@ -65,14 +76,8 @@ def test_screenshot(model, screenshot_path):
             raise ValueError(f"Failed to load image: {screenshot_path}")
 
         # Test with model
-        instruction = (
-            "You are a game-playing AI agent. Analyze this Genshin Impact screenshot "
-            "and describe: 1) What you see in the scene, 2) Character/UI information visible, "
-            "3) What action or objective seems most appropriate next."
-        )
-
         print(f"\n🤖 Querying model...")
-        response = model.predict(image_array, instruction)
+        response = model.predict(image_array, INSTRUCTION)
 
         print(f"\n📝 Model Response:")
         print(f"{'-'*70}")
@@ -100,6 +105,56 @@ def test_screenshot(model, screenshot_path):
             'error': error_msg
         }
 
+def test_screenshots_batch(model, screenshots, batch_size=None):
+    """Tests all screenshots in one /predict_batch request; returns results in input order."""
+    results = [None] * len(screenshots)
+    images = []
+    for i, screenshot_path in enumerate(screenshots):
+        image_array = cv2.imread(str(screenshot_path))
+        if image_array is None:
+            results[i] = {
+                'success': False,
+                'file': screenshot_path.name,
+                'size': None,
+                'file_size_kb': None,
+                'response': None,
+                'error': f"Failed to load image: {screenshot_path}"
+            }
+        else:
+            images.append((i, image_array))
+
+    print(f"🤖 Sending {len(images)} screenshot(s) in one batch request...")
+    try:
+        for item in model.predict_batch([image for _, image in images], [INSTRUCTION], batch_size=batch_size):
+            i, image_array = images[item['index']]
+            screenshot_path = screenshots[i]
+            height, width = image_array.shape[:2]
+            error = item.get('error')
+            results[i] = {
+                'success': error is None,
+                'file': screenshot_path.name,
+                'size': f"{width}x{height}",
+                'file_size_kb': f"{screenshot_path.stat().st_size / 1024:.1f}",
+                'response': item.get('action'),
+                'error': error
+            }
+            status = f"❌ {error}" if error else f"✓ {item.get('generated_tokens', 0)} tokens"
+            print(f"  [{i + 1}/{len(screenshots)}] {screenshot_path.name}: {status}")
+    except Exception as e:
+        print(f"\n❌ Batch request failed: {e}")
+
+    for i, screenshot_path in enumerate(screenshots):
+        if results[i] is None:
+            results[i] = {
+                'success': False,
+                'file': screenshot_path.name,
+                'size': None,
+                'file_size_kb': None,
+                'response': None,
+                'error': "No result from batch request"
+            }
+    return results
+
 def generate_report(results):
     """Generate a summary report of all tests."""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -143,6 +198,11 @@ def generate_report(results):
 
 def main():
     """Main test execution."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sequential", action="store_true", help="send screenshots one at a time via /predict")
+    parser.add_argument("--batch-size", type=int, default=None, help="GPU batch size (server default if omitted)")
+    args = parser.parse_args()
+
     print("="*70)
     print("BATCH SCREENSHOT TESTING WITH QWEN2-VL")
     print("="*70)
@@ -169,11 +229,12 @@ def main():
     model = RemoteVLM(server_url=SERVER_URL)
     print("✓ Connected\n")
 
-    # Test each screenshot
-    results = []
-    for screenshot in screenshots:
-        result = test_screenshot(model, screenshot)
-        results.append(result)
+    start = time.perf_counter()
+    if args.sequential:
+        results = [test_screenshot(model, screenshot) for screenshot in screenshots]
+    else:
+        results = test_screenshots_batch(model, screenshots, args.batch_size)
+    elapsed = time.perf_counter() - start
 
     # Generate report
     print(f"\n{'='*70}")
@@ -193,6 +254,7 @@ def main():
     print(f"Total tests: {len(results)}")
     print(f"✓ Successful: {successful}")
     print(f"✗ Failed: {failed}")
+    print(f"⏱  Total time: {elapsed:.1f}s ({elapsed / len(results):.2f}s per screenshot)")
     print(f"{'='*70}")
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+"""
+Checks for model_registry.ModelRegistry that need no real model.
+
+    python -m pytest test_model_registry.py
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+from model_registry import ModelRegistry
+
+MODEL_BYTES = 1000
+
+
+class FakeTensor:
+    def numel(self):
+        return MODEL_BYTES
+
+    def element_size(self):
+        return 1
+
+
+class FakeModel:
+    def parameters(self):
+        return [FakeTensor()]
+
+    def buffers(self):
+        return []
+
+
+def make_registry(root: str, names: list, budget: int) -> ModelRegistry:
+    for name in names:
+        os.makedirs(os.path.join(root, name))
+        with open(os.path.join(root, name, "model.safetensors"), "wb") as f:
+            f.write(b"\0" * MODEL_BYTES)
+    return ModelRegistry(
+        {name: name for name in names}, names[0], budget,
+        loader=lambda path: (FakeModel(), None),
+        resolve_path=lambda model_id: os.path.join(root, model_id),
+    )
+
+
+def test_model_and_draft_checkouts_do_not_deadlock():
+    # Room for two models: x and y are loaded, and both requests need the draft
+    # too. Each request must evict the model the other one is using.
+    with tempfile.TemporaryDirectory() as root:
+        registry = make_registry(root, ["x", "y", "draft"], budget=2 * MODEL_BYTES)
+        for name in ("x", "y"):
+            with registry.acquire(name):
+                pass
+
+        started = threading.Barrier(2)
+        done = []
+
+        def request(name):
+            started.wait()
+            with registry.acquire_many([name, "draft"]) as (entry, draft):
+                assert (entry.name, draft.name) == (name, "draft")
+                time.sleep(0.05)
+            done.append(name)
+
+        threads = [threading.Thread(target=request, args=(name,), daemon=True) for name in ("x", "y")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        assert not any(thread.is_alive() for thread in threads), "checkouts deadlocked"
+        assert sorted(done) == ["x", "y"]
+        assert registry.stats()["memory_used"] <= 2 * MODEL_BYTES
+
+
+def test_acquire_many_releases_on_load_failure():
+    with tempfile.TemporaryDirectory() as root:
+        registry = make_registry(root, ["x", "broken"], budget=2 * MODEL_BYTES)
+        loader = registry.loader
+        registry.loader = lambda path: loader(path) if not path.endswith("broken") else 1 / 0
+        try:
+            with registry.acquire_many(["x", "broken"]):
+                pass
+        except ZeroDivisionError:
+            pass
+        assert registry.stats()["loaded"]["x"]["in_flight"] == 0
+
+
+if __name__ == "__main__":
+    test_model_and_draft_checkouts_do_not_deadlock()
+    test_acquire_many_releases_on_load_failure()
+    print("ok")
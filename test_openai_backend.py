@@ -0,0 +1,57 @@
+"""
+Checks backends.OpenAIBackend against stub_openai_server.py, no GPU needed.
+
+    python -m pytest test_openai_backend.py
+"""
+
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+from backends import OpenAIBackend, UnsupportedRequest
+from scheduler import DeadlineExceeded
+from stub_openai_server import ACTION, StubHandler
+
+CONTENT = [{"type": "text", "text": "What should I do next?"}]
+
+
+@pytest.fixture
+def backend():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield OpenAIBackend(f"http://127.0.0.1:{server.server_address[1]}/v1", "stub", timeout=10)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_predict_streams_the_whole_action(backend):
+    timings = {}
+    response = backend.predict("stub", CONTENT, [], timings)
+    assert response["action"] == ACTION
+    assert response["generated_tokens"] == len(ACTION.split(" "))
+    assert response["input_tokens"] == 20
+    assert {"prefill", "decode"} <= set(timings)
+    assert backend.stats()["requests"] == 1 and backend.stats()["failures"] == 0
+
+
+def test_predict_drops_requests_past_their_deadline(backend):
+    with pytest.raises(DeadlineExceeded):
+        backend.predict("stub", CONTENT, [], {}, deadline=time.time() - 1)
+    assert backend.stats()["requests"] == 0
+
+
+def test_sessions_are_rejected_as_bad_requests(backend):
+    # The server answers UnsupportedRequest with 400.
+    with pytest.raises(UnsupportedRequest):
+        backend.predict_session("stub", "session", CONTENT, [], {})
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q"])
@@ -1,9 +1,12 @@
+import io
+import os
+
 import requests
 from PIL import Image
-import io
 
-# Test the deployed Qwen2-VL server
-SERVER_URL = "http://91.150.160.37:43002"
+# Smoke-tests a running server, by default a local one:
+#     SERVER_URL=http://host:port python test_server.py
+SERVER_URL = os.environ.get("SERVER_URL", "http://localhost:8000").rstrip("/")
 
 print("=" * 60)
 print("TESTING QWEN2-VL SERVER")
@@ -13,7 +16,7 @@ print(f"\nServer: {SERVER_URL}")
 # Test health endpoint
 print("\n[1/2] Testing health endpoint...")
 try:
-    response = requests.get(f"{SERVER_URL}/")
+    response = requests.get(f"{SERVER_URL}/health")
     print(f"Status: {response.status_code}")
     print(f"Response: {response.json()}")
 except Exception as e:
@@ -0,0 +1,54 @@
+"""
+Checks for sessions.Session that run on CPU without a model.
+
+    python -m pytest test_sessions.py
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from sessions import Session
+
+
+class FakeCache:
+    """Legacy DynamicCache layout: per-layer key/value tensors of shape (batch, heads, seq, dim)."""
+
+    def __init__(self, token_ids):
+        positions = torch.tensor(token_ids, dtype=torch.float32).view(1, 1, -1, 1)
+        self.key_cache = [positions.clone()]
+        self.value_cache = [positions.clone()]
+
+
+def test_trim_keeps_the_instruction_turn():
+    # 2 system tokens, then turns of 3 tokens each; token ids equal positions.
+    session = Session("s", entry=None)
+    session.prefix_len = 2
+    session.turns = [[2 + 3 * i, 5 + 3 * i] for i in range(10)]
+    session.seq_len = 32
+    session.cache = FakeCache(list(range(32)))
+    instruction = list(range(2, 5))
+
+    session.trim(3)
+
+    kept = session.cache.key_cache[0].view(-1).long().tolist()
+    assert kept[:2] == [0, 1]
+    assert kept[2:5] == instruction
+    assert len(session.turns) == 3
+    assert session.turns[0] == [2, 5]
+    # The latest turn survives and spans are contiguous after the cut.
+    assert kept[session.turns[-1][0]:session.turns[-1][1]] == [29, 30, 31]
+    assert session.turns[1][0] == session.turns[0][1]
+    assert session.seq_len == len(kept) == 11
+
+
+def test_trim_always_keeps_first_and_latest_turn():
+    session = Session("s", entry=None)
+    session.turns = [[0, 2], [2, 4], [4, 6]]
+    session.seq_len = 6
+    session.cache = FakeCache(list(range(6)))
+
+    session.trim(1)
+
+    assert session.cache.key_cache[0].view(-1).long().tolist() == [0, 1, 4, 5]
+    assert session.turns == [[0, 2], [2, 4]]
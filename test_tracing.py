@@ -0,0 +1,43 @@
+"""
+Checks for tracing.StepTrace and the trace summarizer.
+
+    python -m pytest test_tracing.py
+"""
+
+import json
+import os
+import tempfile
+
+from tracing import StepTrace, summarize
+
+
+def test_stages_without_an_offset_store_plain_seconds():
+    trace = StepTrace(1)
+    with trace.stage("capture"):
+        pass
+    trace.add("server", 0.25)
+    offset, seconds = trace.record["stages"]["capture"]
+    assert offset >= 0 and seconds >= 0
+    assert trace.record["stages"]["server"] == 0.25
+
+
+def test_summarize_reads_every_stage_format():
+    records = [
+        {"step": 1, "stages": {"capture": [0.0, 0.01], "server": 0.2}},
+        # Traces written before client-reported stages dropped their null offset.
+        {"step": 2, "stages": {"capture": [0.0, 0.03], "server": [None, 0.4]}},
+    ]
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "trace.jsonl")
+        with open(path, "w") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        summary = summarize([path])
+    assert summary["steps"] == 2
+    assert summary["stages"]["capture"]["count"] == 2
+    assert abs(summary["stages"]["server"]["mean"] - 0.3) < 1e-9
+
+
+if __name__ == "__main__":
+    test_stages_without_an_offset_store_plain_seconds()
+    test_summarize_reads_every_stage_format()
+    print("ok")
@@ -0,0 +1,49 @@
+"""
+Checks for vision_cache.VisionFeatureCache with stand-in vision towers.
+
+    python -m pytest test_vision_cache.py
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from vision_cache import VisionFeatureCache
+
+GRID = torch.tensor([[1, 4, 4]])  # 16 patches, 4 embeddings after 2x2 merging
+
+
+class FakeTower:
+    spatial_merge_size = 2
+
+    def __init__(self, hidden_size: int):
+        self.hidden_size = hidden_size
+        self.calls = 0
+
+    def forward(self, hidden_states, grid_thw=None, **kwargs):
+        self.calls += 1
+        return torch.full((hidden_states.shape[0] // 4, self.hidden_size), float(self.hidden_size))
+
+
+def encode(cache, tower, key):
+    with cache.images([key]):
+        return tower.forward(torch.zeros(16, 8), grid_thw=GRID)
+
+
+def test_models_never_share_features_for_the_same_image():
+    cache = VisionFeatureCache(max_bytes=1 << 20)
+    small, large = FakeTower(1536), FakeTower(3584)
+    cache.install(small, namespace="Qwen/Qwen2-VL-2B-Instruct")
+    cache.install(large, namespace="Qwen/Qwen2-VL-7B-Instruct")
+
+    assert encode(cache, small, "frame").shape == (4, 1536)
+    # Same image key, other model: encoded by its own tower, not served from the first.
+    assert encode(cache, large, "frame").shape == (4, 3584)
+    assert encode(cache, small, "frame").shape == (4, 1536)
+    assert (small.calls, large.calls) == (1, 1)
+    assert cache.stats()["hits"] == 1
+
+
+if __name__ == "__main__":
+    test_models_never_share_features_for_the_same_image()
+    print("ok")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Structured per-step traces of the agent loop.
+
+Each step becomes one JSON line: its monotonic start time, the offset and
+duration of every loop stage (capture, reason, parse, act), the duration of
+each part of the VLM call the client measured (queue, encode, upload,
+server or generate), frame and response sizes, the parsed action and whether the fallback
+parse fired. TraceWriter hands records to a background thread through a
+bounded queue, so writing never blocks the loop; when the queue is full
+the record is dropped and counted. Files rotate by size like logging's
+RotatingFileHandler (trace.jsonl, trace.jsonl.1, ...).
+
+Summarize one or more traces (rotated files included) with:
+    python tracing.py traces/agent.jsonl
+"""
+
+import argparse
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TraceWriter:
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backups: int = 3, max_pending: int = 10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a")
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, record: dict):
+        """Queues a record for writing; never blocks."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            lines = [record]
+            # Write whatever else is already waiting in one go.
+            while True:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._queue.put(None)
+                    break
+                lines.append(record)
+            self._file.write("".join(json.dumps(line, separators=(",", ":")) + "\n" for line in lines))
+            self._file.flush()
+            self.written += len(lines)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        self._file.close()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a")
+
+
+class StepTrace:
+    """
+    Builds one step's record. A stage timed here is stored as [offset from the
+    step start, seconds]; one reported by someone else (the VLM client) has no
+    known offset and is stored as plain seconds.
+    """
+
+    def __init__(self, step: int, **fields):
+        self.start = time.monotonic()
+        self.record = {"step": step, "t": round(self.start, 6), "wall": round(time.time(), 3), "stages": {}, **fields}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start, start)
+
+    def add(self, name: str, seconds: float, start: float = None):
+        if start is None:
+            self.record["stages"][name] = round(seconds, 6)
+        else:
+            self.record["stages"][name] = [round(start - self.start, 6), round(seconds, 6)]
+
+    def set(self, **fields):
+        self.record.update(fields)
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of sorted `values`."""
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def summarize(paths: list) -> dict:
+    durations = {}
+    steps = fallbacks = 0
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by a crash
+                steps += 1
+                fallbacks += bool(record.get("parse_fallback"))
+                for name, stage in record.get("stages", {}).items():
+                    seconds = stage[1] if isinstance(stage, list) else stage
+                    if seconds is not None:
+                        durations.setdefault(name, []).append(seconds)
+
+    stages = {}
+    for name, values in durations.items():
+        values.sort()
+        stages[name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+        }
+    return {"steps": steps, "parse_fallbacks": fallbacks, "stages": stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles of agent traces")
+    parser.add_argument("paths", nargs="+", help="trace files; rotated siblings (.1, .2, ...) are included")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.paths:
+        paths += sorted(glob.glob(glob.escape(path) + ".*"), reverse=True) + [path]
+    paths = [path for path in paths if os.path.isfile(path)]
+    if not paths:
+        print("No trace files found")
+        sys.exit(1)
+
+    summary = summarize(paths)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"{summary['steps']} steps from {len(paths)} file(s), {summary['parse_fallbacks']} fallback parses")
+    print(f"{'Stage':<14} {'Count':>7} {'Mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["mean"]):
+        print(f"{name:<14} {stage['count']:>7} {stage['mean'] * 1000:>9.1f} {stage['p50'] * 1000:>9.1f} "
+              f"{stage['p95'] * 1000:>9.1f} {stage['p99'] * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
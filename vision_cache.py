@@ -0,0 +1,182 @@
+"""
+In-memory cache of Qwen2-VL vision encoder outputs, keyed by image content.
+
+The cache wraps each model's vision tower. Before generating, the caller tags
+the images of the request with content keys; when a tower is invoked during
+prefill, images already in the cache are served from memory and only the
+remaining ones go through the encoder. Entries are namespaced per tower, so
+models with different hidden sizes never share features.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+# Upload-hash -> pixel-key aliases are tiny, but still bounded.
+MAX_ALIASES = 4096
+
+
+class VisionFeatureCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self._entries = OrderedDict()  # (namespace, key) -> (embeds, grid, compute_seconds)
+        self._aliases = OrderedDict()  # sha1(upload bytes + budget) -> key
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def image_key(self, contents: bytes, pil_image, budget) -> str:
+        """
+        Returns the cache key for a decoded upload.
+        Identical upload bytes resolve through an alias without rehashing pixels;
+        otherwise the key is a hash of the decoded pixels, so re-encoded copies
+        of the same frame still match.
+        """
+        budget_tag = repr(budget).encode()
+        byte_key = hashlib.sha1(contents + budget_tag).hexdigest()
+        with self._lock:
+            key = self._aliases.get(byte_key)
+            if key is not None:
+                self._aliases.move_to_end(byte_key)
+                return key
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(budget_tag)
+        digest.update(repr(pil_image.size).encode())
+        digest.update(pil_image.tobytes())
+        key = digest.hexdigest()
+
+        with self._lock:
+            self._aliases[byte_key] = key
+            while len(self._aliases) > MAX_ALIASES:
+                self._aliases.popitem(last=False)
+        return key
+
+    @contextmanager
+    def images(self, keys):
+        """
+        Tags the images of the next vision tower call with `keys` (one per image,
+        in prompt order). Yields a dict that receives this call's hit/miss counts.
+        """
+        lookup = {"hits": 0, "misses": 0}
+        self._local.keys = list(keys)
+        self._local.lookup = lookup
+        self._local.used = set()
+        try:
+            yield lookup
+        finally:
+            self._local.keys = None
+            self._local.lookup = None
+            self._local.used = None
+
+    def install(self, visual, namespace: str):
+        """Wraps the vision tower's forward so cached images skip the encoder."""
+        original_forward = visual.forward
+        merge_area = getattr(visual, "spatial_merge_size", 2) ** 2
+
+        def forward(hidden_states, grid_thw=None, **kwargs):
+            keys = getattr(self._local, "keys", None)
+            used = getattr(self._local, "used", None)
+            # Keys apply to each tower's first call only (images); video calls
+            # pass through. A draft model's tower gets its own first call.
+            if not keys or namespace in used or grid_thw is None or len(keys) != len(grid_thw):
+                return original_forward(hidden_states, grid_thw=grid_thw, **kwargs)
+            used.add(namespace)
+            namespaced = [(namespace, key) for key in keys]
+            return self._cached_forward(original_forward, merge_area, hidden_states, grid_thw, namespaced, kwargs)
+
+        visual.forward = forward
+
+    def _cached_forward(self, original_forward, merge_area, hidden_states, grid_thw, keys, kwargs):
+        patch_counts = grid_thw.prod(dim=-1).tolist()
+        offsets = [0]
+        for count in patch_counts:
+            offsets.append(offsets[-1] + count)
+
+        outputs = [self._lookup(key, grid_thw[i]) for i, key in enumerate(keys)]
+
+        # Encode each missing image once, even if it appears several times in the call.
+        first_index = {}
+        for i, key in enumerate(keys):
+            if outputs[i] is None and key not in first_index:
+                first_index[key] = i
+
+        if first_index:
+            missing = list(first_index.values())
+            pixels = torch.cat([hidden_states[offsets[i]:offsets[i + 1]] for i in missing])
+            start = time.perf_counter()
+            embeds = original_forward(pixels, grid_thw=grid_thw[missing], **kwargs)
+            if embeds.is_cuda:
+                torch.cuda.synchronize(embeds.device)
+            elapsed = time.perf_counter() - start
+
+            missing_patches = sum(patch_counts[i] for i in missing)
+            split_sizes = [patch_counts[i] // merge_area for i in missing]
+            encoded = {}
+            for i, image_embeds in zip(missing, torch.split(embeds, split_sizes)):
+                share = elapsed * patch_counts[i] / missing_patches
+                encoded[keys[i]] = (image_embeds, share)
+                self.put(keys[i], image_embeds, grid_thw[i], share)
+
+        saved = 0.0
+        for i, key in enumerate(keys):
+            if outputs[i] is None:
+                image_embeds, share = encoded[key]
+                outputs[i] = (image_embeds, 0.0 if first_index.get(key) == i else share)
+            saved += outputs[i][1]
+
+        misses = len(first_index)
+        with self._lock:
+            self.hits += len(keys) - misses
+            self.misses += misses
+            self.seconds_saved += saved
+        lookup = self._local.lookup
+        if lookup is not None:
+            lookup["hits"] += len(keys) - misses
+            lookup["misses"] += misses
+
+        return torch.cat([image_embeds for image_embeds, _ in outputs])
+
+    def _lookup(self, key, grid):
+        """Returns (embeds, compute_seconds) for a cached image, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not torch.equal(entry[1], grid.cpu()):
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[2]
+
+    def put(self, key, embeds, grid, compute_seconds: float):
+        embeds = embeds.detach()
+        size = embeds.element_size() * embeds.nelement()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[0].element_size() * old[0].nelement()
+            self._entries[key] = (embeds, grid.cpu(), compute_seconds)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.element_size() * evicted.nelement()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "encoder_seconds_saved": round(self.seconds_saved, 4),
+            }